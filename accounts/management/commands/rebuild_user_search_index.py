@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from accounts.models import CustomUser, UserSearchGram
+from accounts.search import SEARCH_FIELDS, ngrams
+
+
+class Command(BaseCommand):
+    help = '社員検索用の n-gram 索引を全社員分作り直します（初回導入時や一括更新の後に実行してください）。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='1トランザクションで処理する社員数')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        last_pk = 0
+        total = 0
+
+        while True:
+            users = list(
+                CustomUser.objects.filter(pk__gt=last_pk).order_by('pk').only('pk', *SEARCH_FIELDS)[:chunk_size]
+            )
+            if not users:
+                break
+            last_pk = users[-1].pk
+
+            with transaction.atomic():
+                UserSearchGram.objects.filter(user__in=users).delete()
+                UserSearchGram.objects.bulk_create([
+                    UserSearchGram(user=user, field=field, gram=gram)
+                    for user in users
+                    for field in SEARCH_FIELDS
+                    for gram in ngrams(getattr(user, field))
+                ])
+            total += len(users)
+
+        self.stdout.write(self.style.SUCCESS(f'{total} 人分の検索索引を作成しました。'))
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:25
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_alter_customuser_department_alter_department_manager_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchGram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(max_length=20, verbose_name='項目')),
+                ('gram', models.CharField(max_length=2, verbose_name='文字列')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_grams', to=settings.AUTH_USER_MODEL, verbose_name='社員')),
+            ],
+            options={
+                'verbose_name': '社員検索索引',
+                'verbose_name_plural': '社員検索索引',
+                'indexes': [models.Index(fields=['gram', 'field', 'user'], name='accounts_search_gram_idx')],
+            },
+        ),
+    ]
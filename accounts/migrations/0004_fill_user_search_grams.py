@@ -0,0 +1,41 @@
+import unicodedata
+from django.db import migrations
+
+SEARCH_FIELDS = ('full_name', 'username', 'employee_number')
+
+
+def ngrams(text):
+    # accounts.search.ngrams と同じ（後から変更されても移行の結果が変わらないよう複製している）
+    text = ''.join(unicodedata.normalize('NFKC', text or '').casefold().split())
+    return set(text) | {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def fill_search_grams(apps, schema_editor):
+    # 索引の導入前に登録済みの社員の索引を作る
+    CustomUser = apps.get_model('accounts', 'CustomUser')
+    UserSearchGram = apps.get_model('accounts', 'UserSearchGram')
+    indexed = set(UserSearchGram.objects.values_list('user_id', flat=True).distinct())
+    grams = []
+    for user in CustomUser.objects.only('pk', *SEARCH_FIELDS).iterator(chunk_size=1000):
+        if user.pk in indexed:
+            continue
+        grams.extend(
+            UserSearchGram(user_id=user.pk, field=field, gram=gram)
+            for field in SEARCH_FIELDS
+            for gram in ngrams(getattr(user, field))
+        )
+        if len(grams) >= 10000:
+            UserSearchGram.objects.bulk_create(grams, batch_size=1000)
+            grams = []
+    UserSearchGram.objects.bulk_create(grams, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_usersearchgram'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_search_grams, migrations.RunPython.noop),
+    ]
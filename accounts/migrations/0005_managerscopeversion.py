@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_fill_user_search_grams'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ManagerScopeVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveBigIntegerField(default=1, verbose_name='世代番号')),
+            ],
+            options={
+                'verbose_name': '管理範囲の世代番号',
+                'verbose_name_plural': '管理範囲の世代番号',
+            },
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.contrib.auth.mixins import UserPassesTestMixin, LoginRequiredMixin
+from django.contrib.auth.views import redirect_to_login
 from django.contrib import messages
 from django.shortcuts import redirect
+from notifications.counters import aunread_notification_count
 
 class EmployeeOnlyMixin(LoginRequiredMixin, UserPassesTestMixin):
     def test_func(self):
@@ -32,4 +34,29 @@ class EmployeeOrHrMixin(LoginRequiredMixin, UserPassesTestMixin):
     
     def handle_no_permission(self):
         messages.error(self.request, 'このページにアクセスする権限がありません。')
-        return redirect('attendance:index')
\ No newline at end of file
+        return redirect('attendance:index')
+
+class AsyncLoginRequiredMixin:
+    """
+    非同期ビュー用の LoginRequiredMixin。
+    ログインユーザーと共通テンプレートの未読通知件数を非同期に読み込み、描画中に同期クエリが発生しないようにする。
+    """
+    async def dispatch(self, request, *args, **kwargs):
+        request.user = await request.auser()
+        if not request.user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        if not self.test_func():
+            return self.handle_no_permission()
+        request.unread_notification_count = await aunread_notification_count(request.user.pk)
+        return await super().dispatch(request, *args, **kwargs)
+
+    def test_func(self):
+        return True
+
+class AsyncHrOnlyMixin(AsyncLoginRequiredMixin):
+    test_func = HrOnlyMixin.test_func
+    handle_no_permission = HrOnlyMixin.handle_no_permission
+
+class AsyncManagerOnlyMixin(AsyncLoginRequiredMixin):
+    test_func = ManagerOnlyMixin.test_func
+    handle_no_permission = ManagerOnlyMixin.handle_no_permission
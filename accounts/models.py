@@ -72,6 +72,19 @@ class CustomUser(AbstractUser):
     def __str__(self):
         return f'{self.full_name} ({self.employee_number})'
 
+    # 上司の管理範囲（accounts.scope）に影響する項目
+    SCOPE_FIELDS = ('department_id', 'team_id', 'role')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_scope = instance._scope_values()
+        return instance
+
+    def _scope_values(self):
+        # 遅延読込の項目を読みに行かないよう __dict__ から取得する
+        return tuple(self.__dict__.get(field) for field in self.SCOPE_FIELDS)
+
     @property
     def is_employee(self):
         return self.role == 'employee'
@@ -90,3 +103,53 @@ class CustomUser(AbstractUser):
         else:
             self.is_staff = False
         super().save(*args, **kwargs)
+
+        # 氏名・ユーザー名・社員番号が変わり得る保存のときだけ検索索引を更新する
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or set(update_fields) & {'full_name', 'username', 'employee_number'}:
+            from .search import index_user
+            index_user(self)
+
+        # 所属・役割が実際に変わったときだけ上司の管理範囲のキャッシュを無効にする
+        if update_fields is None or set(update_fields) & {'department', 'team', 'role'}:
+            if self._scope_values() != getattr(self, '_loaded_scope', None):
+                from .scope import invalidate_manager_scopes
+                invalidate_manager_scopes()
+            self._loaded_scope = self._scope_values()
+
+class UserSearchGram(models.Model):
+    """
+    社員検索用の n-gram 索引（氏名・ユーザー名・社員番号）。
+    CustomUser.save() で更新するため、bulk_create / bulk_update / QuerySet.update で社員を登録・変更した場合は
+    索引が更新されない。一括で登録・変更した後は rebuild_user_search_index コマンドで作り直すこと。
+    """
+    user = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name='search_grams',
+        verbose_name='社員',
+    )
+    field = models.CharField(max_length=20, verbose_name='項目')
+    gram = models.CharField(max_length=2, verbose_name='文字列')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['gram', 'field', 'user'], name='accounts_search_gram_idx'),
+        ]
+        verbose_name = '社員検索索引'
+        verbose_name_plural = '社員検索索引'
+
+    def __str__(self):
+        return f'{self.user_id} {self.field}: {self.gram}'
+
+
+class ManagerScopeVersion(models.Model):
+    """
+    上司の管理範囲（accounts.scope）のキャッシュの世代番号（1行だけ）。
+    組織を変更したトランザクションの中で上げるため、コミット後に読んだプロセスはすべて新しい世代を使う。
+    """
+    version = models.PositiveBigIntegerField(default=1, verbose_name='世代番号')
+
+    class Meta:
+        verbose_name = '管理範囲の世代番号'
+        verbose_name_plural = '管理範囲の世代番号'
@@ -0,0 +1,69 @@
+from django.core.cache import cache
+from django.db.models import F, Q
+from .models import CustomUser, ManagerScopeVersion
+
+# 無効化が漏れた場合（queryset.update など）でも古い範囲を使い続けないための上限（秒）
+SCOPE_CACHE_TIMEOUT = 60 * 10
+
+
+class ManagerScope:
+    """上司が管理する部署・課と、そこに所属する部下の社員ID"""
+
+    def __init__(self, department_ids, team_ids, user_ids):
+        self.department_ids = frozenset(department_ids)
+        self.team_ids = frozenset(team_ids)
+        self.user_ids = frozenset(user_ids)
+
+    def __contains__(self, user_id):
+        return user_id in self.user_ids
+
+
+def _scope_version():
+    # 組織（部署・課の上司、社員の所属）が変わるたびに上がる世代番号。
+    # キャッシュに置くとプロセス・キャッシュの消去でずれるため、データベースの1行から読む
+    return ManagerScopeVersion.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+
+def scope_cache_key(manager_id):
+    return f'accounts:scope:{_scope_version()}:{manager_id}'
+
+
+def resolve_manager_scope(manager):
+    """部署・課から部下の社員IDを求める（キャッシュを使わない）"""
+    department_ids = set(manager.manage_departments.values_list('pk', flat=True))
+    team_ids = set(manager.manage_teams.values_list('pk', flat=True))
+    user_ids = set(
+        CustomUser.objects.filter(
+            Q(department_id__in=department_ids) | Q(team_id__in=team_ids),
+        ).exclude(pk=manager.pk).values_list('pk', flat=True)
+    ) if department_ids or team_ids else set()
+    return ManagerScope(department_ids, team_ids, user_ids)
+
+
+def get_manager_scope(manager):
+    """
+    上司の管理範囲を返す。
+    組織の世代番号ごとにキャッシュし、同じリクエスト内ではユーザーオブジェクトに保持して再利用する。
+    """
+    scope = getattr(manager, '_manager_scope', None)
+    if scope is not None:
+        return scope
+
+    key = scope_cache_key(manager.pk)
+    cached = cache.get(key)
+    if cached is None:
+        scope = resolve_manager_scope(manager)
+        cache.set(key, (scope.department_ids, scope.team_ids, scope.user_ids), SCOPE_CACHE_TIMEOUT)
+    else:
+        scope = ManagerScope(*cached)
+    manager._manager_scope = scope
+    return scope
+
+
+def invalidate_manager_scopes():
+    """
+    すべての上司の管理範囲のキャッシュを無効にする。
+    変更と同じトランザクションで世代番号を上げ、コミットと同時に新しい世代へ切り替わるようにする。
+    """
+    if not ManagerScopeVersion.objects.filter(pk=1).update(version=F('version') + 1):
+        ManagerScopeVersion.objects.get_or_create(pk=1, defaults={'version': 1})
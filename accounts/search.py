@@ -0,0 +1,60 @@
+import unicodedata
+from django.db.models import Count
+from .models import CustomUser, UserSearchGram
+
+# 検索索引の対象項目
+SEARCH_FIELDS = ('full_name', 'username', 'employee_number')
+
+
+def normalize(text):
+    """全角・半角と大文字・小文字の違い、空白を無視して比較できる形にする"""
+    text = unicodedata.normalize('NFKC', text or '').casefold()
+    return ''.join(text.split())
+
+
+def ngrams(text):
+    """1文字と2文字（バイグラム）の部分文字列の集合"""
+    text = normalize(text)
+    return set(text) | {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def query_grams(term):
+    """検索語に含まれるべき gram（2文字以上ならバイグラム、1文字ならその文字）"""
+    if len(term) < 2:
+        return {term}
+    return {term[i:i + 2] for i in range(len(term) - 1)}
+
+
+def index_user(user):
+    """社員1人分の検索索引を作り直す（bulk_create などで save() を通さない登録・変更では呼ばれない）"""
+    UserSearchGram.objects.filter(user=user).delete()
+    UserSearchGram.objects.bulk_create([
+        UserSearchGram(user=user, field=field, gram=gram)
+        for field in SEARCH_FIELDS
+        for gram in ngrams(getattr(user, field))
+    ])
+
+
+def search_user_ids(q, fields=SEARCH_FIELDS):
+    """
+    部分一致する社員のIDの集合を返す。
+    gram の索引で候補を絞り込んでから、候補の社員だけを実際の文字列で確認する。
+    """
+    term = normalize(q)
+    if not term:
+        return set()
+
+    grams = query_grams(term)
+    candidates = UserSearchGram.objects.filter(
+        field__in=fields,
+        gram__in=grams,
+    ).values('user_id', 'field').annotate(
+        matched=Count('gram', distinct=True),
+    ).filter(matched=len(grams)).values_list('user_id', flat=True)
+
+    # バイグラムがすべて含まれていても連続しているとは限らないため確認する
+    return {
+        user['pk']
+        for user in CustomUser.objects.filter(pk__in=set(candidates)).values('pk', *fields)
+        if any(term in normalize(user[field]) for field in fields)
+    }
@@ -0,0 +1,14 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import CustomUser, Department, Team
+from .scope import invalidate_manager_scopes
+
+
+@receiver(post_save, sender=Department)
+@receiver(post_save, sender=Team)
+@receiver(post_delete, sender=Department)
+@receiver(post_delete, sender=Team)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_scopes_on_change(sender, **kwargs):
+    """部署・課の上司の変更や削除、社員の削除で上司の管理範囲が変わるため無効にする"""
+    invalidate_manager_scopes()
@@ -1,3 +1,149 @@
-from django.test import TestCase
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.shortcuts import resolve_url
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from attendance.services import punch
+from notifications.models import Notification
+from notifications.utils import create_notifications, mark_inbox_read
+from .models import CustomUser, Department, ManagerScopeVersion, UserSearchGram
+from .scope import get_manager_scope, scope_cache_key
+from .search import search_user_ids
 
-# Create your tests here.
+
+class UserSearchTests(TestCase):
+    """社員検索の n-gram 索引"""
+
+    def test_search_by_partial_name_and_number(self):
+        user = CustomUser.objects.create_user(username='yamada', employee_number='E0012', full_name='山田 太郎')
+        CustomUser.objects.create_user(username='tanaka', employee_number='E0021', full_name='田中 花子')
+        self.assertEqual(search_user_ids('田太'), {user.pk})
+        self.assertEqual(search_user_ids('ｅ００１'), {user.pk})
+        self.assertEqual(search_user_ids('太田'), set())
+
+    def test_bulk_created_users_are_not_indexed(self):
+        # bulk_create は save() を通らないため、rebuild_user_search_index で作り直す
+        CustomUser.objects.bulk_create([CustomUser(username='sato', employee_number='E0031', full_name='佐藤 一郎')])
+        self.assertEqual(search_user_ids('佐藤'), set())
+
+
+class ManagerScopeTests(TestCase):
+    """上司の管理範囲のキャッシュ"""
+
+    def setUp(self):
+        cache.clear()
+        self.manager = CustomUser.objects.create_user(
+            username='manager', employee_number='M0001', full_name='上司 太郎', role='manager',
+        )
+        self.department = Department.objects.create(name='開発部', manager=self.manager)
+        self.employee = CustomUser.objects.create_user(username='employee', employee_number='E0001', full_name='社員 太郎')
+
+    def scope_user_ids(self):
+        # リクエストごとにユーザーを読み直す場合と同じく、ユーザーオブジェクトの保持を使わない
+        return get_manager_scope(CustomUser.objects.get(pk=self.manager.pk)).user_ids
+
+    def test_scope_follows_organization_changes(self):
+        self.assertEqual(self.scope_user_ids(), set())
+        self.employee.department = self.department
+        self.employee.save()
+        self.assertEqual(self.scope_user_ids(), {self.employee.pk})
+
+        self.department.manager = None
+        self.department.save()
+        self.assertEqual(self.scope_user_ids(), set())
+
+    def test_version_is_kept_in_database(self):
+        self.employee.department = self.department
+        self.employee.save()
+        version = ManagerScopeVersion.objects.get().version
+        self.assertEqual(self.scope_user_ids(), {self.employee.pk})
+
+        # キャッシュが消えても世代番号は戻らず、古い世代のキャッシュを使わない
+        cache.clear()
+        cache.set(scope_cache_key(self.manager.pk).replace(f':{version}:', f':{version - 1}:'), (set(), set(), set()))
+        self.assertEqual(ManagerScopeVersion.objects.get().version, version)
+        self.assertEqual(self.scope_user_ids(), {self.employee.pk})
+
+
+class AsyncViewTests(TestCase):
+    """非同期ビュー（AsyncLoginRequiredMixin）のログイン確認と、同期版と同じ表示内容"""
+
+    def setUp(self):
+        cache.clear()
+        self.employee = CustomUser.objects.create_user(
+            username='employee', password='password', employee_number='E0001', full_name='社員 太郎',
+        )
+        self.sender = CustomUser.objects.create_user(username='sender', employee_number='E0002', full_name='送信 花子')
+
+    def test_anonymous_is_redirected_to_login(self):
+        login_url = resolve_url(settings.LOGIN_URL)
+        names = ('attendance:dashboard_async', 'notifications:notification_list_async', 'notifications:notification_stream')
+        for name in names:
+            url = reverse(name)
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertRedirects(response, f'{login_url}?next={url}', fetch_redirect_response=False)
+
+    def test_permission_is_checked_after_login(self):
+        self.client.login(username='employee', password='password')
+        response = self.client.get(reverse('attendance:manager_roster_stream'))
+        self.assertRedirects(response, reverse('attendance:index'), fetch_redirect_response=False)
+
+    def test_dashboard_matches_sync_view(self):
+        punch(self.employee, 'clock_in')
+        self.client.login(username='employee', password='password')
+        sync = self.client.get(reverse('attendance:dashboard')).context
+        asynchronous = self.client.get(reverse('attendance:dashboard_async')).context
+        self.assertEqual(asynchronous['record'].pk, sync['record'].pk)
+        self.assertEqual(asynchronous['record'].clock_in, sync['record'].clock_in)
+        self.assertEqual(asynchronous['unread_notification_count'], sync['unread_notification_count'])
+        self.assertTrue(asynchronous['punch_token'])
+
+    def test_notification_list_matches_sync_view(self):
+        for index in range(25):
+            create_notifications(self.sender, {self.employee.pk: f'通知 {index}'}, '/')
+        mark_inbox_read(self.employee, list(Notification.objects.values_list('pk', flat=True)[:5]))
+        self.client.login(username='employee', password='password')
+        for params in ({}, {'status': 'unread'}, {'status': 'read'}):
+            with self.subTest(params=params):
+                sync = self.client.get(reverse('notifications:notification_list'), params).context
+                asynchronous = self.client.get(reverse('notifications:notification_list_async'), params).context
+                self.assertEqual(
+                    [notification.pk for notification in asynchronous['object_list']],
+                    [notification.pk for notification in sync['object_list']],
+                )
+                for key in ('selected_status', 'status_query', 'unread_notification_count'):
+                    self.assertEqual(asynchronous[key], sync[key])
+                self.assertEqual(asynchronous['cursor_page'].next_cursor, sync['cursor_page'].next_cursor)
+
+                # 次のページも同じ
+                cursor = {**params, 'cursor': sync['cursor_page'].next_cursor}
+                self.assertEqual(
+                    self.page_ids('notifications:notification_list_async', cursor),
+                    self.page_ids('notifications:notification_list', cursor),
+                )
+
+    def page_ids(self, name, params):
+        return [notification.pk for notification in self.client.get(reverse(name), params).context['object_list']]
+
+class SearchIndexMigrationTests(TransactionTestCase):
+    """索引の導入前に登録済みの社員を移行で索引に加える"""
+    migrate_from = [('accounts', '0003_usersearchgram')]
+
+    def test_existing_users_are_indexed(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        apps = executor.loader.project_state(self.migrate_from).apps
+        user = apps.get_model('accounts', 'CustomUser').objects.create(
+            username='yamada', employee_number='E0012', full_name='山田 太郎',
+        )
+        self.assertFalse(apps.get_model('accounts', 'UserSearchGram').objects.exists())
+
+        # 0004 の移行と、巻き戻した他のアプリの移行を最新まで適用する
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+        self.assertTrue(UserSearchGram.objects.filter(user_id=user.pk, gram='山田').exists())
+        self.assertEqual(search_user_ids('田太'), {user.pk})
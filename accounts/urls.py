@@ -21,6 +21,8 @@ urlpatterns = [
     path('signup/', views.SignUpView.as_view(), name='signup'),
     path('hr-signup/', views.HrSignUpView.as_view(), name='hr_signup'),
     path('profiles/', views.CustomUserListView.as_view(), name='profile_list'),
+    # ASGI で運用する場合の非同期版
+    path('profiles/async/', views.AsyncCustomUserListView.as_view(), name='profile_list_async'),
     path('profile/<int:pk>/approve/', views.UserApproveView.as_view(), name='user_approve'),
     path('profile/<int:pk>/detail/', views.CustomUserDetailView.as_view(), name='profile_detail'),
     path('profile/<int:pk>/update/', views.CustomUserUpdateView.as_view(), name='profile_update'),
@@ -2,10 +2,14 @@ from django.views.generic import ListView, CreateView, UpdateView, DeleteView, D
 from django.contrib.auth.views import LoginView, PasswordChangeView, PasswordChangeDoneView
 from django.urls import reverse_lazy, reverse
 from django.db.models import Q
-from django.shortcuts import get_object_or_404, redirect
+from django.shortcuts import get_object_or_404, redirect, render
+from django.core.paginator import InvalidPage, Paginator
+from django.http import Http404
+from asgiref.sync import sync_to_async
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
-from .mixins import HrOnlyMixin
+from .mixins import AsyncHrOnlyMixin, HrOnlyMixin
+from .search import search_user_ids
 from .models import Department, Team, CustomUser
 from .forms import (
     CustomAuthenticationForm, DepartmentForm, TeamForm, HrCustomUserCreateForm,
@@ -16,6 +20,7 @@ from .forms import (
 class DepartmentListView(HrOnlyMixin, ListView):
     model = Department
     template_name = 'accounts/department_list.html'
+    use_read_replica = True
 
     def get_queryset(self):
         return Department.objects.order_by('pk')
@@ -41,6 +46,7 @@ class DepartmentDeleteView(HrOnlyMixin, DeleteView):
 class TeamListView(HrOnlyMixin, ListView):
     model = Team
     template_name = 'accounts/team_list.html'
+    use_read_replica = True
 
     def get_queryset(self):
         return Team.objects.order_by('pk')
@@ -82,54 +88,92 @@ class CustomUserLoginView(LoginView):
     form_class = CustomAuthenticationForm
     template_name = 'accounts/login.html'
 
+def filter_profiles(params):
+    """社員一覧の絞り込み（同期・非同期のビューで共通）"""
+    queryset = CustomUser.objects.select_related('department', 'team').order_by('pk')
+    q = params.get('q')
+    if q:
+        queryset = queryset.filter(pk__in=search_user_ids(q, ('username', 'full_name')))
+    role = params.get('role')
+    if role:
+        queryset = queryset.filter(role=role)
+    
+    department_pk_param = params.get('department')
+    if department_pk_param:
+        try:
+            department_pk = int(department_pk_param)
+            queryset = queryset.filter(department=department_pk)
+        except ValueError:
+            pass
+    approval = params.get('approval')
+    if approval == 'approved':
+        queryset = queryset.filter(is_active=True)
+    elif approval == 'unapproved':
+        queryset = queryset.filter(is_active=False)
+    
+    return queryset
+
+def profile_filter_context(params):
+    context = {
+        'q': params.get('q', ''),
+        'role': params.get('role', ''),
+        'department': params.get('department', ''),
+        'approval': params.get('approval', ''),
+        'roles': CustomUser.ROLE_CHOICES,
+    }
+    query_params = params.copy()
+    if 'page' in query_params:
+        del query_params['page']
+    context['current_filters_query'] = f'&{query_params.urlencode()}' if query_params else ''
+    return context
+
 class CustomUserListView(HrOnlyMixin, ListView):
     model = CustomUser
     template_name = 'accounts/profile_list.html'
+    use_read_replica = True
     paginate_by = 10
 
     def get_queryset(self):
-        queryset = CustomUser.objects.select_related('department', 'team').order_by('pk')
-        q = self.request.GET.get('q')
-        if q:
-            queryset = queryset.filter(
-                Q(username__icontains=q) | Q(full_name__icontains=q)
-            )
-        role = self.request.GET.get('role')
-        if role:
-            queryset = queryset.filter(role=role)
-        
-        department_pk_param = self.request.GET.get('department')
-        if department_pk_param:
-            try:
-                department_pk = int(department_pk_param)
-                queryset = queryset.filter(department=department_pk)
-            except ValueError:
-                pass
-        approval = self.request.GET.get('approval')
-        if approval == 'approved':
-            queryset = queryset.filter(is_active=True)
-        elif approval == 'unapproved':
-            queryset = queryset.filter(is_active=False)
-        
-        return queryset
+        return filter_profiles(self.request.GET)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)      
-        context['q'] = self.request.GET.get('q', '')
-        context['role'] = self.request.GET.get('role', '')
-        context['department'] = self.request.GET.get('department', '')
-        context['approval'] = self.request.GET.get('approval', '')
-        context['roles'] = CustomUser.ROLE_CHOICES
+        context.update(profile_filter_context(self.request.GET))
         context['departments'] = Department.objects.order_by('pk')
         context['unapproved_count'] = CustomUser.objects.filter(is_active=False).count()
 
-        query_params = self.request.GET.copy()
-        if 'page' in query_params:
-            del query_params['page']
-        context['current_filters_query'] = f'&{query_params.urlencode()}' if query_params else ''
-
         return context
 
+class AsyncCustomUserListView(AsyncHrOnlyMixin, View):
+    """CustomUserListView の非同期版。件数・ページ・部署を非同期のORMで読む"""
+    template_name = CustomUserListView.template_name
+    paginate_by = CustomUserListView.paginate_by
+
+    async def get(self, request, *args, **kwargs):
+        # 氏名検索は検索索引を同期で引くため、絞り込みの組み立てだけスレッドで行う
+        queryset = await sync_to_async(filter_profiles)(request.GET)
+        paginator = Paginator(queryset, self.paginate_by)
+        paginator.count = await queryset.acount()
+        page_number = request.GET.get('page') or 1
+        if page_number == 'last':
+            page_number = paginator.num_pages
+        try:
+            page_obj = paginator.page(page_number)
+        except InvalidPage:
+            raise Http404('ページが見つかりません。')
+        page_obj.object_list = [user async for user in page_obj.object_list]
+
+        context = {
+            'paginator': paginator,
+            'page_obj': page_obj,
+            'is_paginated': page_obj.has_other_pages(),
+            'object_list': page_obj.object_list,
+            'departments': [department async for department in Department.objects.order_by('pk')],
+            'unapproved_count': await CustomUser.objects.filter(is_active=False).acount(),
+            **profile_filter_context(request.GET),
+        }
+        return render(request, self.template_name, context)
+
 """人事専用：社員アカウントを承認するビュー"""
 class UserApproveView(HrOnlyMixin, View):
     def post(self, request, *args, **kwargs):
@@ -147,6 +191,7 @@ class UserApproveView(HrOnlyMixin, View):
 class CustomUserDetailView(HrOnlyMixin, DetailView):
     model = CustomUser
     template_name = 'accounts/profile_detail.html'
+    use_read_replica = True
 
 class CustomUserUpdateView(HrOnlyMixin, UpdateView):
     model = CustomUser
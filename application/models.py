@@ -1,7 +1,56 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.utils import timezone
 
+
+def _touch_applicant_calendars(applicant_ids):
+    # 承認済みの申請はカレンダーに表示されるため、申請者のカレンダーの更新日時を進める
+    from attendance.calendar_feed import touch_calendars
+    touch_calendars(applicant_ids)
+
+
+class ApplicationQuerySet(models.QuerySet):
+    """save() / delete() を通らない一括の更新・削除でも、申請者のカレンダーの更新日時を進める"""
+
+    def _applicant_ids(self):
+        return set(self.order_by().values_list('applicant_id', flat=True).distinct())
+
+    def update(self, **kwargs):
+        with transaction.atomic(using=self.db):
+            applicant_ids = self._applicant_ids()
+            updated = super().update(**kwargs)
+            # 申請者を付け替えた場合は、付け替え先のカレンダーも進める
+            if 'applicant' in kwargs or 'applicant_id' in kwargs:
+                applicant = kwargs.get('applicant', kwargs.get('applicant_id'))
+                applicant_ids.add(getattr(applicant, 'pk', applicant))
+            if updated:
+                _touch_applicant_calendars(applicant_ids)
+        return updated
+
+    update.alters_data = True
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            applicant_ids = self._applicant_ids()
+            result = super().delete()
+            if result[0]:
+                _touch_applicant_calendars(applicant_ids)
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        with transaction.atomic(using=self.db):
+            objs = list(objs)
+            applicant_ids = self.filter(pk__in=[obj.pk for obj in objs])._applicant_ids()
+            updated = super().bulk_update(objs, fields, batch_size=batch_size)
+            _touch_applicant_calendars(applicant_ids | {obj.applicant_id for obj in objs})
+        return updated
+
+    bulk_update.alters_data = True
+
+
 class Application(models.Model):
     TYPE_CHOICES = [
         ('paid_leave', '有給休暇'),
@@ -52,13 +101,41 @@ class Application(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='申請日時')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='更新日時')
 
+    objects = ApplicationQuerySet.as_manager()
+
     class Meta:
         verbose_name = '各種申請'
         verbose_name_plural = '各種申請'
         ordering = ['-created_at']
+        indexes = [
+            # 人事・上司一覧のステータス絞り込み＋申請日時順の並び替え用
+            models.Index(fields=['status', 'created_at'], name='application_status_idx'),
+            # 社員本人の一覧（開始日時順）用
+            models.Index(fields=['applicant', 'start_datetime'], name='application_applicant_idx'),
+        ]
     
     def __str__(self):
         return f'{self.get_application_type_display()} - {self.applicant.full_name }（{self.get_status_display()}）'
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_applicant_id = instance.__dict__.get('applicant_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # 申請者を付け替えた場合は、付け替え前の社員のカレンダーも進める
+            _touch_applicant_calendars({self.applicant_id, getattr(self, '_loaded_applicant_id', None)})
+        self._loaded_applicant_id = self.applicant_id
+
+    def delete(self, *args, **kwargs):
+        applicant_id = self.applicant_id
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            _touch_applicant_calendars([applicant_id])
+        return result
     
     # 状態変更メソッド
     def approve_by_manager(self, user):
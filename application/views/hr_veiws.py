@@ -1,8 +1,10 @@
 from django.shortcuts import redirect
 from django.contrib import messages
+from django.db import transaction
 from django.views.generic import ListView, DetailView
 from datetime import date, timedelta
 from ..models import Application
+from accounts.search import search_user_ids
 from accounts.mixins import HrOnlyMixin
 from notifications.utils import create_notification
 
@@ -10,6 +12,7 @@ from notifications.utils import create_notification
 class HrApplicationListView(HrOnlyMixin, ListView):
     model = Application
     template_name = 'application/hr_application_list.html'
+    use_read_replica = True
     paginate_by = 10
 
     def get_queryset(self):
@@ -34,7 +37,7 @@ class HrApplicationListView(HrOnlyMixin, ListView):
             queryset = queryset.filter(application_type=type_param)
         
         if applicant_name_param:
-            queryset = queryset.filter(applicant__full_name__icontains=applicant_name_param)
+            queryset = queryset.filter(applicant_id__in=search_user_ids(applicant_name_param, ('full_name',)))
         
         if start_date_param:
             try:
@@ -72,6 +75,7 @@ class HrApplicationListView(HrOnlyMixin, ListView):
 class HrApplicationDetailView(HrOnlyMixin, DetailView):
     model = Application
     template_name = 'application/hr_application_detail.html'
+    use_read_replica = True
 
     def get_queryset(self):
         return Application.objects.filter(
@@ -82,6 +86,7 @@ class HrApplicationDetailView(HrOnlyMixin, DetailView):
             'hr_approver',
         )
     
+    @transaction.atomic
     def post(self, request, *args, **kwargs):
         self.object = self.get_object()
         user = request.user
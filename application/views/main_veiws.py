@@ -1,13 +1,14 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
+from django.db import transaction
 from django.utils import timezone
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
-from django.urls import reverse_lazy
+from django.urls import reverse, reverse_lazy
 from datetime import date, timedelta
 from ..models import Application
 from ..forms import ApplicationForm
-from notifications.utils import create_notification
+from notifications.utils import coalesce_notification
 
 class ApplicationCreateView(LoginRequiredMixin, CreateView):
     model = Application
@@ -15,23 +16,29 @@ class ApplicationCreateView(LoginRequiredMixin, CreateView):
     template_name = 'application/application_form.html'
     success_url = reverse_lazy('application:application_list')
 
+    # 申請と上司への通知を一緒に確定する
+    @transaction.atomic
     def form_valid(self, form):
         form.instance.applicant = self.request.user
         messages.success(self.request, '申請を送信しました。')
         response = super().form_valid(form)
 
-        create_notification(
+        # 部下が多い上司の通知一覧が申請で埋まらないよう、未読の間は申請種別ごとに1件にまとめる
+        type_display = self.object.get_application_type_display()
+        coalesce_notification(
             sender=self.request.user,
             recipient=self.request.user.department.manager,
-            message=f'{self.request.user.full_name}さんが{self.object.get_application_type_display()}の申請をしました。',
-            link_name='application:manager_application_detail',
-            pk=self.object.pk,
+            kind=f'application_submitted:{self.object.application_type}',
+            message=f'{self.request.user.full_name}さんが{type_display}の申請をしました。',
+            summary=f'{type_display}の申請が {{count}} 件届いています。',
+            link=reverse('application:manager_application_detail', kwargs={'pk': self.object.pk}),
         )
         return response
 
 class ApplicationListView(LoginRequiredMixin, ListView):
     model = Application
     template_name = 'application/application_list.html'
+    use_read_replica = True
     paginate_by = 10
 
     def get_queryset(self):
@@ -81,6 +88,7 @@ class ApplicationListView(LoginRequiredMixin, ListView):
 class ApplicationDetailView(LoginRequiredMixin, DetailView):
     model = Application
     template_name = 'application/application_detail.html'
+    use_read_replica = True
 
     def get_queryset(self):
         return Application.objects.filter(applicant=self.request.user).select_related('applicant')
@@ -1,31 +1,27 @@
 from django.shortcuts import redirect
 from django.contrib import messages
+from django.db import transaction
 from django.utils import timezone
 from django.views.generic import ListView, DetailView
 from django.urls import reverse_lazy
-from django.db.models import Q
 from datetime import date, timedelta
 from ..models import Application
+from accounts.search import search_user_ids
 from accounts.mixins import ManagerOnlyMixin
+from accounts.scope import get_manager_scope
 from notifications.utils import create_notification
 
 class MnagerApplicationListView(ManagerOnlyMixin, ListView):
     model = Application
     template_name = 'application/manager_application_list.html'
+    use_read_replica = True
     paginate_by = 10
 
     def get_queryset(self):
-        user = self.request.user
-        manage_departments = user.manage_departments.all()
-        manage_teams = user.manage_teams.all()
-        # 自身が管理する部署に所属するユーザー
-        q_department = Q(applicant__department__in=manage_departments)
-        # 自身が管理する課に所属するユーザー
-        q_team = Q(applicant__team__in=manage_teams)
+        # 自身が管理する部署・課に所属するユーザー（自分自身を除く）
+        scope = get_manager_scope(self.request.user)
         # クエリ取得
-        queryset = Application.objects.filter(q_department | q_team).exclude(
-            applicant=user,
-        ).select_related(
+        queryset = Application.objects.filter(applicant_id__in=scope.user_ids).select_related(
             'applicant',
             'manager_approver',
             'hr_approver',
@@ -59,7 +55,7 @@ class MnagerApplicationListView(ManagerOnlyMixin, ListView):
                 pass
         
         if applicant_name_param:
-            queryset = queryset.filter(applicant__full_name__icontains=applicant_name_param)
+            queryset = queryset.filter(applicant_id__in=search_user_ids(applicant_name_param, ('full_name',)))
 
         return queryset
     
@@ -85,18 +81,12 @@ class MnagerApplicationListView(ManagerOnlyMixin, ListView):
 class ManagerApplicationDetailView(ManagerOnlyMixin, DetailView):
     model = Application
     template_name = 'application/manager_application_detail.html'
+    use_read_replica = True
 
     def get_queryset(self):
-        user = self.request.user
-        manage_departments = user.manage_departments.all()
-        manage_teams = user.manage_teams.all()
-
-        q_department = Q(applicant__department__in=manage_departments)
-        q_team = Q(applicant__team__in=manage_teams)
+        scope = get_manager_scope(self.request.user)
 
-        queryset = Application.objects.filter(q_department | q_team).exclude(
-            applicant=user,
-        ).select_related(
+        queryset = Application.objects.filter(applicant_id__in=scope.user_ids).select_related(
             'applicant',
             'manager_approver',
             'hr_approver',
@@ -104,6 +94,8 @@ class ManagerApplicationDetailView(ManagerOnlyMixin, DetailView):
 
         return queryset
     
+    # 申請の更新と通知（送信待ち）の登録を同じトランザクションで確定する
+    @transaction.atomic
     def post(self, request, *args, **kwargs):
         self.object = self.get_object()
         user = self.request.user
@@ -1,5 +1,71 @@
+from collections import Counter
 from django.contrib import admin
+from django.db import transaction
 from .models import AttendanceRecord, BreakRecord
+from .cache import invalidate_today_many
+from .changes import records_changed
+from .counters import add_unread, adjust_unread, unread_deltas
 
-admin.site.register(AttendanceRecord)
-admin.site.register(BreakRecord)
+
+def records_edited(records):
+    """管理画面で変更した勤怠記録を、打刻画面のキャッシュと月次集計・カレンダーへ反映する"""
+    keys = {(record.user_id, record.date) for record in records}
+    records_changed(keys)
+    transaction.on_commit(lambda: invalidate_today_many(keys))
+
+
+@admin.register(AttendanceRecord)
+class AttendanceRecordAdmin(admin.ModelAdmin):
+    # 未確認件数は確認状況・社員の変更前後の差分を反映する
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            deltas = Counter()
+            if change:
+                previous_user_id, previous_is_read = AttendanceRecord.objects.filter(pk=obj.pk).values_list(
+                    'user_id', 'is_read',
+                ).get()
+                if not previous_is_read:
+                    deltas.update(unread_deltas([previous_user_id], sign=-1))
+            super().save_model(request, obj, form, change)
+            if not obj.is_read:
+                deltas.update(unread_deltas([obj.user_id]))
+            adjust_unread(deltas)
+            records_edited([obj])
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            super().delete_model(request, obj)
+            if not obj.is_read:
+                add_unread(obj.user, -1)
+            records_edited([obj])
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            records = list(queryset.only('user', 'date', 'is_read'))
+            super().delete_queryset(request, queryset)
+            adjust_unread(unread_deltas((record.user_id for record in records if not record.is_read), sign=-1))
+            records_edited(records)
+
+
+@admin.register(BreakRecord)
+class BreakRecordAdmin(admin.ModelAdmin):
+    # 休憩合計・実働時間の再計算は BreakRecord.save() / delete() が行う
+    def save_model(self, request, obj, form, change):
+        record_ids = {getattr(obj, '_loaded_attendance_id', None), obj.attendance_id}
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            records_edited(AttendanceRecord.objects.filter(pk__in=record_ids))
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            super().delete_model(request, obj)
+            records_edited([obj.attendance])
+
+    def delete_queryset(self, request, queryset):
+        # 一括削除は BreakRecord.delete() を通らないため、対象の勤怠記録をまとめて集計し直す
+        with transaction.atomic():
+            records = list(AttendanceRecord.objects.filter(pk__in=queryset.values('attendance_id')))
+            super().delete_queryset(request, queryset)
+            for record in records:
+                record.sync_breaks()
+            records_edited(records)
@@ -0,0 +1,166 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, models
+from django.utils import timezone
+from .models import AttendanceArchive, AttendanceRecord, BreakRecord
+
+# アーカイブ済みの年と、年ごとのアーカイブ済みの最終日の一覧（アーカイブ実行時に破棄する）
+ARCHIVE_BOUNDARIES_CACHE_KEY = 'attendance:archive-boundaries'
+ARCHIVE_BOUNDARIES_CACHE_TIMEOUT = 60 * 5
+# アーカイブへ写す勤怠記録・休憩の項目
+ARCHIVE_RECORD_FIELDS = [
+    'id', 'user_id', 'date', 'clock_in', 'clock_out', 'total_work_time', 'break_total',
+    'note', 'is_read', 'read_at', 'read_by_id',
+]
+ARCHIVE_BREAK_FIELDS = ['id', 'attendance_id', 'start_time', 'end_time']
+
+
+class ArchivedAttendanceBase(models.Model):
+    """
+    年ごとのアーカイブテーブルの勤怠記録。元のIDをそのまま主キーにする。
+    社員が削除されてもアーカイブは残すため、外部キー制約は付けない。
+    社員は null を許す扱いにして select_related を LEFT OUTER JOIN にし、削除された社員の記録（user は None）も読む。
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+',
+        verbose_name='社員',
+    )
+    date = models.DateField(verbose_name='日付')
+    clock_in = models.DateTimeField(blank=True, null=True, verbose_name='出勤時刻')
+    clock_out = models.DateTimeField(blank=True, null=True, verbose_name='退勤時刻')
+    total_work_time = models.DurationField(blank=True, null=True, verbose_name='実働時間')
+    break_total = models.DurationField(default=timedelta, verbose_name='休憩合計')
+    note = models.TextField(blank=True, verbose_name='備考')
+    is_read = models.BooleanField(default=True, verbose_name='既読')
+    read_at = models.DateTimeField(blank=True, null=True)
+    read_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.DO_NOTHING, db_constraint=False, blank=True, null=True,
+        related_name='+', verbose_name='確認者',
+    )
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name='アーカイブ日時')
+
+    # アーカイブするのは休憩が終わった記録だけ
+    break_started_at = None
+    is_archived = True
+    formatted_work_time = AttendanceRecord.formatted_work_time
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return f"{self.user.full_name if self.user else '削除された社員'} - {self.date}"
+
+
+class ArchivedBreakBase(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    start_time = models.DateTimeField(verbose_name='休憩開始')
+    end_time = models.DateTimeField(blank=True, null=True, verbose_name='休憩終了')
+
+    duration = BreakRecord.duration
+    formatted_duration = BreakRecord.formatted_duration
+
+    class Meta:
+        abstract = True
+
+
+_archive_models = {}
+_existing_tables = set()
+
+
+def archive_models(year):
+    """year 年のアーカイブ用の (勤怠記録, 休憩) モデル。プロセス内で1度だけ作る"""
+    if year not in _archive_models:
+        record_model = type(f'ArchivedAttendanceRecord{year}', (ArchivedAttendanceBase,), {
+            '__module__': __name__,
+            'Meta': type('Meta', (), {
+                'app_label': 'attendance',
+                'managed': False,
+                'db_table': f'attendance_archive_{year}',
+                'ordering': ['-date'],
+                'indexes': [
+                    models.Index(fields=['date', 'id'], name=f'attendance_arch{year}_date_idx'),
+                    models.Index(fields=['user', 'date'], name=f'attendance_arch{year}_user_idx'),
+                ],
+            }),
+        })
+        break_model = type(f'ArchivedBreakRecord{year}', (ArchivedBreakBase,), {
+            '__module__': __name__,
+            'attendance': models.ForeignKey(
+                record_model, on_delete=models.DO_NOTHING, db_constraint=False, related_name='breaks',
+            ),
+            'Meta': type('Meta', (), {
+                'app_label': 'attendance',
+                'managed': False,
+                'db_table': f'attendance_break_archive_{year}',
+            }),
+        })
+        _archive_models[year] = (record_model, break_model)
+    return _archive_models[year]
+
+
+def ensure_archive_tables(year):
+    """year 年のアーカイブテーブルがなければ作成し、モデルを返す"""
+    archive = archive_models(year)
+    tables = {model._meta.db_table for model in archive}
+    if tables <= _existing_tables:
+        return archive
+
+    missing = [model for model in archive if model._meta.db_table not in connection.introspection.table_names()]
+    if missing:
+        # SQLite のスキーマエディタはトランザクション内で使えないため、DDLを生成して同じ接続で実行する
+        editor = connection.schema_editor(collect_sql=True)
+        editor.deferred_sql = []
+        for model in missing:
+            editor.create_model(model)
+        with connection.cursor() as cursor:
+            for sql in [*editor.collected_sql, *map(str, editor.deferred_sql)]:
+                cursor.execute(sql)
+    _existing_tables.update(tables)
+    return archive
+
+
+def archive_cutoff(today=None):
+    """この日付より前の確認済の記録がアーカイブの対象になる"""
+    horizon = getattr(settings, 'ATTENDANCE_ARCHIVE_HORIZON_DAYS', 365)
+    return (today or timezone.localdate()) - timedelta(days=horizon)
+
+
+def archive_boundaries():
+    """アーカイブ済みの (年, その年のアーカイブ済みの最終日) の一覧"""
+    boundaries = cache.get(ARCHIVE_BOUNDARIES_CACHE_KEY)
+    if boundaries is None:
+        boundaries = list(AttendanceArchive.objects.values_list('year', 'last_date'))
+        cache.set(ARCHIVE_BOUNDARIES_CACHE_KEY, boundaries, ARCHIVE_BOUNDARIES_CACHE_TIMEOUT)
+    return boundaries
+
+
+def archive_years():
+    return [year for year, _ in archive_boundaries()]
+
+
+def record_querysets(start_date=None, end_date=None):
+    """
+    期間 [start_date, end_date] の勤怠記録を読むためのクエリセットのリスト。
+    現行テーブルに加え、期間と重なる年のアーカイブを加える。重なりは実際にアーカイブした最終日で判定するため、
+    保存期間の設定やアーカイブ時の --horizon-days が変わっても記録を読み落とさない。
+    開始日・終了日の指定がない場合は、その側の制限なしとして扱う。
+    """
+    querysets = [AttendanceRecord.objects.all()]
+    for year, last_date in archive_boundaries():
+        if end_date is not None and year > end_date.year:
+            continue
+        if start_date is not None and (start_date.year > year or (last_date and start_date > last_date)):
+            continue
+        querysets.append(archive_models(year)[0].objects.all())
+    return querysets
+
+
+def find_archived_record(pk):
+    """アーカイブ済みの勤怠記録を主キーで探す（見つからなければ None）"""
+    for year in reversed(archive_years()):
+        record = archive_models(year)[0].objects.select_related('user', 'read_by').filter(pk=pk).first()
+        if record:
+            return record
+    return None
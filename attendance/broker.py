@@ -0,0 +1,101 @@
+import asyncio
+import json
+import threading
+from contextlib import asynccontextmanager
+from django.db import transaction
+
+# 購読ごとに溜められるイベントの上限（超えた購読には RESYNC を送り、スナップショットから取り直させる）
+SUBSCRIPTION_QUEUE_SIZE = 1000
+RESYNC = object()
+
+
+class Subscription:
+    """1つの接続の購読。publish はどのスレッドからでも呼べ、イベントは購読側のイベントループで受け取る"""
+
+    def __init__(self, keys, maxsize=SUBSCRIPTION_QUEUE_SIZE):
+        self.keys = frozenset(keys)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # 接続のイベントループが既に終了している
+            pass
+
+    def _put(self, event):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # 読み出しが追いつかない接続は、溜まったイベントを捨てて再同期させる
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+    async def get(self):
+        event = await self.queue.get()
+        if event is RESYNC:
+            self.overflowed = False
+        return event
+
+
+class Broker:
+    """
+    プロセス内の pub/sub。キー（社員IDなど）ごとに購読を持ち、publish 1回で該当する購読だけに配る。
+    複数プロセスで動かす場合は、プロセスごとに自分の打刻のイベントだけが届く。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = {}
+
+    @asynccontextmanager
+    async def subscribe(self, keys):
+        subscription = Subscription(keys)
+        with self._lock:
+            for key in subscription.keys:
+                self._subscriptions.setdefault(key, set()).add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                for key in subscription.keys:
+                    subscribers = self._subscriptions.get(key)
+                    if subscribers is not None:
+                        subscribers.discard(subscription)
+                        if not subscribers:
+                            del self._subscriptions[key]
+
+    def publish(self, key, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(key, ()))
+        for subscription in subscriptions:
+            subscription.put(event)
+        return len(subscriptions)
+
+    def publish_later(self, key_events):
+        """(キー, イベント) のリストをトランザクションのコミット後に配る"""
+        key_events = list(key_events)
+        if key_events:
+            transaction.on_commit(lambda: [self.publish(key, event) for key, event in key_events])
+
+    def subscriber_count(self):
+        with self._lock:
+            return len({subscription for subscriptions in self._subscriptions.values() for subscription in subscriptions})
+
+
+def sse(event, data, retry=None):
+    """Server-Sent Events の1イベント分の文字列"""
+    lines = [f'event: {event}', f'data: {json.dumps(data, ensure_ascii=False)}']
+    if retry is not None:
+        lines.insert(0, f'retry: {retry}')
+    return '\n'.join(lines) + '\n\n'
+
+
+# 上司の出勤状況（ロースター）向け。キーは社員ID
+roster_broker = Broker()
@@ -0,0 +1,42 @@
+from django.core.cache import cache
+from .models import AttendanceRecord
+
+# 打刻画面で表示する本日分の勤怠のキャッシュ（打刻時に破棄する）
+TODAY_CACHE_TIMEOUT = 60 * 60 * 24
+TODAY_FIELDS = ('id', 'clock_in', 'clock_out', 'total_work_time', 'break_total', 'break_started_at', 'note')
+
+
+def today_cache_key(user_id, day):
+    return f'attendance:today:{user_id}:{day.isoformat()}'
+
+
+def get_today_record(user, day):
+    """
+    本日分の勤怠を読み取り専用で返す。
+    未打刻の場合はレコードを作らず、未保存の AttendanceRecord を返す。
+    """
+    key = today_cache_key(user.pk, day)
+    values = cache.get(key)
+    if values is None:
+        values = AttendanceRecord.objects.filter(user=user, date=day).values(*TODAY_FIELDS).first() or {}
+        cache.set(key, values, TODAY_CACHE_TIMEOUT)
+    return AttendanceRecord(user=user, date=day, **values)
+
+
+async def aget_today_record(user, day):
+    """get_today_record の非同期版（キャッシュ・クエリとも非同期APIで読む）"""
+    key = today_cache_key(user.pk, day)
+    values = await cache.aget(key)
+    if values is None:
+        values = await AttendanceRecord.objects.filter(user=user, date=day).values(*TODAY_FIELDS).afirst() or {}
+        await cache.aset(key, values, TODAY_CACHE_TIMEOUT)
+    return AttendanceRecord(user=user, date=day, **values)
+
+
+def invalidate_today(user_id, day):
+    cache.delete(today_cache_key(user_id, day))
+
+
+def invalidate_today_many(keys):
+    """(user_id, date) の組をまとめて破棄する"""
+    cache.delete_many([today_cache_key(user_id, day) for user_id, day in keys])
@@ -0,0 +1,138 @@
+import hashlib
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from django.utils import timezone
+from application.models import Application
+from .archive import record_querysets
+from .models import CalendarVersion
+
+# 1回の要求で返す最大の日数（FullCalendar の月表示は最大6週間）
+MAX_RANGE_DAYS = 100
+
+APPLICATION_COLORS = {
+    'paid_leave': '#198754',
+    'absence': '#dc3545',
+    'business_trip': '#0d6efd',
+    'remote': '#6f42c1',
+}
+
+
+def touch_calendars(user_ids):
+    """
+    社員のカレンダーの更新日時を現在時刻にする（ETag・Last-Modified が変わる）。
+    変更と同じトランザクションで書き込み、コミットと同時に新しい値が見えるようにする。
+    """
+    user_ids = {user_id for user_id in user_ids if user_id}
+    if not user_ids:
+        return
+    now = timezone.now()
+    CalendarVersion.objects.bulk_create(
+        [CalendarVersion(user_id=user_id, updated_at=now) for user_id in sorted(user_ids)],
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['updated_at'],
+    )
+
+
+def calendar_versions(user_ids):
+    """
+    社員IDごとの更新日時（UNIX時刻）。一度も変更のない社員は 0 とする
+    （表示の要求では書き込まない。変更すると touch_calendars で記録される）。
+    """
+    found = dict(CalendarVersion.objects.filter(user_id__in=user_ids).values_list('user_id', 'updated_at'))
+    return {user_id: found[user_id].timestamp() if user_id in found else 0 for user_id in user_ids}
+
+
+def parse_range(start, end):
+    """FullCalendar の start / end（日付または日時の文字列）を [開始日, 終了日) にする"""
+    try:
+        start_date = date.fromisoformat((start or '')[:10])
+        end_date = date.fromisoformat((end or '')[:10])
+    except ValueError:
+        raise ValueError('start / end は YYYY-MM-DD 形式で指定してください。')
+    if end_date <= start_date:
+        raise ValueError('end は start より後の日付を指定してください。')
+    if (end_date - start_date).days > MAX_RANGE_DAYS:
+        raise ValueError(f'期間は {MAX_RANGE_DAYS} 日以内で指定してください。')
+    return start_date, end_date
+
+
+class CalendarFeed:
+    """対象社員と期間の組。ETag・Last-Modified とイベントの生成をまとめる"""
+
+    def __init__(self, kind, target_id, user_ids, start, end):
+        self.kind = kind
+        self.target_id = target_id
+        self.user_ids = sorted(user_ids)
+        self.start = start
+        self.end = end
+        self._versions = None
+
+    @property
+    def versions(self):
+        if self._versions is None:
+            self._versions = calendar_versions(self.user_ids)
+        return self._versions
+
+    def etag(self):
+        source = '|'.join([
+            self.kind, str(self.target_id), self.start.isoformat(), self.end.isoformat(),
+            *(f'{user_id}:{self.versions[user_id]}' for user_id in self.user_ids),
+        ])
+        return hashlib.sha1(source.encode()).hexdigest()
+
+    def last_modified(self):
+        latest = max(self.versions.values(), default=0)
+        if not latest:
+            return None
+        return datetime.fromtimestamp(latest, tz=dt_timezone.utc)
+
+    def events(self, names=None):
+        """勤怠のある日と承認済みの申請を FullCalendar のイベント形式で返す"""
+        if not self.user_ids:
+            return []
+        names = names or {}
+        start_at = timezone.make_aware(datetime.combine(self.start, datetime.min.time()))
+        end_at = timezone.make_aware(datetime.combine(self.end, datetime.min.time()))
+        events = []
+
+        # (user, date) の一意制約のインデックスで範囲を絞り、表示に使う列だけを読む（古い月はアーカイブも読む）
+        rows = [
+            row
+            for queryset in record_querysets(self.start, self.end)
+            for row in queryset.filter(
+                user_id__in=self.user_ids, date__gte=self.start, date__lt=self.end,
+            ).values_list('pk', 'user_id', 'date', 'clock_in', 'clock_out')
+        ]
+        for pk, user_id, day, clock_in, clock_out in rows:
+            times = '-'.join(
+                timezone.localtime(value).strftime('%H:%M') for value in (clock_in, clock_out) if value
+            ) or '出勤記録なし'
+            events.append({
+                'id': f'attendance-{pk}',
+                'title': f'{names[user_id]} {times}' if user_id in names else times,
+                'start': day.isoformat(),
+                'allDay': True,
+                'type': 'attendance',
+            })
+
+        # 期間と重なる承認済みの申請（申請者・開始日時のインデックスで開始側を絞る）。
+        # 開始日時の下限を設けるため、MAX_RANGE_DAYS を超えて続く申請は表示範囲の途中からは表示されない
+        type_labels = dict(Application.TYPE_CHOICES)
+        for pk, user_id, application_type, start_datetime, end_datetime in Application.objects.filter(
+            applicant_id__in=self.user_ids,
+            status='approved',
+            start_datetime__lt=end_at,
+            start_datetime__gte=start_at - timedelta(days=MAX_RANGE_DAYS),
+        ).values_list('pk', 'applicant_id', 'application_type', 'start_datetime', 'end_datetime'):
+            if (end_datetime or start_datetime) < start_at:
+                continue
+            label = type_labels.get(application_type, application_type)
+            events.append({
+                'id': f'application-{pk}',
+                'title': f'{names[user_id]} {label}' if user_id in names else label,
+                'start': timezone.localtime(start_datetime).isoformat(),
+                'end': timezone.localtime(end_datetime).isoformat() if end_datetime else None,
+                'color': APPLICATION_COLORS.get(application_type, '#6c757d'),
+                'type': 'application',
+            })
+        return events
@@ -0,0 +1,19 @@
+from .calendar_feed import touch_calendars
+from .rollups import apply_rollup_changes, refresh_timesheets_later
+
+
+def records_changed(keys, rollup_changes=None):
+    """
+    勤怠記録が作成・変更・削除された (user_id, date) を派生データへ反映する。
+    月次集計の再集計（コミット後）と、カレンダーの更新日時（ETag）の更新（同じトランザクション）を行う。
+    打刻のように変更前後の行 (user_id, 変更前, 変更後) が分かる場合は rollup_changes に渡すと、
+    月全体を集計し直さずに増減だけを同じトランザクションで月次集計に加算する。
+    """
+    keys = {(user_id, day) for user_id, day in keys if user_id and day}
+    if not keys:
+        return
+    if rollup_changes is None:
+        refresh_timesheets_later(keys)
+    else:
+        apply_rollup_changes(rollup_changes)
+    touch_calendars({user_id for user_id, _ in keys})
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.checks import Warning, register, Tags
+
+# プロセスごとにしか共有されないキャッシュ
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    """打刻トークンの重複排除と表示用キャッシュの破棄は、全ワーカーで共有するキャッシュを前提にしている"""
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend in PROCESS_LOCAL_CACHES:
+        return [Warning(
+            f'CACHES の default が {backend} です。',
+            hint='複数のワーカープロセスで動かすと打刻の重複排除が効かず、打刻画面に古い内容が表示されます。'
+                 '同じホストなら attendance_management.cache_backends.SharedFileBasedCache、'
+                 '複数ホストなら RedisCache などの共有キャッシュを設定してください。',
+            id='attendance.W001',
+        )]
+    return []
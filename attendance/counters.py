@@ -0,0 +1,65 @@
+from collections import Counter
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from .models import UnreadRecordCounter
+
+# 全社の件数は最初の打刻のたびに増えるため、1行に更新が集中しないよう社員IDで分けて持ち、表示時に合計する
+COMPANY_SHARDS = 16
+
+
+def company_key(user_id):
+    return f'company:{user_id % COMPANY_SHARDS}'
+
+
+def company_keys():
+    return [f'company:{shard}' for shard in range(COMPANY_SHARDS)]
+
+
+def user_key(user_id):
+    return f'user:{user_id}'
+
+
+def counter_keys(user_id):
+    """勤怠記録1件が計上される集計キー（部署・日付ごとの件数は勤怠記録のインデックスから数える）"""
+    return [company_key(user_id), user_key(user_id)]
+
+
+def unread_deltas(user_ids, sign=1):
+    """勤怠記録ごとの社員IDの並びから集計キーごとの増減を作る"""
+    deltas = Counter()
+    for user_id in user_ids:
+        for key in counter_keys(user_id):
+            deltas[key] += sign
+    return deltas
+
+
+def counted_unread_deltas(rows, sign=1):
+    """(user_id, 件数) の集計結果から集計キーごとの増減を作る"""
+    deltas = Counter()
+    for user_id, count in rows:
+        for key in counter_keys(user_id):
+            deltas[key] += sign * count
+    return deltas
+
+
+def adjust_unread(deltas):
+    """集計キーごとの増減を、呼び出し元と同じトランザクションで反映する"""
+    for key, delta in deltas.items():
+        if not delta:
+            continue
+        if UnreadRecordCounter.objects.filter(key=key).update(count=F('count') + delta):
+            continue
+        try:
+            with transaction.atomic():
+                UnreadRecordCounter.objects.create(key=key, count=delta)
+        except IntegrityError:
+            UnreadRecordCounter.objects.filter(key=key).update(count=F('count') + delta)
+
+
+def add_unread(user, delta=1):
+    """社員1人分の未確認件数を増減する（作成・確認・確認取消・削除時）"""
+    adjust_unread(unread_deltas([user.pk], sign=delta))
+
+
+def unread_count(*keys):
+    return UnreadRecordCounter.objects.filter(key__in=keys).aggregate(total=Sum('count'))['total'] or 0
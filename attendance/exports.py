@@ -0,0 +1,192 @@
+import csv
+import heapq
+import re
+from operator import attrgetter
+import zipfile
+from xml.sax.saxutils import escape
+from django.utils import timezone
+
+EXPORT_HEADER = ['社員番号', '氏名', '日付', '出勤', '退勤', '休憩合計', '休憩', '実働時間', '備考', '確認']
+EXPORT_CHUNK_SIZE = 2000
+
+
+def _time(value):
+    return timezone.localtime(value).strftime('%H:%M') if value else ''
+
+
+def _duration(value):
+    if not value:
+        return ''
+    total_minutes = int(value.total_seconds()) // 60
+    return f'{total_minutes // 60}:{total_minutes % 60:02d}'
+
+
+def iter_export_rows(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    勤怠記録を1行ずつ返す。
+    記録は iterator でチャンクごとに読み、休憩はチャンク単位で1クエリにまとめて取得する。
+    queryset にアーカイブを含むクエリセットのリストを渡した場合は、日付・ID順に突き合わせて返す。
+    """
+    querysets = queryset if isinstance(queryset, (list, tuple)) else [queryset]
+    records = heapq.merge(
+        *(
+            source.select_related('user').only(
+                'date', 'clock_in', 'clock_out', 'total_work_time', 'break_total', 'note', 'is_read',
+                'user__employee_number', 'user__full_name',
+            ).order_by('date', 'id').iterator(chunk_size=chunk_size)
+            for source in querysets
+        ),
+        key=attrgetter('date', 'pk'),
+    )
+
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield from _chunk_rows(chunk)
+            chunk = []
+    if chunk:
+        yield from _chunk_rows(chunk)
+
+
+def _chunk_rows(records):
+    # 休憩は記録のモデル（現行・年ごとのアーカイブ）に対応する休憩のモデルから読む
+    ids_by_model = {}
+    for record in records:
+        ids_by_model.setdefault(type(record).breaks.field.model, []).append(record.pk)
+    breaks = {}
+    for break_model, record_ids in ids_by_model.items():
+        for attendance_id, start_time, end_time in break_model.objects.filter(
+            attendance_id__in=record_ids,
+        ).order_by('start_time').values_list('attendance_id', 'start_time', 'end_time'):
+            breaks.setdefault(attendance_id, []).append(f'{_time(start_time)}-{_time(end_time)}')
+
+    for record in records:
+        # アーカイブには削除された社員の記録も残る（user は None）
+        user = record.user
+        yield [
+            user.employee_number if user else '',
+            user.full_name if user else '',
+            record.date.isoformat(),
+            _time(record.clock_in),
+            _time(record.clock_out),
+            _duration(record.break_total),
+            ' / '.join(breaks.get(record.pk, [])),
+            record.formatted_work_time,
+            record.note,
+            '確認済' if record.is_read else '未確認',
+        ]
+
+
+class _Echo:
+    """csv.writer の書き込み内容をそのまま返す疑似バッファ"""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows):
+    # Excel で文字化けしないよう BOM 付きの UTF-8 で出力する
+    yield '\ufeff'
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_HEADER)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+class _ZipStream:
+    """zipfile の出力を溜めておき、ジェネレーターから少しずつ取り出すための書き込み先"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.position = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = bytes(self.buffer)
+        self.buffer.clear()
+        return data
+
+
+# XMLに含められない制御文字
+_ILLEGAL_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="勤怠記録" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+
+def _xlsx_row(row):
+    cells = ''.join(
+        f'<c t="inlineStr"><is><t xml:space="preserve">{escape(_ILLEGAL_XML_CHARS.sub("", str(value)))}</t></is></c>'
+        for value in row
+    )
+    return f'<row>{cells}</row>'.encode()
+
+
+def stream_xlsx(rows, flush_every=500):
+    """
+    外部ライブラリを使わずにXLSXを逐次生成する。
+    シートは共有文字列を使わないインライン文字列で書き、ZIPはデータ記述子付きでストリーム出力する。
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as workbook:
+        for name, content in _XLSX_PARTS.items():
+            workbook.writestr(name, content)
+        yield stream.drain()
+
+        with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(_xlsx_row(EXPORT_HEADER))
+            for index, row in enumerate(rows, start=1):
+                sheet.write(_xlsx_row(row))
+                if index % flush_every == 0:
+                    yield stream.drain()
+            sheet.write(b'</sheetData></worksheet>')
+    yield stream.drain()
@@ -0,0 +1,44 @@
+from datetime import date
+from accounts.search import search_user_ids
+from .archive import record_querysets
+
+
+def parse_date(value):
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def filter_attendance_records(queryset, params):
+    """人事の勤怠一覧と同じ条件（q / start_date / end_date / read_status）で絞り込む"""
+    q = params.get('q')
+    if q:
+        # 氏名・ユーザー名は検索索引で社員IDに変換してから絞り込む
+        queryset = queryset.filter(user_id__in=search_user_ids(q, ('username', 'full_name')))
+
+    start_date_obj = parse_date(params.get('start_date'))
+    end_date_obj = parse_date(params.get('end_date'))
+    if start_date_obj:
+        queryset = queryset.filter(date__gte=start_date_obj)
+    if end_date_obj:
+        queryset = queryset.filter(date__lte=end_date_obj)
+
+    selected_read_status = params.get('read_status', 'all')
+    if selected_read_status == 'unread':
+        queryset = queryset.filter(is_read=False)
+    elif selected_read_status == 'read':
+        queryset = queryset.filter(is_read=True)
+
+    return queryset
+
+
+def filter_attendance_sources(params, prepare=None):
+    """
+    検索条件の期間に応じて現行テーブルと必要なアーカイブを選び、それぞれを同じ条件で絞り込む。
+    prepare を渡した場合はそれぞれに同じ加工（select_related など）をしてから絞り込む。
+    """
+    sources = record_querysets(parse_date(params.get('start_date')), parse_date(params.get('end_date')))
+    if prepare:
+        sources = [prepare(source) for source in sources]
+    return [filter_attendance_records(source, params) for source in sources]
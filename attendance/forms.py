@@ -1,5 +1,6 @@
 from django import forms
 from .models import AttendanceRecord, BreakRecord
+from .imports import IMPORT_MODES
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -26,3 +27,15 @@ class AttendanceRecordForm(forms.ModelForm):
             field.widget.attrs['class'] = 'form-control'
         # 人事用にアクティブユーザーのみ選択可能
         self.fields['user'].queryset = User.objects.filter(is_active=True)
+
+class AttendanceImportForm(forms.Form):
+    file = forms.FileField(
+        label='CSVファイル',
+        help_text='列: 社員番号, 日付(YYYY-MM-DD), 出勤(HH:MM), 退勤(HH:MM), 休憩(12:00-13:00 / ...、休憩中は 12:00-), 備考。CSV出力と同じ形式で取り込めます。',
+    )
+    mode = forms.ChoiceField(label='登録済みの日の扱い', choices=IMPORT_MODES, initial='ignore')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['file'].widget.attrs['class'] = 'form-control'
+        self.fields['mode'].widget.attrs['class'] = 'form-select'
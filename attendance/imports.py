@@ -0,0 +1,253 @@
+import csv
+import io
+from datetime import date, datetime, time, timedelta
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+from .models import AttendanceRecord, BreakRecord
+from .cache import invalidate_today_many
+from .counters import adjust_unread, unread_deltas
+from .changes import records_changed
+
+CustomUser = get_user_model()
+
+IMPORT_CHUNK_SIZE = 1000
+# 画面・レポートに保持するエラーの上限（件数自体はすべて数える）
+MAX_REPORTED_ERRORS = 1000
+# 出力（exports.EXPORT_HEADER）と同じ列名で読む。その他の列は無視する
+REQUIRED_COLUMNS = ('社員番号', '日付')
+IMPORT_MODES = (
+    ('ignore', '登録済みの日はスキップする'),
+    ('update', '登録済みの日は上書きする（確認済を除く）'),
+)
+IMPORT_FIELDS = ['clock_in', 'clock_out', 'break_total', 'break_started_at', 'total_work_time', 'note']
+
+
+class RowError(ValueError):
+    """1行分の取込エラー"""
+
+
+class ImportResult:
+    """取込結果の件数と、行ごとのエラー"""
+
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((line, message))
+
+    @property
+    def errors_truncated(self):
+        return self.error_count > len(self.errors)
+
+
+def _parse_time(day, value, label):
+    if not value:
+        return None
+    try:
+        parsed = time.fromisoformat(value.strip())
+    except ValueError:
+        raise RowError(f'{label}の形式が正しくありません（HH:MM）: {value}')
+    return timezone.make_aware(datetime.combine(day, parsed))
+
+
+def _parse_breaks(day, value):
+    """
+    '12:00-13:00 / 15:00-15:10' 形式の休憩を (開始, 終了) のリストにする。
+    CSV出力と同じく、休憩中の記録は最後の休憩を '15:00-' のように終了なしで書く（終了は None）。
+    """
+    breaks = []
+    parts = [part for part in (part.strip() for part in (value or '').split('/')) if part]
+    for index, part in enumerate(parts):
+        start, separator, end = part.partition('-')
+        start_time = _parse_time(day, start, '休憩開始')
+        end_time = _parse_time(day, end, '休憩終了')
+        is_open = separator and not end.strip() and index == len(parts) - 1
+        if not start_time or (not end_time and not is_open) or (end_time and end_time < start_time):
+            raise RowError(f'休憩の形式が正しくありません（HH:MM-HH:MM）: {part}')
+        breaks.append((start_time, end_time))
+    return breaks
+
+
+def parse_row(row):
+    """CSVの1行を検証し、社員番号と勤怠記録・休憩の値にする"""
+    employee_number = (row.get('社員番号') or '').strip()
+    if not employee_number:
+        raise RowError('社員番号が空です。')
+    try:
+        day = date.fromisoformat((row.get('日付') or '').strip().replace('/', '-'))
+    except ValueError:
+        raise RowError(f"日付の形式が正しくありません（YYYY-MM-DD）: {row.get('日付')}")
+
+    clock_in = _parse_time(day, row.get('出勤'), '出勤')
+    clock_out = _parse_time(day, row.get('退勤'), '退勤')
+    if clock_out and not clock_in:
+        raise RowError('出勤がないのに退勤が入力されています。')
+    if clock_in and clock_out and clock_out < clock_in:
+        raise RowError('退勤が出勤より前です。')
+
+    breaks = _parse_breaks(day, row.get('休憩'))
+    break_started_at = next((start for start, end in breaks if end is None), None)
+    if break_started_at and (not clock_in or clock_out):
+        raise RowError('休憩中の記録は、出勤があり退勤がない場合だけ取り込めます。')
+    break_total = sum((end - start for start, end in breaks if end), timedelta())
+    total_work_time = clock_out - clock_in - break_total if clock_in and clock_out else None
+    values = {
+        'date': day,
+        'clock_in': clock_in,
+        'clock_out': clock_out,
+        'break_total': break_total,
+        'break_started_at': break_started_at,
+        'total_work_time': total_work_time,
+        'note': (row.get('備考') or '').strip(),
+    }
+    return employee_number, values, breaks
+
+
+def _same_values(record, values):
+    """読み直した記録が、この取込で書き込んだ値のままか（同時に登録された別の記録ではないか）"""
+    return all(getattr(record, field) == values[field] for field in IMPORT_FIELDS)
+
+
+def iter_chunks(reader, chunk_size):
+    """(行番号, 行) をチャンクごとにまとめて返す（ヘッダーが1行目）"""
+    chunk = []
+    for line, row in enumerate(reader, start=2):
+        chunk.append((line, row))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def import_attendance_csv(file, mode='ignore', chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    勤怠記録のCSVをチャンク単位で取り込み、ImportResult を返す。
+    社員番号の解決と登録済みの記録の確認はチャンクごとに1クエリで行い、
+    記録・休憩は bulk_create でまとめて書き込む。不正な行はエラーとして記録し、残りの行は取り込む。
+    """
+    if mode not in dict(IMPORT_MODES):
+        raise ValueError(f'未対応の取込方法です: {mode}')
+    if isinstance(file, (bytes, bytearray)):
+        file = io.BytesIO(file)
+    # Excel で保存した BOM 付きの UTF-8 も読めるようにする
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(text)
+    result = ImportResult()
+
+    missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or [])]
+    if missing:
+        result.add_error(1, f"必須の列がありません: {', '.join(missing)}")
+        return result
+
+    for chunk in iter_chunks(reader, chunk_size):
+        _import_chunk(chunk, mode, result)
+    result.errors.sort()
+    return result
+
+
+def _import_chunk(chunk, mode, result):
+    parsed = []
+    for line, row in chunk:
+        try:
+            parsed.append((line, *parse_row(row)))
+        except RowError as e:
+            result.add_error(line, str(e))
+
+    users = dict(
+        CustomUser.objects.filter(
+            employee_number__in={employee_number for _, employee_number, _, _ in parsed},
+        ).values_list('employee_number', 'pk')
+    )
+
+    rows = {}
+    for line, employee_number, values, breaks in parsed:
+        if employee_number not in users:
+            result.add_error(line, f'社員番号 {employee_number} の社員が見つかりません。')
+            continue
+        key = (users[employee_number], values['date'])
+        if key in rows:
+            result.add_error(line, f'{rows[key][0]} 行目と同じ社員・日付です。')
+            continue
+        rows[key] = (line, values, breaks)
+    if not rows:
+        return
+
+    with transaction.atomic():
+        existing = {
+            (user_id, day): (pk, is_read)
+            for user_id, day, pk, is_read in AttendanceRecord.objects.filter(
+                user_id__in={user_id for user_id, _ in rows},
+                date__in={day for _, day in rows},
+            ).values_list('user_id', 'date', 'pk', 'is_read')
+        }
+
+        records = []
+        breaks_by_key = {}
+        replaced_ids = []
+        for key, (line, values, breaks) in rows.items():
+            if key in existing:
+                pk, is_read = existing[key]
+                if mode == 'ignore':
+                    result.skipped += 1
+                    continue
+                if is_read:
+                    result.add_error(line, '確認済の勤怠は上書きできません。')
+                    continue
+                replaced_ids.append(pk)
+            records.append(AttendanceRecord(user_id=key[0], **values))
+            breaks_by_key[key] = breaks
+
+        if not records:
+            return
+        if mode == 'update':
+            # (user, date) の重複は上書きとし、採番済み・新規の両方の主キーを受け取る
+            AttendanceRecord.objects.bulk_create(
+                records, update_conflicts=True, unique_fields=['user', 'date'], update_fields=IMPORT_FIELDS,
+            )
+            BreakRecord.objects.filter(attendance_id__in=replaced_ids).delete()
+        else:
+            # 確認した後に別の取込・打刻で登録された日は、エラーにせずスキップする
+            AttendanceRecord.objects.bulk_create(records, ignore_conflicts=True)
+            # 登録を無視した行には主キーが返らないため、実際に登録した記録を読み直す
+            inserted = {
+                (record.user_id, record.date): record
+                for record in AttendanceRecord.objects.filter(
+                    user_id__in={record.user_id for record in records},
+                    date__in={record.date for record in records},
+                ).exclude(pk__in=[pk for pk, _ in existing.values()]).only('user', 'date', *IMPORT_FIELDS)
+            }
+            attempted = len(records)
+            records = [
+                inserted[key] for key in ((record.user_id, record.date) for record in records)
+                if key in inserted and _same_values(inserted[key], rows[key][1])
+            ]
+            result.skipped += attempted - len(records)
+            if not records:
+                return
+
+        BreakRecord.objects.bulk_create([
+            BreakRecord(attendance=record, start_time=start_time, end_time=end_time)
+            for record in records
+            for start_time, end_time in breaks_by_key[(record.user_id, record.date)]
+        ])
+
+        created_keys = [(record.user_id, record.date) for record in records if (record.user_id, record.date) not in existing]
+        adjust_unread(unread_deltas(user_id for user_id, _ in created_keys))
+        result.created += len(created_keys)
+        result.updated += len(records) - len(created_keys)
+
+        changed_keys = [(record.user_id, record.date) for record in records]
+        records_changed(changed_keys)
+        today = timezone.localdate()
+        today_keys = [key for key in changed_keys if key[1] == today]
+        if today_keys:
+            transaction.on_commit(lambda: invalidate_today_many(today_keys))
+
@@ -0,0 +1,306 @@
+import json
+import logging
+import os
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from .models import PunchJournalSegment
+from .roster import publish_punches_later
+from .services import PUNCH_TOKEN_TIMEOUT, PunchResult, apply_punch_batch, load_punch_states
+
+try:
+    import fcntl
+except ImportError:  # Windows ではファイルロックを省略する
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PUNCH_BUFFER = {
+    'ENABLED': False,
+    'JOURNAL_DIR': Path(settings.BASE_DIR) / 'punch_journal',
+    'FLUSH_INTERVAL': 2,
+    'BATCH_SIZE': 500,
+    'SEGMENT_HISTORY_SECONDS': 60 * 60,
+}
+
+
+def get_buffer_settings():
+    return {**DEFAULT_PUNCH_BUFFER, **getattr(settings, 'PUNCH_BUFFER', {})}
+
+
+def buffering_enabled():
+    return get_buffer_settings()['ENABLED']
+
+
+@contextmanager
+def _locked(path, exclusive=True, blocking=True):
+    with open(path, 'a+') as lock_file:
+        if fcntl:
+            flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+            if not blocking:
+                flags |= fcntl.LOCK_NB
+            fcntl.flock(lock_file, flags)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class PunchJournal:
+    """
+    打刻を追記するローカルジャーナル。
+    打刻は active.jsonl に追記して fsync した時点で受付完了とし、
+    ライターは active.jsonl をセグメントに切り替えてからDBへ一括反映する。
+    """
+
+    def __init__(self, directory=None):
+        self.directory = Path(directory or get_buffer_settings()['JOURNAL_DIR'])
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.active_path = self.directory / 'active.jsonl'
+        self.lock_path = self.directory / 'journal.lock'
+        self.writer_lock_path = self.directory / 'writer.lock'
+
+    def append(self, user_id, action, timestamp, note='', locked=False):
+        """打刻を追記する。既にジャーナルのロックを取得している場合は locked=True で呼ぶ"""
+        return self.append_many([(user_id, action, timestamp, note)], locked=locked)[0]
+
+    def append_many(self, punches, locked=False):
+        """(user_id, action, timestamp, note) の打刻をまとめて追記し、fsync は1回で済ませる"""
+        entries = [
+            {
+                'id': uuid.uuid4().hex,
+                'user_id': user_id,
+                'action': action,
+                'timestamp': timestamp.isoformat(),
+                'note': note,
+            }
+            for user_id, action, timestamp, note in punches
+        ]
+        if not entries:
+            return entries
+        if locked:
+            self._write(entries)
+        else:
+            with _locked(self.lock_path):
+                self._write(entries)
+        return entries
+
+    def _write(self, entries):
+        with open(self.active_path, 'a', encoding='utf-8') as journal:
+            journal.write(''.join(json.dumps(entry, ensure_ascii=False) + '\n' for entry in entries))
+            journal.flush()
+            os.fsync(journal.fileno())
+
+    def segments(self):
+        """未反映のセグメント（古い順）"""
+        return sorted(self.directory.glob('segment-*.jsonl'))
+
+    def rotate(self):
+        """受付中のジャーナルをセグメントに切り替える。空の場合は None"""
+        with _locked(self.lock_path):
+            if not self.active_path.exists() or self.active_path.stat().st_size == 0:
+                return None
+            segment = self.directory / f"segment-{timezone.now().strftime('%Y%m%d%H%M%S%f')}.jsonl"
+            os.replace(self.active_path, segment)
+        return segment
+
+    def read(self, path):
+        entries = []
+        with open(path, encoding='utf-8') as journal:
+            for line in journal:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # 書き込み途中でクラッシュした末尾行は捨てる
+                    logger.warning('journal %s: broken line skipped', path.name)
+                    continue
+                entry['timestamp'] = datetime.fromisoformat(entry['timestamp'])
+                entries.append(entry)
+        return entries
+
+    def _read_matching(self, path, keys):
+        return [
+            entry for entry in self.read(path)
+            if (entry['user_id'], timezone.localtime(entry['timestamp']).date()) in keys
+        ]
+
+    def _flushed(self, segments):
+        return set(PunchJournalSegment.objects.filter(
+            name__in=[path.name for path in segments],
+        ).values_list('name', flat=True))
+
+    def read_pending(self, keys, load_states=None):
+        """
+        load_states() で読んだDBの状態と、その状態に未反映の (user_id, date) の打刻（時刻順）を返す。
+        ジャーナルのロックを取得してから呼ぶ（受付中のジャーナルが途中でセグメントに切り替わらないように）。
+        ライターがDBへの反映をコミットした前後で状態と反映済みセグメントを別々に読むと、打刻を二重に重ねたり
+        取りこぼしたりするため、反映済みセグメントを状態の前後で読み、変わっていれば状態から読み直す。
+        """
+        keys = set(keys)
+        segments = self.segments()
+        contents = {}
+        for path in segments:
+            try:
+                contents[path.name] = self._read_matching(path, keys)
+            except FileNotFoundError:
+                # ライターが反映をコミットして削除した（下で反映済みとして除外される）
+                contents[path.name] = []
+        active = self._read_matching(self.active_path, keys) if self.active_path.exists() else []
+
+        while True:
+            flushed = self._flushed(segments)
+            states = load_states() if load_states else None
+            if self._flushed(segments) == flushed:
+                break
+
+        entries = [entry for name, rows in contents.items() if name not in flushed for entry in rows]
+        entries.extend(active)
+        return states, sorted(entries, key=lambda entry: entry['timestamp'])
+
+    def pending(self, user_id, day):
+        """DBに未反映の、指定ユーザー・指定日の打刻（時刻順）"""
+        with _locked(self.lock_path, exclusive=False):
+            return self.read_pending({(user_id, day)})[1]
+
+    def flush_segment(self, path):
+        """
+        セグメントをDBへ反映して削除する。
+        反映済みのセグメント名は同じトランザクションで記録するため、
+        コミット後・削除前にクラッシュしても再実行で二重に反映されない。
+        """
+        if PunchJournalSegment.objects.filter(name=path.name).exists():
+            path.unlink()
+            return []
+
+        entries = self.read(path)
+        with transaction.atomic():
+            results = apply_punch_batch(entries, batch_size=get_buffer_settings()['BATCH_SIZE']) if entries else []
+            PunchJournalSegment.objects.create(name=path.name, entry_count=len(entries))
+        path.unlink()
+
+        for entry, result in zip(entries, results):
+            if not result.applied:
+                logger.warning('journal %s: punch %s rejected: %s', path.name, entry['id'], result.message)
+        return results
+
+    def flush(self):
+        """前回中断したセグメントを先に再生し、その後に受付中の打刻を反映する"""
+        flushed = 0
+        with _locked(self.writer_lock_path, blocking=False):
+            for path in self.segments():
+                flushed += len(self.flush_segment(path))
+            segment = self.rotate()
+            if segment:
+                flushed += len(self.flush_segment(segment))
+            self.compact_history()
+        return flushed
+
+    def compact_history(self):
+        """
+        反映済みセグメントの記録のうち、ファイルが残っておらず SEGMENT_HISTORY_SECONDS を過ぎたものを削除する。
+        反映とファイルの削除の前後に読み始めた read_pending が反映済みと判定できるよう、しばらくは残しておく。
+        """
+        cutoff = timezone.now() - timedelta(seconds=get_buffer_settings()['SEGMENT_HISTORY_SECONDS'])
+        deleted, _ = PunchJournalSegment.objects.filter(flushed_at__lt=cutoff).exclude(
+            name__in=[path.name for path in self.segments()],
+        ).delete()
+        return deleted
+
+
+def _current_states(journal, keys):
+    """(user_id, date) ごとの、DBの勤怠記録に未反映の打刻を重ねた PunchState"""
+    states, entries = journal.read_pending(keys, lambda: load_punch_states(keys))
+    for entry in entries:
+        state = states[(entry['user_id'], timezone.localtime(entry['timestamp']).date())]
+        state.apply(entry['action'], timezone.localtime(entry['timestamp']), entry['note'])
+    return states
+
+
+def current_state(user, day, journal=None):
+    """DBの勤怠記録に未反映の打刻を重ねた、本人から見た現在の状態"""
+    journal = journal or PunchJournal()
+    with _locked(journal.lock_path, exclusive=False):
+        return _current_states(journal, {(user.pk, day)})[(user.pk, day)]
+
+
+def overlay_pending(record, journal=None):
+    """
+    読み取り専用の勤怠に、本人の未反映の打刻を重ねる。
+    未反映の打刻がある場合は、DBの状態と未反映の打刻を同じロックの中で読み直して重ねる
+    （先に読んだ record とジャーナルの間でライターが反映すると、反映済みの打刻を二重に重ねるため）。
+    """
+    journal = journal or PunchJournal()
+    key = (record.user_id, record.date)
+    with _locked(journal.lock_path, exclusive=False):
+        if not journal.read_pending({key})[1]:
+            return record
+        return _current_states(journal, {key})[key].record
+
+
+def enqueue_punch(user, action, note='', token=None, now=None):
+    """
+    打刻をジャーナルに追記して即時に受付結果を返す（DBへの反映はライターが行う）。
+    同じ社員の打刻が同時に届いても両方が同じ状態で検証されないよう、状態の読み取りから追記までロックを保持する。
+    """
+    now = now or timezone.localtime(timezone.now())
+
+    token_key = None
+    if token:
+        token_key = f'attendance:punch-token:{user.pk}:{token}'
+        if not cache.add(token_key, action, PUNCH_TOKEN_TIMEOUT):
+            return PunchResult(messages.INFO, 'この打刻は既に処理済みです。', duplicate=True)
+
+    journal = PunchJournal()
+    try:
+        with _locked(journal.lock_path):
+            state = _current_states(journal, {(user.pk, now.date())})[(user.pk, now.date())]
+            level, message = state.apply(action, now, note)
+            if level == messages.SUCCESS:
+                journal.append(user.pk, action, now, note, locked=True)
+    except Exception:
+        if token_key:
+            cache.delete(token_key)
+        raise
+
+    if level == messages.SUCCESS:
+        # ライターは別プロセスのため、受付時点でこのプロセスのロースターの購読者へ配る
+        publish_punches_later([(user.pk, now, action)])
+    elif token_key:
+        cache.delete(token_key)
+    return PunchResult(level, message)
+
+
+def enqueue_punch_batch(entries):
+    """
+    apply_punch_batch のジャーナル版。打刻をまとめて検証してジャーナルに追記し、入力順に PunchResult のリストを返す。
+    打刻端末の一括送信も画面の打刻と同じ順序・同じ状態で検証されるよう、ジャーナルのロックを保持して行う。
+    """
+    entries = [
+        dict(entry, timestamp=timezone.localtime(entry['timestamp']))
+        for entry in entries
+    ]
+    results = [None] * len(entries)
+    accepted = []
+    journal = PunchJournal()
+    with _locked(journal.lock_path):
+        states = _current_states(journal, {(entry['user_id'], entry['timestamp'].date()) for entry in entries})
+        for index in sorted(range(len(entries)), key=lambda index: entries[index]['timestamp']):
+            entry = entries[index]
+            state = states[(entry['user_id'], entry['timestamp'].date())]
+            level, message = state.apply(entry['action'], entry['timestamp'], entry.get('note', ''))
+            results[index] = PunchResult(level, message)
+            if level == messages.SUCCESS:
+                accepted.append((entry['user_id'], entry['action'], entry['timestamp'], entry.get('note', '')))
+        journal.append_many(accepted, locked=True)
+    publish_punches_later((user_id, timestamp, action) for user_id, action, timestamp, _ in accepted)
+    return results
@@ -0,0 +1,112 @@
+from datetime import timedelta
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from attendance.archive import (
+    ARCHIVE_BOUNDARIES_CACHE_KEY, ARCHIVE_BREAK_FIELDS, ARCHIVE_RECORD_FIELDS, archive_cutoff, ensure_archive_tables,
+)
+from attendance.models import AttendanceArchive, AttendanceRecord, BreakRecord
+
+
+class Command(BaseCommand):
+    help = (
+        '保存期間を過ぎた確認済の勤怠記録と休憩を、年ごとのアーカイブテーブルへチャンク単位で移します。'
+        '未確認・退勤前・休憩中の記録は移しません。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--horizon-days', type=int, help='この日数より前の記録を移す（省略時は ATTENDANCE_ARCHIVE_HORIZON_DAYS）',
+        )
+        parser.add_argument('--chunk-size', type=int, default=1000, help='1トランザクションで移す勤怠記録の件数')
+        parser.add_argument('--dry-run', action='store_true', help='移さずに年ごとの対象件数だけを表示する')
+
+    def handle(self, *args, **options):
+        if options['horizon_days'] is not None and options['horizon_days'] < 0:
+            raise CommandError('--horizon-days は 0 以上で指定してください。')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size は 1 以上で指定してください。')
+
+        today = timezone.localdate()
+        if options['horizon_days'] is None:
+            cutoff = archive_cutoff(today)
+        else:
+            cutoff = today - timedelta(days=options['horizon_days'])
+        candidates = AttendanceRecord.objects.filter(
+            Q(clock_out__isnull=False) | Q(clock_in__isnull=True),
+            is_read=True,
+            date__lt=cutoff,
+            break_started_at__isnull=True,
+        )
+
+        # 年ごとの対象件数（アーカイブテーブルを先に用意する年にもなる）
+        counts = dict(
+            candidates.values('date__year').annotate(count=Count('id')).order_by('date__year').values_list(
+                'date__year', 'count',
+            )
+        )
+        if options['dry_run']:
+            for year, count in counts.items():
+                self.stdout.write(f'{year}年: {count} 件')
+            self.stdout.write(self.style.SUCCESS(f'{cutoff} より前の {sum(counts.values())} 件が対象です（移していません）。'))
+            return
+
+        # テーブルの作成はチャンクのトランザクションの外で先に済ませる
+        archives = {year: ensure_archive_tables(year) for year in counts}
+
+        moved = 0
+        while True:
+            with transaction.atomic():
+                # 移した記録は消えるため、毎回先頭のチャンクを読めばよい
+                records = list(
+                    candidates.select_for_update().order_by('date', 'id').values(*ARCHIVE_RECORD_FIELDS)[
+                        :options['chunk_size']
+                    ]
+                )
+                if not records:
+                    break
+                record_ids = [record['id'] for record in records]
+                breaks_by_record = {}
+                for row in BreakRecord.objects.filter(attendance_id__in=record_ids).values(*ARCHIVE_BREAK_FIELDS):
+                    breaks_by_record.setdefault(row['attendance_id'], []).append(row)
+
+                records_by_year = {}
+                for record in records:
+                    records_by_year.setdefault(record['date'].year, []).append(record)
+
+                for year, year_records in records_by_year.items():
+                    if year not in archives:
+                        archives[year] = ensure_archive_tables(year)
+                    record_model, break_model = archives[year]
+                    # 途中で失敗して再実行した場合に備え、移し済みの行は無視する（件数には実際に加えた行だけを数える）
+                    year_ids = [record['id'] for record in year_records]
+                    archived = record_model.objects.filter(pk__in=year_ids).count()
+                    record_model.objects.bulk_create(
+                        [record_model(**record) for record in year_records], ignore_conflicts=True,
+                    )
+                    inserted = record_model.objects.filter(pk__in=year_ids).count() - archived
+                    break_model.objects.bulk_create(
+                        [
+                            break_model(**row)
+                            for record in year_records
+                            for row in breaks_by_record.get(record['id'], [])
+                        ],
+                        ignore_conflicts=True,
+                    )
+                    last_date = max(record['date'] for record in year_records)
+                    AttendanceArchive.objects.get_or_create(year=year)
+                    AttendanceArchive.objects.filter(year=year).update(
+                        record_count=F('record_count') + inserted,
+                        last_date=Greatest(Coalesce(F('last_date'), last_date), last_date),
+                        archived_at=timezone.now(),
+                    )
+
+                # 休憩は外部キーの CASCADE で一緒に消える
+                AttendanceRecord.objects.filter(pk__in=record_ids).delete()
+                transaction.on_commit(lambda: cache.delete(ARCHIVE_BOUNDARIES_CACHE_KEY))
+                moved += len(records)
+
+        self.stdout.write(self.style.SUCCESS(f'{cutoff} より前の勤怠記録 {moved} 件をアーカイブへ移しました。'))
@@ -0,0 +1,121 @@
+import http.client
+import threading
+import time
+from urllib.parse import urlsplit
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+CustomUser = get_user_model()
+
+# (名前, 同期ビューのURL名, 非同期ビューのURL名)
+BENCH_PAGES = [
+    ('dashboard', 'attendance:dashboard', 'attendance:dashboard_async'),
+    ('notifications', 'notifications:notification_list', 'notifications:notification_list_async'),
+    ('profiles', 'accounts:profile_list', 'accounts:profile_list_async'),
+]
+
+
+def percentile(sorted_values, ratio):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * ratio))]
+
+
+def run_load(base_url, path, cookie, concurrency, duration):
+    """concurrency 本の接続で duration 秒間 GET を繰り返し、(件数, エラー件数, 応答時間のリスト) を返す"""
+    parts = urlsplit(base_url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    headers = {'Cookie': cookie, 'Connection': 'keep-alive'}
+    deadline = time.perf_counter() + duration
+    results = []
+    lock = threading.Lock()
+
+    def worker():
+        latencies = []
+        errors = 0
+        connection = connection_class(parts.hostname, parts.port, timeout=30)
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors += 1
+            except (OSError, http.client.HTTPException):
+                errors += 1
+                connection.close()
+                connection = connection_class(parts.hostname, parts.port, timeout=30)
+                continue
+            latencies.append(time.perf_counter() - started)
+        connection.close()
+        with lock:
+            results.append((latencies, errors))
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies = sorted(latency for worker_latencies, _ in results for latency in worker_latencies)
+    return len(latencies), sum(errors for _, errors in results), latencies
+
+
+class Command(BaseCommand):
+    help = (
+        '起動済みの WSGI サーバーと ASGI サーバー（uvicorn）に同じ画面へ同時に GET を送り、'
+        '秒間リクエスト数と p50 / p99 の応答時間を比較します。WSGI には同期ビュー、ASGI には同期・非同期の両方のビューを送ります。'
+        '例: gunicorn attendance_management.wsgi -w 4 -b :8000 / '
+        'uvicorn attendance_management.asgi:application --workers 4 --port 8001'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wsgi-url', default='http://127.0.0.1:8000', help='WSGI サーバーのURL（空文字で省略）')
+        parser.add_argument('--asgi-url', default='http://127.0.0.1:8001', help='ASGI サーバーのURL（空文字で省略）')
+        parser.add_argument('--concurrency', type=int, default=32, help='同時接続数')
+        parser.add_argument('--duration', type=float, default=10, help='1画面あたりの計測秒数')
+        parser.add_argument('--username', default='bench-hr', help='計測に使う人事ユーザー（なければ作成する）')
+        parser.add_argument('--pages', nargs='+', choices=[name for name, _, _ in BENCH_PAGES], help='計測する画面')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['duration'] <= 0:
+            raise CommandError('--concurrency と --duration には正の値を指定してください。')
+        targets = []
+        for name, sync_url, async_url in BENCH_PAGES:
+            if options['pages'] and name not in options['pages']:
+                continue
+            if options['wsgi_url']:
+                targets.append((f'{name}/wsgi', options['wsgi_url'], reverse(sync_url)))
+            if options['asgi_url']:
+                # ASGI で同期ビューを動かす場合（スレッドで実行される）と非同期ビューの両方を測る
+                targets.append((f'{name}/asgi-sync', options['asgi_url'], reverse(sync_url)))
+                targets.append((f'{name}/asgi-async', options['asgi_url'], reverse(async_url)))
+        if not targets:
+            raise CommandError('--wsgi-url か --asgi-url のどちらかを指定してください。')
+
+        # 各サーバーは同じデータベースを使うため、ここで作ったセッションでログイン済みになる
+        user, _ = CustomUser.objects.get_or_create(
+            username=options['username'],
+            defaults={'employee_number': options['username'], 'full_name': options['username'], 'role': 'hr'},
+        )
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        cookie = f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+        self.stdout.write(f"{'':28}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+        try:
+            for label, base_url, path in targets:
+                count, errors, latencies = run_load(base_url, path, cookie, options['concurrency'], options['duration'])
+                self.stdout.write(
+                    f'{label:28}{count:>10}{errors:>8}{count / options["duration"]:>10.1f}'
+                    f'{percentile(latencies, 0.5) * 1000:>10.1f}{percentile(latencies, 0.99) * 1000:>10.1f}'
+                )
+        finally:
+            session.delete()
@@ -0,0 +1,65 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+from attendance.cache import get_today_record, today_cache_key
+from attendance.models import AttendanceRecord
+
+CustomUser = get_user_model()
+
+
+class StatementCounter:
+    """実行されたSQLを読み取り・書き込みに分けて数える"""
+
+    def __init__(self):
+        self.reads = 0
+        self.writes = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        if sql.lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE')):
+            self.writes += 1
+        else:
+            self.reads += 1
+        return execute(sql, params, many, context)
+
+
+def legacy_dashboard_get(user, day):
+    """変更前の打刻画面の表示処理（get_or_create と進行中の休憩の取得）"""
+    record, _ = AttendanceRecord.objects.get_or_create(user=user, date=day)
+    record.breaks.filter(end_time__isnull=True).first()
+
+
+class Command(BaseCommand):
+    help = (
+        '打刻画面の表示だけで発生する書き込み件数を、変更前（get_or_create）と現在（読み取り専用＋キャッシュ）で比較します。'
+        '計測用のデータはトランザクションごとロールバックされます。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200, help='打刻画面を開く社員数')
+        parser.add_argument('--views', type=int, default=5, help='1人あたりの表示回数')
+
+    def handle(self, *args, **options):
+        day = timezone.localdate()
+        rows = []
+
+        for label, load in (('before', legacy_dashboard_get), ('after', get_today_record)):
+            counter = StatementCounter()
+            with transaction.atomic():
+                users = CustomUser.objects.bulk_create([
+                    CustomUser(username=f'bench-{label}-{i}', employee_number=f'bench-{label}-{i}', full_name=f'bench {i}')
+                    for i in range(options['users'])
+                ])
+                with connection.execute_wrapper(counter):
+                    for _ in range(options['views']):
+                        for user in users:
+                            load(user, day)
+                created = AttendanceRecord.objects.filter(user__in=users).count()
+                transaction.set_rollback(True)
+            cache.delete_many([today_cache_key(user.pk, day) for user in users])
+            rows.append((label, counter.reads, counter.writes, created))
+
+        self.stdout.write(f"{'':8}{'reads':>10}{'writes':>10}{'records':>10}")
+        for label, reads, writes, created in rows:
+            self.stdout.write(f'{label:8}{reads:>10}{writes:>10}{created:>10}')
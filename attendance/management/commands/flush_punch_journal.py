@@ -0,0 +1,34 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+from attendance.journal import PunchJournal, get_buffer_settings
+
+
+class Command(BaseCommand):
+    help = (
+        '打刻ジャーナルをDBへ一括反映します。起動時に前回中断したセグメントを再生します。'
+        'PUNCH_BUFFER の ENABLED を有効にした環境で常駐させてください。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='1回だけ反映して終了する')
+        parser.add_argument('--interval', type=float, help='反映間隔（秒）。省略時は PUNCH_BUFFER の FLUSH_INTERVAL')
+
+    def handle(self, *args, **options):
+        interval = options['interval'] or get_buffer_settings()['FLUSH_INTERVAL']
+        journal = PunchJournal()
+
+        while True:
+            try:
+                flushed = journal.flush()
+            except BlockingIOError:
+                raise CommandError('別のライターが実行中です。ライターは1プロセスのみ起動してください。')
+            except DatabaseError as e:
+                # 反映できなかったセグメントは残るため、次回の反映で再試行される
+                self.stderr.write(f'打刻の反映に失敗しました: {e}')
+                flushed = 0
+            if flushed:
+                self.stdout.write(f'{flushed} 件の打刻を反映しました。')
+            if options['once']:
+                break
+            time.sleep(interval)
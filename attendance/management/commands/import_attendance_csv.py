@@ -0,0 +1,36 @@
+import csv
+from django.core.management.base import BaseCommand, CommandError
+from attendance.imports import IMPORT_CHUNK_SIZE, IMPORT_MODES, import_attendance_csv
+
+
+class Command(BaseCommand):
+    help = '勤怠記録のCSVをチャンク単位で取り込みます。取り込めなかった行は行番号とエラー内容を出力します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='取り込むCSVファイル')
+        parser.add_argument('--mode', choices=[mode for mode, _ in IMPORT_MODES], default='ignore',
+                            help='登録済みの社員・日付の扱い（ignore: スキップ / update: 上書き）')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, help='1トランザクションで処理する行数')
+        parser.add_argument('--report', help='エラー行を書き出すCSVファイル')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], 'rb') as file:
+                result = import_attendance_csv(file, mode=options['mode'], chunk_size=options['chunk_size'])
+        except OSError as e:
+            raise CommandError(f'ファイルを開けません: {e}')
+
+        if options['report']:
+            with open(options['report'], 'w', encoding='utf-8', newline='') as report:
+                writer = csv.writer(report)
+                writer.writerow(['行', 'エラー内容'])
+                writer.writerows(result.errors)
+        else:
+            for line, message in result.errors:
+                self.stderr.write(f'{line}行目: {message}')
+        if result.errors_truncated:
+            self.stderr.write(f'エラーは先頭の {len(result.errors)} 行のみ出力しています。')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'新規 {result.created} 件、上書き {result.updated} 件、スキップ {result.skipped} 件、エラー {result.error_count} 行'
+        ))
@@ -0,0 +1,73 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from attendance.models import AttendanceRecord, BreakRecord
+from attendance.changes import records_changed
+
+
+class Command(BaseCommand):
+    help = '休憩記録から勤怠記録の休憩合計・進行中の休憩・実働時間をチャンク単位で再集計します。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='1トランザクションで処理する勤怠記録の件数')
+        parser.add_argument('--verify', action='store_true', help='更新せずに不一致の件数だけを報告する')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        verify = options['verify']
+        checked = mismatched = 0
+        last_pk = 0
+
+        while True:
+            with transaction.atomic():
+                records = list(
+                    AttendanceRecord.objects.filter(pk__gt=last_pk).order_by('pk').only(
+                        'pk', 'user', 'date', 'clock_in', 'clock_out', 'total_work_time', 'break_total', 'break_started_at',
+                    )[:chunk_size]
+                )
+                if not records:
+                    break
+                last_pk = records[-1].pk
+
+                # チャンク内の休憩は1クエリでまとめて取得する
+                totals = {}
+                open_starts = {}
+                breaks = BreakRecord.objects.filter(
+                    attendance_id__in=[record.pk for record in records],
+                ).values_list('attendance_id', 'start_time', 'end_time')
+                for attendance_id, start_time, end_time in breaks:
+                    if end_time:
+                        totals[attendance_id] = totals.get(attendance_id, timedelta()) + (end_time - start_time)
+                    elif attendance_id not in open_starts or start_time > open_starts[attendance_id]:
+                        open_starts[attendance_id] = start_time
+
+                changed = []
+                for record in records:
+                    break_total = totals.get(record.pk, timedelta())
+                    break_started_at = open_starts.get(record.pk)
+                    total_work_time = record.total_work_time
+                    if record.clock_in and record.clock_out:
+                        total_work_time = record.clock_out - record.clock_in - break_total
+
+                    if (record.break_total, record.break_started_at, record.total_work_time) != (
+                        break_total, break_started_at, total_work_time,
+                    ):
+                        record.break_total = break_total
+                        record.break_started_at = break_started_at
+                        record.total_work_time = total_work_time
+                        changed.append(record)
+
+                checked += len(records)
+                mismatched += len(changed)
+                if changed and not verify:
+                    AttendanceRecord.objects.bulk_update(
+                        changed, ['break_total', 'break_started_at', 'total_work_time'],
+                    )
+                    records_changed([(record.user_id, record.date) for record in changed])
+
+        if verify:
+            if mismatched:
+                raise CommandError(f'{checked} 件中 {mismatched} 件の休憩合計が一致しません。')
+            self.stdout.write(self.style.SUCCESS(f'{checked} 件の休憩合計はすべて一致しています。'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'{checked} 件を確認し、{mismatched} 件を更新しました。'))
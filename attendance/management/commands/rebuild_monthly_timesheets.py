@@ -0,0 +1,91 @@
+import heapq
+from operator import itemgetter
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from attendance.archive import archive_years, archive_models
+from attendance.models import AttendanceRecord, MonthlyTimesheet
+from attendance.rollups import ROLLUP_FIELDS, month_range, summarize
+
+
+class Command(BaseCommand):
+    help = '勤怠記録から月次勤怠集計をまとめて作り直します。社員・日付順に読み、チャンクごとのトランザクションで書き込みます。'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--year', type=int, help='対象の年（省略時はすべて）')
+        parser.add_argument('--month', type=int, help='対象の月（--year と併用）')
+        parser.add_argument('--chunk-size', type=int, default=500, help='1トランザクションで書き込む・削除する月次集計の件数')
+
+    def handle(self, *args, **options):
+        year, month = options['year'], options['month']
+        if month and not year:
+            raise CommandError('--month は --year と一緒に指定してください。')
+        if month and not 1 <= month <= 12:
+            raise CommandError('--month は 1〜12 で指定してください。')
+
+        # 現行テーブルと、対象の年のアーカイブを読む
+        sources = [AttendanceRecord.objects.all()]
+        sources += [archive_models(archived)[0].objects.all() for archived in archive_years() if archived == year or not year]
+        timesheets = MonthlyTimesheet.objects.all()
+        if year:
+            if month:
+                first, following = month_range(year, month)
+                timesheets = timesheets.filter(year=year, month=month)
+            else:
+                first, following = month_range(year, 1)[0], month_range(year + 1, 1)[0]
+                timesheets = timesheets.filter(year=year)
+            sources = [source.filter(date__gte=first, date__lt=following) for source in sources]
+
+        # それぞれ社員・日付順に読み、社員・日付順のまま突き合わせる
+        rows = heapq.merge(
+            *(
+                source.order_by('user_id', 'date').values_list(
+                    'user_id', 'date', 'clock_in', 'clock_out', 'total_work_time', 'break_total',
+                ).iterator(chunk_size=2000)
+                for source in sources
+            ),
+            key=itemgetter(0, 1),
+        )
+
+        # 集計はチャンクごとに別々のトランザクションで書き込み、書き込みロックを短く保つ
+        started_at = timezone.now()
+        pending = []
+        written = 0
+        current_key = None
+        month_rows = []
+        for user_id, *row in rows:
+            key = (user_id, row[0].year, row[0].month)
+            if key != current_key:
+                if current_key:
+                    pending.append(self.build(current_key, month_rows))
+                current_key, month_rows = key, []
+            month_rows.append(row)
+            if len(pending) >= options['chunk_size']:
+                written += self.write(pending)
+                pending = []
+        if current_key:
+            pending.append(self.build(current_key, month_rows))
+        written += self.write(pending)
+
+        # 記録のなくなった月の集計を消す（作り直しの間に打刻などで更新された集計は残す）
+        deleted = 0
+        stale = timesheets.filter(updated_at__lt=started_at).order_by('pk').values_list('pk', flat=True)
+        while pks := list(stale[:options['chunk_size']]):
+            with transaction.atomic():
+                deleted += MonthlyTimesheet.objects.filter(pk__in=pks).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f'{written} 件の月次勤怠集計を作成し、{deleted} 件を削除しました。'))
+
+    def build(self, key, rows):
+        user_id, year, month = key
+        return MonthlyTimesheet(user_id=user_id, year=year, month=month, **summarize(rows))
+
+    def write(self, timesheets):
+        with transaction.atomic():
+            MonthlyTimesheet.objects.bulk_create(
+                timesheets,
+                update_conflicts=True,
+                unique_fields=['user', 'year', 'month'],
+                update_fields=[*ROLLUP_FIELDS, 'updated_at'],
+            )
+        return len(timesheets)
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+from attendance.counters import counted_unread_deltas
+from attendance.models import AttendanceRecord, UnreadRecordCounter
+
+
+class Command(BaseCommand):
+    help = (
+        '未確認の勤怠記録を集計し直して未確認件数と比較します。'
+        '管理画面を通さない一括更新・削除などで生じたずれを検出し、--fix で修正します。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='ずれがあった集計キーを実際の件数で上書きする')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='一度に読み込む社員ごとの集計行の件数')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rows = AttendanceRecord.objects.filter(is_read=False).order_by().values_list('user_id').annotate(
+                count=Count('id'),
+            ).iterator(chunk_size=options['chunk_size'])
+            actual = counted_unread_deltas(rows)
+            stored = dict(UnreadRecordCounter.objects.values_list('key', 'count'))
+
+            drift = {
+                key: (stored.get(key, 0), actual.get(key, 0))
+                for key in set(actual) | set(stored)
+                if stored.get(key, 0) != actual.get(key, 0)
+            }
+            for key, (stored_count, actual_count) in sorted(drift.items()):
+                self.stdout.write(f'{key}: 集計値 {stored_count} / 実件数 {actual_count}')
+
+            if drift and options['fix']:
+                UnreadRecordCounter.objects.filter(key__in=drift).delete()
+                UnreadRecordCounter.objects.bulk_create([
+                    UnreadRecordCounter(key=key, count=actual_count)
+                    for key, (_, actual_count) in drift.items()
+                    if actual_count
+                ])
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('未確認件数にずれはありません。'))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f'{len(drift)} 件の集計キーを修正しました。'))
+        else:
+            raise CommandError(f'{len(drift)} 件の集計キーにずれがあります。--fix で修正できます。')
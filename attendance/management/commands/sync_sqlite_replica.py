@@ -0,0 +1,35 @@
+import sqlite3
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from attendance_management.db_router import replica_aliases
+
+
+class Command(BaseCommand):
+    help = (
+        'ローカル確認用に、プライマリのSQLiteファイルをレプリカのSQLiteファイルへ複製します。'
+        '本番のレプリカはデータベースのレプリケーションで同期するため、このコマンドは使いません。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--replica', help='複製先の別名（省略時は READ_REPLICA の REPLICAS すべて）')
+
+    def handle(self, *args, **options):
+        aliases = [options['replica']] if options['replica'] else replica_aliases()
+        if not aliases:
+            raise CommandError('READ_REPLICA の REPLICAS にレプリカが設定されていません。')
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != 'sqlite':
+            raise CommandError('プライマリが SQLite の場合だけ使えます。')
+
+        primary.ensure_connection()
+        for alias in aliases:
+            if alias not in connections or connections[alias].vendor != 'sqlite':
+                raise CommandError(f'{alias} は SQLite のデータベースではありません。')
+            # 読み込み中の接続を閉じてから、SQLite のバックアップAPIでファイルごと複製する
+            connections[alias].close()
+            target = sqlite3.connect(connections[alias].settings_dict['NAME'])
+            try:
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            self.stdout.write(self.style.SUCCESS(f'{alias} にプライマリを複製しました。'))
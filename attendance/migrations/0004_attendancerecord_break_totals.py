@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:18
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0003_alter_breakrecord_end_time'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendancerecord',
+            name='break_started_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='休憩開始（進行中）'),
+        ),
+        migrations.AddField(
+            model_name='attendancerecord',
+            name='break_total',
+            field=models.DurationField(default=datetime.timedelta, verbose_name='休憩合計'),
+        ),
+    ]
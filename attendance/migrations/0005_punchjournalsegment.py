@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0004_attendancerecord_break_totals'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PunchJournalSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='セグメント名')),
+                ('entry_count', models.PositiveIntegerField(default=0, verbose_name='打刻件数')),
+                ('flushed_at', models.DateTimeField(auto_now_add=True, verbose_name='反映日時')),
+            ],
+            options={
+                'verbose_name': '打刻ジャーナル反映履歴',
+                'verbose_name_plural': '打刻ジャーナル反映履歴',
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0007_list_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnreadRecordCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True, verbose_name='集計キー')),
+                ('count', models.IntegerField(default=0, verbose_name='未確認件数')),
+            ],
+            options={
+                'verbose_name': '未確認件数',
+                'verbose_name_plural': '未確認件数',
+            },
+        ),
+    ]
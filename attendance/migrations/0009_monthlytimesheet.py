@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:28
+
+import datetime
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0008_unreadrecordcounter'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyTimesheet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField(verbose_name='年')),
+                ('month', models.PositiveSmallIntegerField(verbose_name='月')),
+                ('total_work_time', models.DurationField(default=datetime.timedelta, verbose_name='実働時間合計')),
+                ('total_break_time', models.DurationField(default=datetime.timedelta, verbose_name='休憩時間合計')),
+                ('days_worked', models.PositiveIntegerField(default=0, verbose_name='出勤日数')),
+                ('late_arrivals', models.PositiveIntegerField(default=0, verbose_name='遅刻')),
+                ('early_leaves', models.PositiveIntegerField(default=0, verbose_name='早退')),
+                ('missing_clock_outs', models.PositiveIntegerField(default=0, verbose_name='退勤打刻漏れ')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='集計日時')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_timesheets', to=settings.AUTH_USER_MODEL, verbose_name='社員')),
+            ],
+            options={
+                'verbose_name': '月次勤怠集計',
+                'verbose_name_plural': '月次勤怠集計',
+                'ordering': ['year', 'month'],
+                'indexes': [models.Index(fields=['year', 'month'], name='timesheet_year_month_idx')],
+                'unique_together': {('user', 'year', 'month')},
+            },
+        ),
+    ]
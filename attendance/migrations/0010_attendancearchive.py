@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0009_monthlytimesheet'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField(unique=True, verbose_name='年')),
+                ('record_count', models.PositiveIntegerField(default=0, verbose_name='勤怠記録件数')),
+                ('archived_at', models.DateTimeField(auto_now=True, verbose_name='最終アーカイブ日時')),
+            ],
+            options={
+                'verbose_name': '勤怠アーカイブ',
+                'verbose_name_plural': '勤怠アーカイブ',
+                'ordering': ['year'],
+            },
+        ),
+    ]
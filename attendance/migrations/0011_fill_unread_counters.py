@@ -0,0 +1,32 @@
+from collections import Counter
+from django.db import migrations
+from django.db.models import Count
+
+# attendance.counters.COMPANY_SHARDS と同じ（後から変更されても移行の結果が変わらないよう複製している）
+COMPANY_SHARDS = 16
+
+
+def fill_counters(apps, schema_editor):
+    # 既存の未確認の記録から件数を作り直す（部署ごとの集計キーは廃止したため削除する）
+    AttendanceRecord = apps.get_model('attendance', 'AttendanceRecord')
+    UnreadRecordCounter = apps.get_model('attendance', 'UnreadRecordCounter')
+    counts = Counter()
+    rows = AttendanceRecord.objects.filter(is_read=False).order_by().values_list('user_id').annotate(count=Count('id'))
+    for user_id, count in rows:
+        counts[f'company:{user_id % COMPANY_SHARDS}'] += count
+        counts[f'user:{user_id}'] += count
+    UnreadRecordCounter.objects.all().delete()
+    UnreadRecordCounter.objects.bulk_create([
+        UnreadRecordCounter(key=key, count=count) for key, count in counts.items()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0010_attendancearchive'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
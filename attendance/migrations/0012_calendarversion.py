@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:36
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_managerscopeversion'),
+        ('attendance', '0011_fill_unread_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarVersion',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='calendar_version', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='社員')),
+                ('updated_at', models.DateTimeField(verbose_name='更新日時')),
+            ],
+            options={
+                'verbose_name': 'カレンダー更新日時',
+                'verbose_name_plural': 'カレンダー更新日時',
+            },
+        ),
+    ]
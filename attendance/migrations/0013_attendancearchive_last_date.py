@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:39
+
+from django.db import migrations, models
+
+
+def fill_last_dates(apps, schema_editor):
+    # 導入前にアーカイブ済みの年は、アーカイブテーブルの最大の日付を最終日とする
+    AttendanceArchive = apps.get_model('attendance', 'AttendanceArchive')
+    connection = schema_editor.connection
+    tables = set(connection.introspection.table_names())
+    for archive in AttendanceArchive.objects.filter(last_date__isnull=True):
+        table = f'attendance_archive_{archive.year}'
+        if table not in tables:
+            continue
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT MAX("date") FROM {connection.ops.quote_name(table)}')
+            last_date = cursor.fetchone()[0]
+        if last_date:
+            archive.last_date = models.DateField().to_python(last_date)
+            archive.save(update_fields=['last_date'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0012_calendarversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendancearchive',
+            name='last_date',
+            field=models.DateField(blank=True, null=True, verbose_name='アーカイブ済みの最終日'),
+        ),
+        migrations.RunPython(fill_last_dates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:58
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0013_attendancearchive_last_date'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='monthlytimesheet',
+            name='missing_clock_outs',
+        ),
+    ]
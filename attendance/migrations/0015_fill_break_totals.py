@@ -0,0 +1,99 @@
+from collections import defaultdict
+from datetime import timedelta
+from django.db import migrations
+from django.db.models import Q, Sum
+
+CHUNK_SIZE = 1000
+
+
+def fill_records(record_model, break_model, using):
+    """
+    休憩記録から休憩合計（終了済みの休憩の合計）と進行中の休憩の開始時刻を求め、値の異なる勤怠記録だけを更新する。
+    実働時間も同じ休憩合計で計算し直し、更新した記録の (user_id, 年, 月) を返す。
+    """
+    totals = defaultdict(timedelta)
+    started = {}
+    for attendance_id, start_time, end_time in break_model.objects.using(using).order_by().values_list(
+        'attendance_id', 'start_time', 'end_time',
+    ).iterator(chunk_size=CHUNK_SIZE):
+        if end_time:
+            totals[attendance_id] += end_time - start_time
+        elif attendance_id not in started or start_time > started[attendance_id]:
+            started[attendance_id] = start_time
+
+    fields = ['break_total', 'total_work_time']
+    # アーカイブの記録には進行中の休憩の項目がない（休憩が終わった記録だけを写す）
+    if any(field.name == 'break_started_at' for field in record_model._meta.concrete_fields):
+        fields.append('break_started_at')
+    changed_keys = set()
+    pending = []
+    # 休憩記録のある記録と、休憩記録がないのに休憩合計が 0 でない記録だけを読む
+    candidates = record_model.objects.using(using).filter(
+        Q(pk__in=break_model.objects.using(using).values('attendance_id')) | ~Q(break_total=timedelta()),
+    )
+    for record in candidates.only('id', 'user_id', 'date', 'clock_in', 'clock_out', *fields).iterator(
+        chunk_size=CHUNK_SIZE,
+    ):
+        values = {'break_total': totals.get(record.pk, timedelta())}
+        if 'break_started_at' in fields:
+            values['break_started_at'] = started.get(record.pk)
+        if record.clock_in and record.clock_out:
+            values['total_work_time'] = record.clock_out - record.clock_in - values['break_total']
+        else:
+            values['total_work_time'] = record.total_work_time
+        if all(getattr(record, field) == value for field, value in values.items()):
+            continue
+        for field, value in values.items():
+            setattr(record, field, value)
+        pending.append(record)
+        changed_keys.add((record.user_id, record.date.year, record.date.month))
+        if len(pending) >= CHUNK_SIZE:
+            record_model.objects.using(using).bulk_update(pending, fields)
+            pending = []
+    record_model.objects.using(using).bulk_update(pending, fields)
+    return changed_keys
+
+
+def refresh_timesheets(MonthlyTimesheet, record_model, keys, using):
+    # 休憩合計が変わった月の月次集計の休憩・実働の合計を合わせる
+    for user_id, year, month in keys:
+        sums = record_model.objects.using(using).filter(
+            user_id=user_id, date__year=year, date__month=month,
+        ).aggregate(work=Sum('total_work_time'), rest=Sum('break_total'))
+        MonthlyTimesheet.objects.using(using).filter(user_id=user_id, year=year, month=month).update(
+            total_work_time=sums['work'] or timedelta(),
+            total_break_time=sums['rest'] or timedelta(),
+        )
+
+
+def fill_break_totals(apps, schema_editor):
+    # 0004 で追加した休憩合計・進行中の休憩を既存の休憩記録から埋める（追加時は既定値のままだった）
+    from attendance.archive import archive_models
+
+    AttendanceRecord = apps.get_model('attendance', 'AttendanceRecord')
+    BreakRecord = apps.get_model('attendance', 'BreakRecord')
+    AttendanceArchive = apps.get_model('attendance', 'AttendanceArchive')
+    MonthlyTimesheet = apps.get_model('attendance', 'MonthlyTimesheet')
+    using = schema_editor.connection.alias
+
+    keys = fill_records(AttendanceRecord, BreakRecord, using)
+    refresh_timesheets(MonthlyTimesheet, AttendanceRecord, keys, using)
+
+    # アーカイブ済みの年も、アーカイブ時に写した休憩合計を直す
+    tables = set(schema_editor.connection.introspection.table_names())
+    for year in AttendanceArchive.objects.using(using).values_list('year', flat=True):
+        record_model, break_model = archive_models(year)
+        if {record_model._meta.db_table, break_model._meta.db_table} <= tables:
+            keys = fill_records(record_model, break_model, using)
+            refresh_timesheets(MonthlyTimesheet, record_model, keys, using)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0014_remove_monthlytimesheet_missing_clock_outs'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_break_totals, migrations.RunPython.noop),
+    ]
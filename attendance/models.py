@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
@@ -14,6 +14,9 @@ class AttendanceRecord(models.Model):
     clock_in = models.DateTimeField(blank=True, null=True, verbose_name='出勤時刻')
     clock_out = models.DateTimeField(blank=True, null=True, verbose_name='退勤時刻')
     total_work_time = models.DurationField(blank=True, null=True, verbose_name='実働時間')
+    # 休憩終了のたびに加算する終了済み休憩の合計と、進行中の休憩の開始時刻
+    break_total = models.DurationField(default=timedelta, verbose_name='休憩合計')
+    break_started_at = models.DateTimeField(blank=True, null=True, verbose_name='休憩開始（進行中）')
     note = models.TextField(blank=True, verbose_name='備考')
     is_read = models.BooleanField(default=False, verbose_name='既読')
     read_at = models.DateTimeField(blank=True, null=True)
@@ -29,18 +32,55 @@ class AttendanceRecord(models.Model):
     class Meta:
         unique_together = ('user', 'date')
         ordering = ['-date']
+        indexes = [
+            # 一覧のシーク方式ページ送り (date, id) 用
+            models.Index(fields=['date', 'id'], name='attendance_date_id_idx'),
+            # 上司一覧の日付＋確認状況の絞り込み用
+            models.Index(fields=['date', 'is_read'], name='attendance_date_read_idx'),
+            # 未確認件数の集計用（未確認の行だけを持つ部分インデックス）
+            models.Index(fields=['date'], condition=models.Q(is_read=False), name='attendance_unread_date_idx'),
+        ]
         verbose_name = '勤怠記録'
         verbose_name_plural = '勤怠記録'
     
+    # アーカイブテーブルの記録（attendance.archive）と区別するため
+    is_archived = False
+
     def __str__(self):
         return f'{self.user.full_name} - {self.date}'
     
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'clock_in', 'clock_out', 'break_total'} & set(update_fields):
+            # 人事の修正や管理画面で出退勤時刻・休憩合計を直接変更した場合も実働時間を合わせる
+            self.total_work_time = self.work_time()
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'total_work_time'}
+        super().save(*args, **kwargs)
+
+    def work_time(self):
+        if self.clock_in and self.clock_out:
+            return self.clock_out - self.clock_in - self.break_total
+        return None
+
     def calculate_total_work_time(self):
         if self.clock_in and self.clock_out:
-            total = self.clock_out - self.clock_in
-            total_break = sum((b.duration for b in self.breaks.all()), timedelta())
-            self.total_work_time = total - total_break
-            self.save()
+            self.total_work_time = self.work_time()
+            self.save(update_fields=['total_work_time'])
+
+    def sync_breaks(self):
+        """休憩記録から休憩合計・進行中の休憩を計算し直し、実働時間とともに保存する"""
+        break_total = timedelta()
+        break_started_at = None
+        for start_time, end_time in BreakRecord.objects.filter(attendance_id=self.pk).values_list('start_time', 'end_time'):
+            if end_time:
+                break_total += end_time - start_time
+            elif break_started_at is None or start_time > break_started_at:
+                break_started_at = start_time
+        self.break_total = break_total
+        self.break_started_at = break_started_at
+        self.save(update_fields=['break_total', 'break_started_at'])
+
     @property
     def formatted_work_time(self):
         if not self.total_work_time:
@@ -66,6 +106,32 @@ class BreakRecord(models.Model):
     
     def __str__(self):
         return f"{self.attendance.user.full_name} - {self.start_time.strftime('%Y-%m-%d %H:%M')}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 管理画面で別の勤怠記録へ付け替えた場合に、元の記録も集計し直すため
+        instance._loaded_attendance_id = instance.__dict__.get('attendance_id')
+        return instance
+
+    def save(self, *args, **kwargs):
+        """
+        休憩記録を直接登録・変更した場合（管理画面など）に、勤怠記録の休憩合計と実働時間を合わせる。
+        打刻・取込は休憩合計を自分で更新するため bulk_create で登録し、ここを通らない。
+        """
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            previous_id = getattr(self, '_loaded_attendance_id', None)
+            if previous_id and previous_id != self.attendance_id:
+                AttendanceRecord.objects.get(pk=previous_id).sync_breaks()
+            self.attendance.sync_breaks()
+        self._loaded_attendance_id = self.attendance_id
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            self.attendance.sync_breaks()
+        return result
     
     @property
     def duration(self):
@@ -80,4 +146,120 @@ class BreakRecord(models.Model):
         total_seconds = int(self.duration.total_seconds())
         hours, remainder = divmod(total_seconds, 3600)
         minutes, _ = divmod(remainder, 60)
-        return f'{hours}時間{minutes}分' if hours > 0 else f'{minutes}分'
\ No newline at end of file
+        return f'{hours}時間{minutes}分' if hours > 0 else f'{minutes}分'
+
+class PunchJournalSegment(models.Model):
+    name = models.CharField(max_length=100, unique=True, verbose_name='セグメント名')
+    entry_count = models.PositiveIntegerField(default=0, verbose_name='打刻件数')
+    flushed_at = models.DateTimeField(auto_now_add=True, verbose_name='反映日時')
+
+    class Meta:
+        verbose_name = '打刻ジャーナル反映履歴'
+        verbose_name_plural = '打刻ジャーナル反映履歴'
+
+    def __str__(self):
+        return self.name
+
+
+class UnreadRecordCounter(models.Model):
+    """
+    未確認の勤怠記録の件数。キーは次のいずれか。
+    company:<社員IDを COMPANY_SHARDS で割った余り>（合計が全社の件数） / user:<社員ID>
+    """
+    key = models.CharField(max_length=64, unique=True, verbose_name='集計キー')
+    count = models.IntegerField(default=0, verbose_name='未確認件数')
+
+    class Meta:
+        verbose_name = '未確認件数'
+        verbose_name_plural = '未確認件数'
+
+    def __str__(self):
+        return f'{self.key}: {self.count}'
+
+
+class MonthlyTimesheet(models.Model):
+    """社員ごと・月ごとの勤怠集計（勤怠記録の変更時にその月だけ再集計する）"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='monthly_timesheets',
+        verbose_name='社員',
+    )
+    year = models.PositiveSmallIntegerField(verbose_name='年')
+    month = models.PositiveSmallIntegerField(verbose_name='月')
+    total_work_time = models.DurationField(default=timedelta, verbose_name='実働時間合計')
+    total_break_time = models.DurationField(default=timedelta, verbose_name='休憩時間合計')
+    days_worked = models.PositiveIntegerField(default=0, verbose_name='出勤日数')
+    late_arrivals = models.PositiveIntegerField(default=0, verbose_name='遅刻')
+    early_leaves = models.PositiveIntegerField(default=0, verbose_name='早退')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='集計日時')
+
+    # 退勤打刻漏れは日付が変わるだけで増えるため保存せず、表示時に rollups.attach_missing_clock_outs で設定する
+    missing_clock_outs = 0
+
+    class Meta:
+        unique_together = ('user', 'year', 'month')
+        ordering = ['year', 'month']
+        indexes = [
+            models.Index(fields=['year', 'month'], name='timesheet_year_month_idx'),
+        ]
+        verbose_name = '月次勤怠集計'
+        verbose_name_plural = '月次勤怠集計'
+
+    def __str__(self):
+        return f'{self.user.full_name} - {self.year}年{self.month}月'
+
+    @staticmethod
+    def format_duration(value):
+        if not value:
+            return '-'
+        total_seconds = int(value.total_seconds())
+        hours, remainder = divmod(total_seconds, 3600)
+        minutes, _ = divmod(remainder, 60)
+        return f'{hours}時間{minutes}分' if hours > 0 else f'{minutes}分'
+
+    @property
+    def formatted_work_time(self):
+        return self.format_duration(self.total_work_time)
+
+    @property
+    def formatted_break_time(self):
+        return self.format_duration(self.total_break_time)
+
+
+class AttendanceArchive(models.Model):
+    """
+    年ごとのアーカイブテーブル（attendance.archive）の一覧。
+    振り分け時は、実際にアーカイブした最終日（last_date）と検索の期間を比べて読む年を決める。
+    """
+    year = models.PositiveSmallIntegerField(unique=True, verbose_name='年')
+    record_count = models.PositiveIntegerField(default=0, verbose_name='勤怠記録件数')
+    last_date = models.DateField(blank=True, null=True, verbose_name='アーカイブ済みの最終日')
+    archived_at = models.DateTimeField(auto_now=True, verbose_name='最終アーカイブ日時')
+
+    class Meta:
+        ordering = ['year']
+        verbose_name = '勤怠アーカイブ'
+        verbose_name_plural = '勤怠アーカイブ'
+
+    def __str__(self):
+        return f'{self.year}年（{self.record_count}件）'
+
+
+class CalendarVersion(models.Model):
+    """
+    社員ごとのカレンダーの更新日時（attendance.calendar_feed の ETag・Last-Modified）。
+    勤怠記録・申請を変更したトランザクションの中で進めるため、全プロセスが同じ値を読む。
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='calendar_version',
+        verbose_name='社員',
+    )
+    updated_at = models.DateTimeField(verbose_name='更新日時')
+
+    class Meta:
+        verbose_name = 'カレンダー更新日時'
+        verbose_name_plural = 'カレンダー更新日時'
@@ -0,0 +1,148 @@
+import base64
+import json
+from operator import attrgetter
+from django.db.models import Q
+
+
+def encode_cursor(direction, values):
+    payload = json.dumps({'d': direction, 'v': values}, default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """不正なカーソルは None（先頭ページ扱い）"""
+    if not cursor:
+        return None
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        direction, values = payload['d'], payload['v']
+    except (ValueError, KeyError, TypeError):
+        return None
+    if direction not in ('next', 'prev') or not isinstance(values, list):
+        return None
+    return direction, values
+
+
+def _seek_filter(ordering, values, after):
+    """
+    並び順 ordering の中で、values の行より後（after=True）または前の行を表す条件。
+    (a, b) > (x, y) を (a > x) OR (a = x AND b > y) に展開する。
+    """
+    condition = Q()
+    for index, field in enumerate(ordering):
+        name = field.lstrip('-')
+        descending = field.startswith('-')
+        lookup = 'lt' if descending == after else 'gt'
+        term = Q(**{f'{name}__{lookup}': values[index]})
+        for prev_field, prev_value in zip(ordering[:index], values[:index]):
+            term &= Q(**{prev_field.lstrip('-'): prev_value})
+        condition |= term
+    return condition
+
+
+def _reverse_ordering(ordering):
+    return [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+
+
+class KeysetPage:
+    """シーク法（キーセット）による1ページ分の結果"""
+
+    def __init__(self, object_list, ordering, has_next, has_previous):
+        self.object_list = object_list
+        self.ordering = ordering
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def _cursor(self, direction, obj):
+        return encode_cursor(direction, [getattr(obj, field.lstrip('-')) for field in self.ordering])
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.object_list:
+            return self._cursor('next', self.object_list[-1])
+        return ''
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous and self.object_list:
+            return self._cursor('prev', self.object_list[0])
+        return ''
+
+
+def sort_rows(rows, ordering):
+    """モデルのリストを order_by と同じ並び順に並べ替える"""
+    for field in reversed(ordering):
+        rows.sort(key=attrgetter(field.lstrip('-')), reverse=field.startswith('-'))
+    return rows
+
+
+def _take(querysets, condition, ordering, limit):
+    """複数のクエリセットからそれぞれ先頭 limit 件を取り、並べ直して先頭 limit 件を返す"""
+    if len(querysets) == 1:
+        return list(querysets[0].filter(condition).order_by(*ordering)[:limit])
+    rows = [row for queryset in querysets for row in queryset.filter(condition).order_by(*ordering)[:limit]]
+    return sort_rows(rows, ordering)[:limit]
+
+
+def paginate_keyset(queryset, ordering, cursor, per_page):
+    """
+    OFFSETを使わずに、直前ページの端の行の値を起点に per_page 件を取得する。
+    ordering は一意になる列（主キーなど）を最後に含めること。
+    queryset にはクエリセットのリスト（現行テーブルとアーカイブなど）も渡せる。
+    """
+    querysets = list(queryset) if isinstance(queryset, (list, tuple)) else [queryset]
+    ordering = list(ordering)
+    decoded = decode_cursor(cursor)
+
+    if decoded is None:
+        rows = _take(querysets, Q(), ordering, per_page + 1)
+        return KeysetPage(rows[:per_page], ordering, has_next=len(rows) > per_page, has_previous=False)
+
+    direction, values = decoded
+    if len(values) != len(ordering):
+        return paginate_keyset(querysets, ordering, None, per_page)
+
+    if direction == 'next':
+        rows = _take(querysets, _seek_filter(ordering, values, after=True), ordering, per_page + 1)
+        return KeysetPage(rows[:per_page], ordering, has_next=len(rows) > per_page, has_previous=True)
+
+    # 前のページは逆順で取得してから並べ直す
+    rows = _take(querysets, _seek_filter(ordering, values, after=False), _reverse_ordering(ordering), per_page + 1)
+    page_rows = rows[:per_page][::-1]
+    return KeysetPage(page_rows, ordering, has_next=True, has_previous=len(rows) > per_page)
+
+
+class MergedRecords:
+    """
+    複数のクエリセットを1つの並び順で連結したものとして Paginator に渡すための列。
+    スライスの終端までの件数をそれぞれから取得して並べ直すため、浅いページ向け。
+    """
+
+    def __init__(self, querysets, ordering):
+        self.querysets = querysets
+        self.ordering = list(ordering)
+
+    def count(self):
+        return sum(queryset.count() for queryset in self.querysets)
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            stop = index.stop if index.stop is not None else self.count()
+            return _take(self.querysets, Q(), self.ordering, stop)[index]
+        return self[index:index + 1][0]
+
+
+def merge_querysets(querysets, ordering):
+    """クエリセットが1つならそのまま、複数なら MergedRecords にして返す"""
+    if len(querysets) == 1:
+        return querysets[0].order_by(*ordering)
+    return MergedRecords(querysets, ordering)
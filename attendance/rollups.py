@@ -0,0 +1,190 @@
+from datetime import date, time, timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from .models import AttendanceRecord, MonthlyTimesheet
+from .archive import record_querysets
+
+# 月次集計で再計算する項目（退勤打刻漏れは日付が変わるだけで増えるため持たず、表示時に数える）
+ROLLUP_FIELDS = [
+    'total_work_time', 'total_break_time', 'days_worked', 'late_arrivals', 'early_leaves',
+]
+
+
+def _setting_time(name, default):
+    return time.fromisoformat(getattr(settings, name, default))
+
+
+def month_range(year, month):
+    """その月の初日と翌月の初日"""
+    first = date(year, month, 1)
+    following = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return first, following
+
+
+def summarize(rows):
+    """
+    1か月分の勤怠記録（date, clock_in, clock_out, total_work_time, break_total）を集計する。
+    結果は記録の内容だけで決まり、集計した日付によらない（差分の加算と全体の集計が一致するように）。
+    """
+    work_start = _setting_time('ATTENDANCE_WORK_START', '09:00')
+    work_end = _setting_time('ATTENDANCE_WORK_END', '18:00')
+    totals = {field: 0 for field in ROLLUP_FIELDS}
+    totals['total_work_time'] = timedelta()
+    totals['total_break_time'] = timedelta()
+
+    for day, clock_in, clock_out, total_work_time, break_total in rows:
+        totals['total_break_time'] += break_total or timedelta()
+        if total_work_time:
+            totals['total_work_time'] += total_work_time
+        if not clock_in:
+            continue
+        totals['days_worked'] += 1
+        if timezone.localtime(clock_in).time() > work_start:
+            totals['late_arrivals'] += 1
+        if clock_out and timezone.localtime(clock_out).time() < work_end:
+            totals['early_leaves'] += 1
+    return totals
+
+
+def refresh_timesheets(keys):
+    """
+    (user_id, year, month) ごとに勤怠記録を集計し直し、月次集計に1文で書き込む（UPSERT）。
+    対象の月の記録だけを月ごとに1クエリで読むため、変更のあった社員・月の件数にだけ比例する。
+    """
+    keys = {key for key in keys if all(key)}
+    if not keys:
+        return
+
+    # 月ごとに対象社員をまとめて読む（一括取込などで対象が多くても条件式が膨らまないように）
+    users_by_month = {}
+    for user_id, year, month in keys:
+        users_by_month.setdefault((year, month), set()).add(user_id)
+
+    rows = {key: [] for key in keys}
+    for (year, month), user_ids in users_by_month.items():
+        first, following = month_range(year, month)
+        # アーカイブ済みの月ならその年のアーカイブも読む
+        for queryset in record_querysets(first, following):
+            for user_id, *row in queryset.filter(
+                user_id__in=user_ids, date__gte=first, date__lt=following,
+            ).values_list('user_id', 'date', 'clock_in', 'clock_out', 'total_work_time', 'break_total'):
+                rows[(user_id, year, month)].append(row)
+
+    MonthlyTimesheet.objects.bulk_create(
+        [
+            MonthlyTimesheet(user_id=user_id, year=year, month=month, **summarize(month_rows))
+            for (user_id, year, month), month_rows in rows.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['user', 'year', 'month'],
+        update_fields=[*ROLLUP_FIELDS, 'updated_at'],
+    )
+
+
+# 月次集計に使う勤怠記録の項目（summarize に渡す行の並び）
+ROLLUP_ROW_FIELDS = ('date', 'clock_in', 'clock_out', 'total_work_time', 'break_total')
+
+
+def rollup_row(record):
+    return tuple(getattr(record, field) for field in ROLLUP_ROW_FIELDS)
+
+
+def apply_rollup_changes(changes):
+    """
+    勤怠記録の変更前後の行 (user_id, 変更前, 変更後) から月次集計の増減を求め、集計の行に加算する。
+    変更前・変更後は ROLLUP_ROW_FIELDS の並びで、記録がない場合は None。
+    打刻のたびに月全体の記録を読み直さないよう、呼び出し元と同じトランザクションで1行の UPDATE だけを行う。
+    集計の行がまだない月は、その月を集計し直して作る。
+    """
+    deltas = {}
+    for user_id, before, after in changes:
+        day = (after or before)[0]
+        old = summarize([before] if before else [])
+        new = summarize([after] if after else [])
+        change = {field: new[field] - old[field] for field in ROLLUP_FIELDS}
+        key = (user_id, day.year, day.month)
+        if key in deltas:
+            change = {field: deltas[key][field] + change[field] for field in ROLLUP_FIELDS}
+        deltas[key] = change
+
+    missing = set()
+    for (user_id, year, month), delta in deltas.items():
+        changed = {field: F(field) + value for field, value in delta.items() if value}
+        if not changed:
+            continue
+        if not MonthlyTimesheet.objects.filter(user_id=user_id, year=year, month=month).update(
+            **changed, updated_at=timezone.now(),
+        ):
+            missing.add((user_id, year, month))
+    refresh_timesheets(missing)
+
+
+def refresh_timesheets_later(records):
+    """
+    (user_id, date) の組に対応する月次集計を、トランザクションのコミット後に集計し直す。
+    打刻のトランザクションを長引かせないよう、集計はコミット後に行う。
+    """
+    keys = {(user_id, day.year, day.month) for user_id, day in records if user_id and day}
+    if keys:
+        transaction.on_commit(lambda: refresh_timesheets(keys))
+
+
+def count_missing_clock_outs(user_ids, year, month=None, today=None):
+    """
+    退勤打刻漏れ（当日より前で、出勤のみ打刻されている日）を (user_id, 月) ごとに数える。
+    日付が変わるだけで件数が変わるため月次集計には持たず、表示のたびに (社員, 日付) のインデックスで数える。
+    アーカイブへ移すのは退勤済みの記録だけなので、現行テーブルだけを読めばよい。
+    """
+    today = today or timezone.localdate()
+    first, following = month_range(year, month) if month else (date(year, 1, 1), date(year + 1, 1, 1))
+    rows = AttendanceRecord.objects.filter(
+        user_id__in=user_ids,
+        date__gte=first,
+        date__lt=min(following, today),
+        clock_in__isnull=False,
+        clock_out__isnull=True,
+    ).order_by().values_list('user_id', 'date__month').annotate(count=Count('id'))
+    return {(user_id, month): count for user_id, month, count in rows}
+
+
+def attach_missing_clock_outs(timesheets, counts):
+    """count_missing_clock_outs の件数を各月次集計の missing_clock_outs に設定する"""
+    for timesheet in timesheets:
+        timesheet.missing_clock_outs = counts.get((timesheet.user_id, timesheet.month), 0)
+    return timesheets
+
+
+def year_totals(timesheets):
+    """月次集計をまとめた年間合計（保存しない MonthlyTimesheet として返す）"""
+    total = MonthlyTimesheet(total_work_time=timedelta(), total_break_time=timedelta())
+    for timesheet in timesheets:
+        for field in [*ROLLUP_FIELDS, 'missing_clock_outs']:
+            setattr(total, field, getattr(total, field) + getattr(timesheet, field))
+    return total
+
+
+def parse_period(params):
+    """クエリ文字列の year / month を読む（不正な値は今年・年間扱い）"""
+    today = timezone.localdate()
+    try:
+        year = int(params.get('year', today.year))
+    except ValueError:
+        year = today.year
+    if not 2000 <= year <= today.year + 1:
+        year = today.year
+    try:
+        month = int(params.get('month') or 0)
+    except ValueError:
+        month = 0
+    return year, month if 1 <= month <= 12 else None
+
+
+def attach_period_totals(users, year, month=None):
+    """Prefetch した period_timesheets を集計し、各社員の timesheet に設定する（退勤打刻漏れはページの社員分を1クエリで数える）"""
+    users = list(users)
+    counts = count_missing_clock_outs([user.pk for user in users], year, month)
+    for user in users:
+        user.timesheet = year_totals(attach_missing_clock_outs(user.period_timesheets, counts))
+    return users
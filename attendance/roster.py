@@ -0,0 +1,85 @@
+import asyncio
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from .broker import RESYNC, roster_broker, sse
+from .models import AttendanceRecord
+
+CustomUser = get_user_model()
+
+# ロースターに反映する打刻（備考の更新は表示に影響しない）
+ROSTER_ACTIONS = ('clock_in', 'clock_out', 'break_start', 'break_end')
+# 接続を保つためのコメントを送る間隔（秒）
+ROSTER_KEEPALIVE = 15
+# 管理範囲の変更を反映するため、この秒数で接続を閉じて再接続させる
+ROSTER_STREAM_MAX_SECONDS = 60 * 30
+# ASGI 以外（WSGI）ではストリームを保てないため、スナップショットを返してこの間隔で再接続させる
+ROSTER_POLL_RETRY_MS = 10 * 1000
+
+
+def _hhmm(value):
+    return timezone.localtime(value).strftime('%H:%M') if value else None
+
+
+def roster_status(clock_in, clock_out, break_started_at):
+    if clock_out:
+        return 'left'
+    if break_started_at:
+        return 'on_break'
+    if clock_in:
+        return 'working'
+    return 'absent'
+
+
+def publish_punches_later(punches):
+    """成功した打刻 (user_id, 打刻日時, 操作) を、コミット後にロースターの購読者へ配る"""
+    roster_broker.publish_later(
+        (user_id, {'user_id': user_id, 'date': at.date().isoformat(), 'action': action, 'at': _hhmm(at)})
+        for user_id, at, action in punches
+        if action in ROSTER_ACTIONS
+    )
+
+
+async def roster_snapshot(user_ids, day):
+    """部下の本日の出勤状況（社員番号順）。社員と勤怠記録の2クエリで読む"""
+    records = {
+        row['user_id']: row
+        async for row in AttendanceRecord.objects.filter(user_id__in=user_ids, date=day).values(
+            'user_id', 'clock_in', 'clock_out', 'break_started_at',
+        )
+    }
+    rows = []
+    async for user in CustomUser.objects.filter(pk__in=user_ids, role='employee').order_by('employee_number').values(
+        'pk', 'employee_number', 'full_name', 'username',
+    ):
+        record = records.get(user['pk'], {})
+        rows.append({
+            'user_id': user['pk'],
+            'employee_number': user['employee_number'],
+            'name': user['full_name'] or user['username'],
+            'clock_in': _hhmm(record.get('clock_in')),
+            'clock_out': _hhmm(record.get('clock_out')),
+            'break_started_at': _hhmm(record.get('break_started_at')),
+            'status': roster_status(record.get('clock_in'), record.get('clock_out'), record.get('break_started_at')),
+        })
+    return {'date': day.isoformat(), 'rows': rows}
+
+
+async def roster_stream(user_ids, day):
+    """
+    最初にスナップショット、以降は部下の打刻を1件ずつ SSE で送る。
+    スナップショットの前に購読するため、その間の打刻も取りこぼさない（重複は画面側で上書きされる）。
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + ROSTER_STREAM_MAX_SECONDS
+    async with roster_broker.subscribe(user_ids) as subscription:
+        yield sse('snapshot', await roster_snapshot(user_ids, day))
+        while loop.time() < deadline:
+            try:
+                event = await asyncio.wait_for(subscription.get(), ROSTER_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if event is RESYNC:
+                yield sse('snapshot', await roster_snapshot(user_ids, day))
+            elif event['date'] == day.isoformat():
+                yield sse('punch', event)
@@ -0,0 +1,392 @@
+import logging
+from django.contrib import messages
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, Count, DurationField, ExpressionWrapper, F, Max, Value, When
+from django.urls import reverse
+from django.utils import timezone
+from .models import AttendanceRecord, BreakRecord
+from .cache import invalidate_today, invalidate_today_many
+from .counters import add_unread, adjust_unread, counted_unread_deltas, unread_deltas
+from .changes import records_changed
+from .rollups import ROLLUP_ROW_FIELDS, rollup_row
+from .roster import publish_punches_later
+from notifications.utils import create_notifications
+
+logger = logging.getLogger(__name__)
+
+PUNCH_ACTIONS = ('clock_in', 'clock_out', 'break_start', 'break_end', 'update_note')
+# 月次集計の値が変わる打刻（休憩開始・備考は集計に影響しない）
+ROLLUP_ACTIONS = ('clock_in', 'clock_out', 'break_end')
+# 同じトークンの再送を無視する期間（秒）
+PUNCH_TOKEN_TIMEOUT = 60 * 60 * 24
+
+
+class PunchResult:
+    """打刻1回分の処理結果"""
+
+    def __init__(self, level, message, duplicate=False, query_count=0):
+        self.level = level
+        self.message = message
+        self.duplicate = duplicate
+        self.query_count = query_count
+
+    @property
+    def applied(self):
+        return self.level == messages.SUCCESS
+
+
+class QueryCounter:
+    """execute_wrapper で実行されたSQLの件数を数える"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def check_punch(action, clock_in, clock_out, on_break):
+    """打刻ルールを検証し、違反していれば警告メッセージを返す"""
+    if action == 'clock_in':
+        if clock_in:
+            return '既に出勤済みです。'
+    elif action == 'clock_out':
+        if not clock_in:
+            return '出勤していません。先に出勤を記録してください。'
+        if clock_out:
+            return '既に退勤済みです。'
+    elif action == 'break_start':
+        if on_break:
+            return '既に休憩中です。'
+    elif action == 'break_end':
+        if not on_break:
+            return '開始中の休憩はありません。'
+    return None
+
+
+def _today_records(user, now):
+    return AttendanceRecord.objects.filter(user=user, date=now.date())
+
+
+def _rollup_row(user, now):
+    return _today_records(user, now).values_list(*ROLLUP_ROW_FIELDS).first()
+
+
+def _create_today_record(user, now, **fields):
+    """本日分の勤怠記録を作成して未確認件数に計上する（既に存在すれば IntegrityError）"""
+    with transaction.atomic():
+        record = AttendanceRecord.objects.create(user=user, date=now.date(), **fields)
+        add_unread(user)
+    return record
+
+
+def _clock_in(user, now, note):
+    # 勤怠記録は最初の打刻で作成されるため、まずINSERTを試みる
+    try:
+        _create_today_record(user, now, clock_in=now)
+    except IntegrityError:
+        if not _today_records(user, now).filter(clock_in__isnull=True).update(clock_in=now):
+            return messages.WARNING, check_punch('clock_in', True, None, False)
+    return messages.SUCCESS, f"出勤時刻を登録しました：{now.strftime('%H:%M')}"
+
+
+def _clock_out(user, now, note):
+    records = _today_records(user, now)
+    # 終了済み休憩の合計は break_total に積み上げ済みのため休憩行は読まない
+    updated = records.filter(clock_in__isnull=False, clock_out__isnull=True).update(
+        clock_out=now,
+        total_work_time=ExpressionWrapper(
+            Value(now) - F('clock_in') - F('break_total'),
+            output_field=DurationField(),
+        ),
+    )
+    if not updated:
+        state = records.values('clock_in', 'clock_out').first() or {}
+        return messages.WARNING, check_punch('clock_out', state.get('clock_in'), state.get('clock_out'), False)
+    return messages.SUCCESS, f"退勤時刻を登録しました：{now.strftime('%H:%M')}"
+
+
+def _break_start(user, now, note):
+    records = _today_records(user, now)
+    # 進行中の休憩が無い場合のみ開始時刻を記録する（二重開始の防止）
+    if records.filter(break_started_at__isnull=True).update(break_started_at=now):
+        record_pk = records.values_list('pk', flat=True).get()
+    else:
+        try:
+            record_pk = _create_today_record(user, now, break_started_at=now).pk
+        except IntegrityError:
+            # 既に休憩中のレコードが存在する
+            return messages.WARNING, check_punch('break_start', None, None, True)
+    # 休憩合計は上のUPDATEで更新済みのため、BreakRecord.save() の再集計を通さずに登録する
+    BreakRecord.objects.bulk_create([BreakRecord(attendance_id=record_pk, start_time=now)])
+    return messages.SUCCESS, f"休憩を開始しました：{now.strftime('%H:%M')}"
+
+
+def _break_end(user, now, note):
+    records = _today_records(user, now).filter(break_started_at__isnull=False)
+    break_total = ExpressionWrapper(
+        F('break_total') + (Value(now) - F('break_started_at')),
+        output_field=DurationField(),
+    )
+    # 休憩合計を加算し、退勤済みであれば実働時間も同じUPDATEで再計算する
+    updated = records.update(
+        break_total=break_total,
+        break_started_at=None,
+        total_work_time=Case(
+            When(
+                clock_in__isnull=False,
+                clock_out__isnull=False,
+                then=ExpressionWrapper(F('clock_out') - F('clock_in') - break_total, output_field=DurationField()),
+            ),
+            default=F('total_work_time'),
+        ),
+    )
+    if not updated:
+        return messages.WARNING, check_punch('break_end', None, None, False)
+    BreakRecord.objects.filter(
+        attendance__user=user,
+        attendance__date=now.date(),
+        end_time__isnull=True,
+    ).update(end_time=now)
+    return messages.SUCCESS, f"休憩を終了しました：{now.strftime('%H:%M')}"
+
+
+def _update_note(user, now, note):
+    if not _today_records(user, now).update(note=note):
+        try:
+            _create_today_record(user, now, note=note)
+        except IntegrityError:
+            _today_records(user, now).update(note=note)
+    return messages.SUCCESS, '備考を更新しました。'
+
+
+_HANDLERS = {
+    'clock_in': _clock_in,
+    'clock_out': _clock_out,
+    'break_start': _break_start,
+    'break_end': _break_end,
+    'update_note': _update_note,
+}
+
+
+def punch(user, action, note='', token=None, now=None):
+    """
+    打刻を1トランザクション内の条件付きUPDATE/INSERTとして適用する。
+    token を渡すと同じトークンでの再送（二重クリック・リトライ）は何もせずに返す。
+    """
+    if action not in _HANDLERS:
+        raise ValueError(f'未対応の打刻操作です: {action}')
+    now = now or timezone.localtime(timezone.now())
+
+    token_key = None
+    if token:
+        token_key = f'attendance:punch-token:{user.pk}:{token}'
+        if not cache.add(token_key, action, PUNCH_TOKEN_TIMEOUT):
+            return PunchResult(messages.INFO, 'この打刻は既に処理済みです。', duplicate=True)
+
+    counter = QueryCounter()
+    try:
+        with connection.execute_wrapper(counter), transaction.atomic():
+            before = _rollup_row(user, now) if action in ROLLUP_ACTIONS else None
+            level, message = _HANDLERS[action](user, now, note)
+            if level == messages.SUCCESS:
+                transaction.on_commit(lambda: invalidate_today(user.pk, now.date()))
+                # 月次集計は月全体を読み直さず、この記録の変更前後の差分だけを加算する
+                rollup_changes = [(user.pk, before, _rollup_row(user, now))] if action in ROLLUP_ACTIONS else []
+                records_changed([(user.pk, now.date())], rollup_changes)
+                publish_punches_later([(user.pk, now, action)])
+    except Exception:
+        # 失敗した打刻は再送できるようにトークンを解放する
+        if token_key:
+            cache.delete(token_key)
+        raise
+
+    logger.info('punch user=%s action=%s level=%s queries=%d', user.pk, action, level, counter.count)
+    return PunchResult(level, message, query_count=counter.count)
+
+
+class PunchState:
+    """1ユーザー1日分の勤怠をメモリ上で打刻ルールに沿って更新する"""
+
+    def __init__(self, record, open_break=None, last_break_end=None):
+        self.record = record
+        self.open_break = open_break
+        self.new_breaks = []
+        self.closed_breaks = []
+        self.changed = False
+        # 月次集計に加算する差分を求めるための、打刻を適用する前の行（未保存の記録は None）
+        self.original = rollup_row(record) if record.pk else None
+        # 最後の打刻の時刻。これより前の時刻の打刻は、休憩合計・実働時間が負になり得るため受け付けない
+        self.last_punch_at = max(
+            (value for value in (record.clock_in, record.clock_out, record.break_started_at, last_break_end) if value),
+            default=None,
+        )
+
+    def apply(self, action, now, note=''):
+        record = self.record
+        warning = check_punch(action, record.clock_in, record.clock_out, record.break_started_at is not None)
+        if warning:
+            return messages.WARNING, warning
+        if action != 'update_note' and self.last_punch_at and now < self.last_punch_at:
+            return messages.WARNING, '直前の打刻より前の時刻は打刻できません。'
+
+        if action == 'clock_in':
+            record.clock_in = now
+            message = f"出勤時刻を登録しました：{now.strftime('%H:%M')}"
+        elif action == 'clock_out':
+            record.clock_out = now
+            record.total_work_time = now - record.clock_in - record.break_total
+            message = f"退勤時刻を登録しました：{now.strftime('%H:%M')}"
+        elif action == 'break_start':
+            record.break_started_at = now
+            self.open_break = BreakRecord(attendance=record, start_time=now)
+            self.new_breaks.append(self.open_break)
+            message = f"休憩を開始しました：{now.strftime('%H:%M')}"
+        elif action == 'break_end':
+            record.break_total += now - record.break_started_at
+            record.break_started_at = None
+            if record.clock_in and record.clock_out:
+                record.total_work_time = record.clock_out - record.clock_in - record.break_total
+            if self.open_break:
+                self.open_break.end_time = now
+                if self.open_break.pk:
+                    self.closed_breaks.append(self.open_break)
+                self.open_break = None
+            message = f"休憩を終了しました：{now.strftime('%H:%M')}"
+        else:
+            record.note = note
+            message = '備考を更新しました。'
+
+        if action != 'update_note':
+            self.last_punch_at = now
+        self.changed = True
+        return messages.SUCCESS, message
+
+
+# 一括打刻で更新する勤怠記録の項目
+PUNCH_FIELDS = ['clock_in', 'clock_out', 'total_work_time', 'break_total', 'break_started_at', 'note']
+
+
+def load_punch_states(keys):
+    """(user_id, date) の集合に対する PunchState を2〜3クエリでまとめて読み込む"""
+    user_ids = {user_id for user_id, _ in keys}
+    dates = {day for _, day in keys}
+    records = {
+        (record.user_id, record.date): record
+        for record in AttendanceRecord.objects.filter(user_id__in=user_ids, date__in=dates)
+    }
+    open_breaks = {
+        break_record.attendance_id: break_record
+        for break_record in BreakRecord.objects.filter(
+            attendance__in=[record for record in records.values() if record.break_started_at],
+            end_time__isnull=True,
+        ).order_by('start_time')
+    }
+    # 終了済みの休憩がある記録だけ、最後の休憩終了時刻を読む
+    last_break_ends = dict(
+        BreakRecord.objects.filter(
+            attendance__in=[record for record in records.values() if record.break_total],
+        ).order_by().values('attendance_id').annotate(last_end=Max('end_time')).values_list('attendance_id', 'last_end')
+    )
+
+    states = {}
+    for user_id, day in keys:
+        record = records.get((user_id, day))
+        if record is None:
+            states[(user_id, day)] = PunchState(AttendanceRecord(user_id=user_id, date=day))
+        else:
+            states[(user_id, day)] = PunchState(record, open_breaks.get(record.pk), last_break_ends.get(record.pk))
+    return states
+
+
+def apply_punch_batch(entries, batch_size=None):
+    """
+    打刻をまとめて適用し、入力順に PunchResult のリストを返す。
+    entries は user_id, action, timestamp(aware datetime), note を持つ dict。
+    同一ユーザー・同一日の打刻は時刻順に打刻ルールで判定し、結果は bulk_create / bulk_update で書き込む。
+    """
+    entries = [
+        dict(entry, timestamp=timezone.localtime(entry['timestamp']))
+        for entry in entries
+    ]
+    results = [None] * len(entries)
+    counter = QueryCounter()
+
+    with connection.execute_wrapper(counter), transaction.atomic():
+        states = load_punch_states({(entry['user_id'], entry['timestamp'].date()) for entry in entries})
+        ordered = sorted(range(len(entries)), key=lambda index: entries[index]['timestamp'])
+        for index in ordered:
+            entry = entries[index]
+            state = states[(entry['user_id'], entry['timestamp'].date())]
+            level, message = state.apply(entry['action'], entry['timestamp'], entry.get('note', ''))
+            results[index] = PunchResult(level, message)
+
+        changed = [state for state in states.values() if state.changed]
+        created = [state.record for state in changed if state.record.pk is None]
+        updated = [state.record for state in changed if state.record.pk is not None]
+        AttendanceRecord.objects.bulk_create(created, batch_size=batch_size)
+        adjust_unread(unread_deltas(record.user_id for record in created))
+        AttendanceRecord.objects.bulk_update(updated, PUNCH_FIELDS, batch_size=batch_size)
+
+        new_breaks = []
+        closed_breaks = []
+        for state in changed:
+            for break_record in state.new_breaks:
+                # bulk_create で採番された勤怠記録のIDを反映する
+                break_record.attendance = state.record
+                new_breaks.append(break_record)
+            closed_breaks.extend(state.closed_breaks)
+        BreakRecord.objects.bulk_create(new_breaks, batch_size=batch_size)
+        BreakRecord.objects.bulk_update(closed_breaks, ['end_time'], batch_size=batch_size)
+        changed_keys = [(state.record.user_id, state.record.date) for state in changed]
+        transaction.on_commit(lambda: invalidate_today_many(changed_keys))
+        records_changed(
+            changed_keys,
+            [(state.record.user_id, state.original, rollup_row(state.record)) for state in changed],
+        )
+        publish_punches_later(
+            (entries[index]['user_id'], entries[index]['timestamp'], entries[index]['action'])
+            for index in ordered
+            if results[index].level == messages.SUCCESS
+        )
+
+    for result in results:
+        result.query_count = counter.count
+    logger.info('punch batch entries=%d records=%d queries=%d', len(entries), len(changed), counter.count)
+    return results
+
+
+def set_read_status(queryset, reader, read=True):
+    """
+    queryset の勤怠記録をまとめて確認済（read=False なら未確認）にし、変更した件数を返す。
+    確認状況は1文の UPDATE で変更し、未確認件数は社員ごとの集計1クエリから、
+    通知は対象の社員ごとに1件ずつ bulk_create でまとめて反映する。
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        targets = queryset.filter(is_read=not read).order_by()
+        groups = list(targets.values_list('user_id').annotate(count=Count('id')))
+        if not groups:
+            return 0
+
+        if read:
+            updated = targets.update(is_read=True, read_by=reader, read_at=now)
+        else:
+            updated = targets.update(is_read=False, read_by=None, read_at=None)
+        adjust_unread(counted_unread_deltas(groups, sign=-1 if read else 1))
+
+        counts = dict(groups)
+        action = '確認' if read else '確認取消'
+        create_notifications(
+            reader,
+            {
+                user_id: f'{reader.full_name} さんが勤怠記録 {count} 件の{action}を行いました。'
+                for user_id, count in counts.items()
+            },
+            reverse('attendance:attendance_list'),
+        )
+
+    logger.info('set read status reader=%s read=%s records=%d', reader.pk, read, updated)
+    return updated
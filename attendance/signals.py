@@ -0,0 +1,15 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+from .counters import adjust_unread, company_key, user_key
+from .models import AttendanceRecord, UnreadRecordCounter
+
+CustomUser = get_user_model()
+
+
+@receiver(pre_delete, sender=CustomUser)
+def remove_unread_on_user_delete(sender, instance, **kwargs):
+    """社員の削除で勤怠記録も削除される（CASCADE）ため、未確認の記録の分を全社の件数から差し引く"""
+    count = AttendanceRecord.objects.filter(user=instance, is_read=False).count()
+    adjust_unread({company_key(instance.pk): -count})
+    UnreadRecordCounter.objects.filter(key=user_key(instance.pk)).delete()
@@ -1,3 +1,1332 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import functools
+import importlib
+import io
+import json
+import re
+import tempfile
+import zipfile
+from datetime import date, datetime, timedelta
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth import get_user_model
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from accounts.models import Department, Team
+from attendance_management import db_router
+from attendance_management.cache_backends import SharedFileBasedCache
+from attendance_management.db_router import RequestState
+from application.models import Application
+from notifications.models import Notification
+from . import archive
+from .exports import EXPORT_HEADER, iter_export_rows
+from .models import (
+    AttendanceArchive, AttendanceRecord, BreakRecord, MonthlyTimesheet, PunchJournalSegment, UnreadRecordCounter,
+)
+from .broker import roster_broker, sse
+from .checks import check_shared_cache
+from .counters import company_keys, unread_count, user_key
+from .imports import import_attendance_csv
+from .journal import PunchJournal, enqueue_punch, overlay_pending
+from .pagination import encode_cursor, paginate_keyset
+from .roster import roster_snapshot, roster_stream
+from .rollups import ROLLUP_FIELDS, count_missing_clock_outs, refresh_timesheets
+from .services import PunchState, apply_punch_batch, load_punch_states, punch
 
-# Create your tests here.
+CustomUser = get_user_model()
+
+# 件数が増え続けるテーブル（全件走査になってはいけない）
+LARGE_TABLES = (
+    AttendanceRecord._meta.db_table,
+    Application._meta.db_table,
+    Notification._meta.db_table,
+)
+
+
+class ListViewQueryPlanTests(TestCase):
+    """
+    一覧画面が発行するクエリの EXPLAIN QUERY PLAN を取得し、
+    大きなテーブルをインデックスなしで全件走査していないことを確認する。
+    """
+    EMPLOYEES = 60
+    DAYS = 120
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.department = Department.objects.create(name='開発部')
+        cls.other_department = Department.objects.create(name='営業部')
+        cls.team = Team.objects.create(name='第一課', department=cls.department)
+
+        cls.hr = CustomUser.objects.create_user(
+            username='hr', password='password', employee_number='H0001', full_name='人事 太郎', role='hr',
+        )
+        cls.manager = CustomUser.objects.create_user(
+            username='manager', password='password', employee_number='M0001', full_name='上司 太郎', role='manager',
+        )
+        cls.department.manager = cls.manager
+        cls.department.save()
+        cls.team.manager = cls.manager
+        cls.team.save()
+
+        employees = CustomUser.objects.bulk_create([
+            CustomUser(
+                username=f'employee{i}',
+                employee_number=f'E{i:04d}',
+                full_name=f'社員 {i}',
+                department=cls.department if i % 2 else cls.other_department,
+                team=cls.team if i % 4 == 1 else None,
+            )
+            for i in range(cls.EMPLOYEES)
+        ])
+        cls.employee = employees[1]
+        cls.employee.set_password('password')
+        cls.employee.save()
+
+        start = date(2024, 1, 1)
+        AttendanceRecord.objects.bulk_create([
+            AttendanceRecord(
+                user=employee,
+                date=start + timedelta(days=day),
+                clock_in=timezone.make_aware(datetime(2024, 1, 1, 9)) + timedelta(days=day),
+                clock_out=timezone.make_aware(datetime(2024, 1, 1, 18)) + timedelta(days=day),
+                is_read=day % 3 != 0,
+            )
+            for employee in employees
+            for day in range(cls.DAYS)
+        ], batch_size=1000)
+
+        statuses = [choice for choice, _ in Application.STATUS_CHOICES]
+        Application.objects.bulk_create([
+            Application(
+                applicant=employee,
+                application_type='paid_leave',
+                reason='私用のため',
+                start_datetime=timezone.make_aware(datetime(2024, 1, 1, 9)) + timedelta(days=i),
+                end_datetime=timezone.make_aware(datetime(2024, 1, 1, 18)) + timedelta(days=i),
+                status=statuses[i % len(statuses)],
+            )
+            for employee in employees
+            for i in range(40)
+        ], batch_size=1000)
+
+        Notification.objects.bulk_create([
+            Notification(sender=cls.hr, recipient=employee, message=f'通知 {i}', is_read=i % 2 == 0)
+            for employee in [*employees, cls.manager, cls.hr]
+            for i in range(40)
+        ], batch_size=1000)
+
+        # 実運用と同じく統計情報を更新してからプランを確認する
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN の形式は SQLite を前提としています。')
+
+    def full_scans(self, sql):
+        """プラン中で、大きなテーブル（またはその別名）をインデックスなしで走査している行"""
+        names = set(LARGE_TABLES)
+        for table in LARGE_TABLES:
+            names.update(re.findall(rf'"{table}" (\w+)', sql))
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            plan = [row[-1] for row in cursor.fetchall()]
+        return [
+            line for line in plan
+            if (match := re.match(r'SCAN (\w+)', line)) and match.group(1) in names and 'USING' not in line
+        ]
+
+    def assertNoFullScan(self, username, url, params=None):
+        self.client.login(username=username, password='password')
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+
+        checked = 0
+        for query in captured.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or not any(f'"{table}"' in sql for table in LARGE_TABLES):
+                continue
+            checked += 1
+            self.assertEqual(self.full_scans(sql), [], msg=f'{url} {params or ""}: {sql}')
+        self.assertGreater(checked, 0)
+
+    def test_hr_attendance_list(self):
+        url = reverse('attendance:hr_attendance_list')
+        self.assertNoFullScan('hr', url)
+        self.assertNoFullScan('hr', url, {'read_status': 'unread'})
+        self.assertNoFullScan('hr', url, {'start_date': '2024-02-01', 'end_date': '2024-02-29'})
+
+    def test_attendance_list(self):
+        url = reverse('attendance:attendance_list')
+        self.assertNoFullScan(self.employee.username, url)
+        self.assertNoFullScan(self.employee.username, url, {'read_status': 'unread', 'start_date': '2024-02-01'})
+
+    def test_manager_attendance_list(self):
+        url = reverse('attendance:manager_attendance_list')
+        self.assertNoFullScan('manager', url, {'date': '2024-02-01'})
+        self.assertNoFullScan('manager', url, {'date': '2024-02-01', 'status': 'submitted'})
+
+    def test_manager_application_list(self):
+        url = reverse('application:manager_application_list')
+        self.assertNoFullScan('manager', url)
+        self.assertNoFullScan('manager', url, {'status': 'pending_manager'})
+
+    def test_hr_application_list(self):
+        url = reverse('application:hr_application_list')
+        self.assertNoFullScan('hr', url)
+        self.assertNoFullScan('hr', url, {'status': 'pending_hr', 'start_date': '2024-01-15'})
+
+    def test_notification_list(self):
+        url = reverse('notifications:notification_list')
+        self.assertNoFullScan(self.employee.username, url)
+        self.assertNoFullScan(self.employee.username, url, {'status': 'unread'})
+        response = self.client.get(url)
+        self.assertNoFullScan(self.employee.username, url, {'cursor': response.context['cursor_page'].next_cursor})
+
+        # 受信件数によらず1ページ分だけ読むよう、並べ替えもインデックスの順で行う
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get(url, {'cursor': response.context['cursor_page'].next_cursor})
+        for query in captured.captured_queries:
+            if f'"{Notification._meta.db_table}"' in query['sql'] and query['sql'].startswith('SELECT'):
+                with connection.cursor() as cursor:
+                    cursor.execute(f"EXPLAIN QUERY PLAN {query['sql']}")
+                    plan = [row[-1] for row in cursor.fetchall()]
+                self.assertFalse([line for line in plan if 'TEMP B-TREE' in line], msg=plan)
+
+    def test_hr_attendance_cursor_uses_date_id_index(self):
+        self.client.login(username='hr', password='password')
+        url = reverse('attendance:hr_attendance_list')
+        next_cursor = self.client.get(url).context['cursor_page'].next_cursor
+        prev_cursor = self.client.get(url, {'cursor': next_cursor}).context['cursor_page'].previous_cursor
+        table = AttendanceRecord._meta.db_table
+        for cursor in (next_cursor, prev_cursor):
+            with CaptureQueriesContext(connection) as captured:
+                self.client.get(url, {'cursor': cursor})
+            queries = [
+                query['sql'] for query in captured.captured_queries
+                if query['sql'].startswith('SELECT') and f'FROM "{table}"' in query['sql']
+            ]
+            self.assertTrue(queries)
+            for sql in queries:
+                with connection.cursor() as db_cursor:
+                    db_cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                    plan = [row[-1] for row in db_cursor.fetchall()]
+                # (date, id) の複合インデックスを順にたどり、並べ替えのための一時B-Treeを作らない
+                self.assertTrue([line for line in plan if 'attendance_date_id_idx' in line], msg=plan)
+                self.assertFalse([line for line in plan if 'TEMP B-TREE' in line], msg=plan)
+
+
+class KeysetPaginationTests(TestCase):
+    """勤怠一覧（人事）のシーク方式のページ送り"""
+
+    def setUp(self):
+        cache.clear()
+        self.hr = CustomUser.objects.create_user(
+            username='hr', password='password', employee_number='H0001', full_name='人事 太郎', role='hr',
+        )
+        employees = CustomUser.objects.bulk_create([
+            CustomUser(username=f'employee{i}', employee_number=f'E{i:04d}', full_name=f'社員 {i}')
+            for i in range(15)
+        ])
+        # 同じ日付の記録が複数ページにまたがるようにする
+        today = timezone.localdate()
+        AttendanceRecord.objects.bulk_create([
+            AttendanceRecord(user=employee, date=today - timedelta(days=day))
+            for day in range(2)
+            for employee in employees
+        ])
+        self.expected = list(AttendanceRecord.objects.order_by('-date', '-id').values_list('pk', flat=True))
+        self.url = reverse('attendance:hr_attendance_list')
+        self.client.login(username='hr', password='password')
+
+    def page(self, cursor=None):
+        response = self.client.get(self.url, {'cursor': cursor} if cursor is not None else {})
+        self.assertEqual(response.status_code, 200)
+        page = response.context['cursor_page']
+        return [record.pk for record in page], page
+
+    def test_next_and_previous_pages_are_stable(self):
+        pages = []
+        ids, page = self.page()
+        pages.append((ids, page))
+        while page.next_cursor:
+            ids, page = self.page(page.next_cursor)
+            pages.append((ids, page))
+        self.assertEqual([pk for ids, _ in pages for pk in ids], self.expected)
+        self.assertEqual([len(ids) for ids, _ in pages], [10, 10, 10])
+        self.assertFalse(pages[0][1].has_previous)
+        self.assertFalse(pages[-1][1].has_next)
+
+        # 前のページへ戻っても、同じ日付の行が重複・欠落しない
+        for (previous_ids, _), (_, page) in zip(pages, pages[1:]):
+            ids, _ = self.page(page.previous_cursor)
+            self.assertEqual(ids, previous_ids)
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        first, _ = self.page()
+        invalid = [
+            'not-a-cursor!',
+            base64.urlsafe_b64encode(b'{"d":"next"}').decode(),
+            encode_cursor('sideways', [str(timezone.localdate()), self.expected[0]]),
+            encode_cursor('next', [self.expected[0]]),
+        ]
+        for cursor in invalid:
+            with self.subTest(cursor=cursor):
+                ids, page = self.page(cursor)
+                self.assertEqual(ids, first)
+                self.assertFalse(page.has_previous)
+
+    def test_paginate_keyset_breaks_ties_on_id(self):
+        queryset = AttendanceRecord.objects.all()
+        page = paginate_keyset(queryset, ['-date', '-id'], None, 4)
+        self.assertEqual([record.pk for record in page], self.expected[:4])
+        page = paginate_keyset(queryset, ['-date', '-id'], page.next_cursor, 4)
+        self.assertEqual([record.pk for record in page], self.expected[4:8])
+        page = paginate_keyset(queryset, ['-date', '-id'], page.previous_cursor, 4)
+        self.assertEqual([record.pk for record in page], self.expected[:4])
+        self.assertFalse(page.has_previous)
+
+
+class PunchTests(TestCase):
+    """打刻画面の表示と打刻処理"""
+
+    def setUp(self):
+        cache.clear()
+        self.department = Department.objects.create(name='開発部')
+        self.employee = CustomUser.objects.create_user(
+            username='employee', password='password', employee_number='E0001', full_name='社員 太郎',
+            department=self.department,
+        )
+        self.now = timezone.localtime(timezone.now()).replace(hour=9, minute=0, second=0, microsecond=0)
+
+    def test_dashboard_get_does_not_write(self):
+        self.client.login(username='employee', password='password')
+        url = reverse('attendance:dashboard')
+        for _ in range(2):
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            writes = [
+                query['sql'] for query in captured.captured_queries
+                if query['sql'].startswith(('INSERT', 'UPDATE', 'DELETE'))
+            ]
+            self.assertEqual(writes, [])
+        self.assertFalse(AttendanceRecord.objects.exists())
+        self.assertIsNone(response.context['record'].pk)
+
+    def test_duplicate_token_is_applied_once(self):
+        self.client.login(username='employee', password='password')
+        url = reverse('attendance:dashboard')
+        self.client.post(url, {'action': 'clock_in', 'punch_token': 'token-1'})
+        record = AttendanceRecord.objects.get(user=self.employee)
+
+        response = self.client.post(url, {'action': 'clock_in', 'punch_token': 'token-1'})
+        self.assertEqual(
+            [message.message for message in get_messages(response.wsgi_request)][-1],
+            'この打刻は既に処理済みです。',
+        )
+        self.assertEqual(AttendanceRecord.objects.get(user=self.employee).clock_in, record.clock_in)
+
+    def test_duplicate_token_is_not_reapplied(self):
+        first = punch(self.employee, 'clock_in', token='token-1', now=self.now)
+        punch(self.employee, 'clock_out', now=self.now + timedelta(hours=8))
+        # 退勤後に出勤の再送が届いても、処理済みのトークンは二度適用しない
+        second = punch(self.employee, 'clock_in', token='token-1', now=self.now + timedelta(hours=9))
+        self.assertTrue(first.applied)
+        self.assertTrue(second.duplicate)
+        self.assertEqual(AttendanceRecord.objects.get(user=self.employee).clock_in, self.now)
+
+
+class BreakTotalTests(TestCase):
+    """休憩合計・実働時間と休憩記録の整合"""
+
+    def setUp(self):
+        cache.clear()
+        self.hr = CustomUser.objects.create_superuser(
+            username='hr', password='password', employee_number='H0001', full_name='人事 太郎', role='hr',
+        )
+        self.employee = CustomUser.objects.create_user(
+            username='employee', password='password', employee_number='E0001', full_name='社員 太郎',
+        )
+        self.now = timezone.localtime(timezone.now()).replace(hour=9, minute=0, second=0, microsecond=0)
+        punch(self.employee, 'clock_in', now=self.now)
+        punch(self.employee, 'break_start', now=self.now + timedelta(hours=3))
+        punch(self.employee, 'break_end', now=self.now + timedelta(hours=4))
+        punch(self.employee, 'clock_out', now=self.now + timedelta(hours=9))
+        self.record = AttendanceRecord.objects.get(user=self.employee)
+        self.client.login(username='hr', password='password')
+
+    def test_punch_totals(self):
+        self.assertEqual(self.record.break_total, timedelta(hours=1))
+        self.assertEqual(self.record.total_work_time, timedelta(hours=8))
+        self.assertEqual(self.record.breaks.count(), 1)
+
+    def test_admin_break_edit_updates_totals(self):
+        break_record = self.record.breaks.get()
+        response = self.client.post(reverse('admin:attendance_breakrecord_change', args=[break_record.pk]), {
+            'attendance': self.record.pk,
+            'start_time_0': break_record.start_time.strftime('%Y-%m-%d'),
+            'start_time_1': '12:00:00',
+            'end_time_0': break_record.start_time.strftime('%Y-%m-%d'),
+            'end_time_1': '12:30:00',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.break_total, timedelta(minutes=30))
+        self.assertEqual(self.record.total_work_time, timedelta(hours=8, minutes=30))
+
+    def test_admin_break_delete_updates_totals(self):
+        break_record = self.record.breaks.get()
+        self.client.post(reverse('admin:attendance_breakrecord_delete', args=[break_record.pk]), {'post': 'yes'})
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.break_total, timedelta())
+        self.assertEqual(self.record.total_work_time, timedelta(hours=9))
+
+    def test_open_break_is_tracked(self):
+        BreakRecord.objects.create(attendance=self.record, start_time=self.now + timedelta(hours=10))
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.break_started_at, self.now + timedelta(hours=10))
+        self.assertEqual(self.record.break_total, timedelta(hours=1))
+
+    def test_migration_fills_break_totals(self):
+        # 休憩合計の追加前に作られた記録（休憩記録だけがあり、休憩合計は既定値のまま）
+        punch(self.employee, 'clock_in', now=self.now - timedelta(days=1))
+        punch(self.employee, 'break_start', now=self.now - timedelta(days=1, hours=-3))
+        yesterday = AttendanceRecord.objects.get(user=self.employee, date=self.now.date() - timedelta(days=1))
+        AttendanceRecord.objects.update(break_total=timedelta(), break_started_at=None)
+        AttendanceRecord.objects.filter(pk=self.record.pk).update(total_work_time=timedelta(hours=8))
+        MonthlyTimesheet.objects.update(total_break_time=timedelta())
+
+        migration = importlib.import_module('attendance.migrations.0015_fill_break_totals')
+        migration.fill_break_totals(django_apps, mock.Mock(connection=connection))
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.break_total, timedelta(hours=1))
+        self.assertEqual(self.record.total_work_time, timedelta(hours=8))
+        yesterday.refresh_from_db()
+        self.assertEqual(yesterday.break_started_at, self.now - timedelta(days=1, hours=-3))
+        self.assertEqual(yesterday.break_total, timedelta())
+        self.assertEqual(
+            MonthlyTimesheet.objects.get(user=self.employee, year=self.now.year, month=self.now.month).total_break_time,
+            timedelta(hours=1),
+        )
+
+    def test_hr_update_recomputes_work_time(self):
+        local = timezone.localtime
+        response = self.client.post(reverse('attendance:hr_attendance_update', args=[self.record.pk]), {
+            'user': self.employee.pk,
+            'date': self.record.date.isoformat(),
+            'clock_in': local(self.record.clock_in).strftime('%Y-%m-%dT%H:%M'),
+            'clock_out': (local(self.record.clock_out) + timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M'),
+            'note': '',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.record.refresh_from_db()
+        self.assertEqual(self.record.total_work_time, timedelta(hours=9))
+
+
+class PunchJournalTests(TestCase):
+    """打刻の書き込み遅延（ジャーナル）"""
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(PUNCH_BUFFER={'ENABLED': True, 'JOURNAL_DIR': directory.name})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.journal = PunchJournal()
+        self.employee = CustomUser.objects.create_user(
+            username='employee', password='password', employee_number='E0001', full_name='社員 太郎',
+        )
+        self.now = timezone.localtime(timezone.now()).replace(hour=9, minute=0, second=0, microsecond=0)
+
+    def test_enqueue_validates_against_pending_punches(self):
+        self.assertTrue(enqueue_punch(self.employee, 'clock_in', now=self.now).applied)
+        self.assertFalse(enqueue_punch(self.employee, 'clock_in', now=self.now + timedelta(minutes=1)).applied)
+        self.assertEqual(len(self.journal.pending(self.employee.pk, self.now.date())), 1)
+
+        self.journal.flush()
+        record = AttendanceRecord.objects.get(user=self.employee)
+        self.assertEqual(record.clock_in, self.now)
+        self.assertEqual(self.journal.pending(self.employee.pk, self.now.date()), [])
+
+    def test_flushed_segment_is_not_overlaid_twice(self):
+        enqueue_punch(self.employee, 'clock_in', now=self.now)
+        segment = self.journal.rotate()
+        copy = segment.read_bytes()
+        self.journal.flush_segment(segment)
+        # 反映のコミット後、セグメントの削除前に止まった場合
+        segment.write_bytes(copy)
+
+        self.assertEqual(self.journal.pending(self.employee.pk, self.now.date()), [])
+        self.assertTrue(enqueue_punch(self.employee, 'clock_out', now=self.now + timedelta(hours=8)).applied)
+
+    def test_flush_between_state_and_segment_reads(self):
+        enqueue_punch(self.employee, 'clock_in', now=self.now)
+        segment = self.journal.rotate()
+        keys = {(self.employee.pk, self.now.date())}
+        loads = []
+
+        def load_states():
+            states = load_punch_states(keys)
+            if not loads:
+                # 状態を読んだ直後にライターが反映をコミットした場合
+                self.journal.flush_segment(segment)
+            loads.append(states)
+            return states
+
+        states, entries = self.journal.read_pending(keys, load_states)
+        self.assertEqual(len(loads), 2)
+        self.assertEqual(states[(self.employee.pk, self.now.date())].record.clock_in, self.now)
+        self.assertEqual(entries, [])
+
+    def test_overlay_reads_state_with_pending_punches(self):
+        enqueue_punch(self.employee, 'clock_in', now=self.now)
+        enqueue_punch(self.employee, 'break_start', now=self.now + timedelta(hours=3))
+        enqueue_punch(self.employee, 'break_end', now=self.now + timedelta(hours=4))
+        segment = self.journal.rotate()
+        # 打刻画面が反映前に読んだ勤怠（まだ記録がない）
+        stale = AttendanceRecord(user=self.employee, date=self.now.date())
+        loads = []
+
+        def load_states(keys):
+            if not loads:
+                # 未反映の打刻を読んだ直後にライターが反映をコミットした場合
+                self.journal.flush_segment(segment)
+            loads.append(keys)
+            return load_punch_states(keys)
+
+        with mock.patch('attendance.journal.load_punch_states', side_effect=load_states):
+            record = overlay_pending(stale, self.journal)
+        self.assertEqual(record.clock_in, self.now)
+        self.assertEqual(record.break_total, timedelta(hours=1))
+        self.assertIsNone(record.break_started_at)
+        self.assertIsNotNone(record.pk)
+
+        # 未反映の打刻がなければ、渡した勤怠をそのまま使う（DBを読み直さない）
+        with CaptureQueriesContext(connection) as captured:
+            self.assertIs(overlay_pending(record, self.journal), record)
+        self.assertEqual(len(captured.captured_queries), 0)
+
+    def test_flush_compacts_segment_history(self):
+        enqueue_punch(self.employee, 'clock_in', now=self.now)
+        self.journal.flush()
+        flushed = PunchJournalSegment.objects.get()
+        # 反映直後の記録は、並行して読み始めた read_pending のために残す
+        self.journal.flush()
+        self.assertTrue(PunchJournalSegment.objects.filter(pk=flushed.pk).exists())
+
+        # コミット後・削除前に止まったセグメントは、ファイルが残る間は記録も残す
+        enqueue_punch(self.employee, 'clock_out', now=self.now + timedelta(hours=8))
+        crashed = self.journal.rotate()
+        PunchJournalSegment.objects.create(name=crashed.name)
+        PunchJournalSegment.objects.update(flushed_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(self.journal.compact_history(), 1)
+        self.assertEqual(list(PunchJournalSegment.objects.values_list('name', flat=True)), [crashed.name])
+
+        self.journal.flush()
+        self.assertFalse(crashed.exists())
+        self.assertFalse(PunchJournalSegment.objects.exists())
+
+    def test_enqueue_publishes_to_roster(self):
+        # ライターは別プロセスのため、受付したプロセスのロースターの購読者へ配る
+        with mock.patch.object(roster_broker, 'publish') as publish, self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(enqueue_punch(self.employee, 'clock_in', now=self.now).applied)
+            self.assertFalse(enqueue_punch(self.employee, 'clock_in', now=self.now).applied)
+        publish.assert_called_once_with(self.employee.pk, {
+            'user_id': self.employee.pk, 'date': self.now.date().isoformat(), 'action': 'clock_in', 'at': '09:00',
+        })
+
+
+@override_settings(ATTENDANCE_KIOSK_TOKENS=['kiosk-token'])
+class PunchApiTests(TestCase):
+    """打刻端末API"""
+
+    def setUp(self):
+        cache.clear()
+        self.employee = CustomUser.objects.create_user(
+            username='employee', password='password', employee_number='E0001', full_name='社員 太郎',
+        )
+        self.start = timezone.localtime(timezone.now()).replace(hour=9, minute=0, second=0, microsecond=0) - timedelta(days=1)
+
+    def post(self, payload):
+        return self.client.post(
+            reverse('attendance:punch_api'), json.dumps(payload),
+            content_type='application/json', HTTP_AUTHORIZATION='Bearer kiosk-token',
+        )
+
+    def punch_item(self, action, hours, **extra):
+        return {
+            'employee_number': 'E0001', 'action': action,
+            'timestamp': (self.start + timedelta(hours=hours)).isoformat(), **extra,
+        }
+
+    def test_token_is_applied_once(self):
+        payload = {'punches': [
+            self.punch_item('clock_in', 0, token='t1'),
+            self.punch_item('clock_in', 0, token='t1'),
+        ]}
+        response = self.post(payload)
+        self.assertEqual([result['status'] for result in response.json()['results']], ['applied', 'duplicate'])
+        response = self.post(payload)
+        self.assertEqual([result['status'] for result in response.json()['results']], ['duplicate', 'duplicate'])
+
+    def test_rejected_punch_releases_token(self):
+        self.assertEqual(self.post(self.punch_item('clock_out', 8, token='t1')).json()['status'], 'rejected')
+        self.post(self.punch_item('clock_in', 0))
+        self.assertEqual(self.post(self.punch_item('clock_out', 8, token='t1')).json()['status'], 'applied')
+
+    def test_punch_before_last_punch_is_rejected(self):
+        response = self.post({'punches': [
+            self.punch_item('clock_in', 0),
+            self.punch_item('break_start', 3),
+        ]})
+        self.assertEqual(response.json()['applied'], 2)
+
+        response = self.post({'punches': [
+            self.punch_item('break_end', 2),
+            self.punch_item('break_end', 4),
+        ]})
+        self.assertEqual([result['status'] for result in response.json()['results']], ['rejected', 'applied'])
+        # 最後の打刻（休憩終了）はDBから読んだ状態でも考慮する
+        self.assertEqual(self.post(self.punch_item('clock_out', 3.5)).json()['status'], 'rejected')
+        record = AttendanceRecord.objects.get(user=self.employee)
+        self.assertEqual(record.break_total, timedelta(hours=1))
+        self.assertIsNone(record.clock_out)
+
+    def test_employee_number_must_be_string(self):
+        for employee_number in (['E0001'], {'number': 'E0001'}, 1):
+            response = self.post({'employee_number': employee_number, 'action': 'clock_in'})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['status'], 'invalid')
+
+    def test_failing_punch_does_not_fail_batch(self):
+        CustomUser.objects.create_user(
+            username='broken', password='password', employee_number='E0002', full_name='社員 次郎',
+        )
+        broken = CustomUser.objects.get(employee_number='E0002')
+        original = PunchState.apply
+
+        def apply(state, action, now, note=''):
+            if state.record.user_id == broken.pk:
+                raise RuntimeError('broken')
+            return original(state, action, now, note)
+
+        with mock.patch.object(PunchState, 'apply', autospec=True, side_effect=apply), \
+                self.assertLogs('attendance.views.api_views', 'ERROR'):
+            response = self.post({'punches': [
+                self.punch_item('clock_in', 0, token='t1'),
+                self.punch_item('clock_in', 0, token='t2', employee_number='E0002'),
+                self.punch_item('clock_out', 8, token='t3'),
+            ]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['applied'], 2)
+        self.assertEqual(
+            [result['status'] for result in response.json()['results']], ['applied', 'error', 'applied'],
+        )
+        self.assertFalse(AttendanceRecord.objects.filter(user=broken).exists())
+        self.assertIsNotNone(AttendanceRecord.objects.get(user=self.employee).clock_out)
+
+        # 処理できなかった打刻のトークンだけが解放され、再送できる
+        response = self.post({'punches': [
+            self.punch_item('clock_in', 0, token='t1'),
+            self.punch_item('clock_in', 0, token='t2', employee_number='E0002'),
+        ]})
+        self.assertEqual([result['status'] for result in response.json()['results']], ['duplicate', 'applied'])
+
+    def test_buffered_punches_go_through_journal(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(
+            PUNCH_BUFFER={'ENABLED': True, 'JOURNAL_DIR': directory},
+        ):
+            self.assertEqual(self.post(self.punch_item('clock_in', 0)).json()['status'], 'applied')
+            self.assertFalse(AttendanceRecord.objects.exists())
+            # 画面の打刻も同じジャーナルの状態で検証される
+            result = enqueue_punch(self.employee, 'clock_in', now=self.start + timedelta(hours=1))
+            self.assertFalse(result.applied)
+
+            PunchJournal().flush()
+        self.assertEqual(AttendanceRecord.objects.get(user=self.employee).clock_in, self.start)
+
+
+class SharedCacheTests(TestCase):
+    """全ワーカーで共有するキャッシュ"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.cache = SharedFileBasedCache(directory.name, {})
+
+    def test_add_succeeds_once(self):
+        self.assertTrue(self.cache.add('token', 'clock_in', 60))
+        self.assertFalse(self.cache.add('token', 'clock_out', 60))
+        self.assertEqual(self.cache.get('token'), 'clock_in')
+
+    def test_add_replaces_expired_entry(self):
+        self.cache.set('token', 'clock_in', -1)
+        self.assertTrue(self.cache.add('token', 'clock_out', 60))
+        self.assertEqual(self.cache.get('token'), 'clock_out')
+
+    def test_process_local_cache_is_reported(self):
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual([error.id for error in check_shared_cache(None)], ['attendance.W001'])
+        self.assertEqual(check_shared_cache(None), [])
+
+
+class UnreadCounterTests(TestCase):
+    """未確認件数の集計"""
+
+    def setUp(self):
+        cache.clear()
+        self.department = Department.objects.create(name='開発部')
+        self.other_department = Department.objects.create(name='営業部')
+        self.hr = CustomUser.objects.create_superuser(
+            username='hr', password='password', employee_number='H0001', full_name='人事 太郎', role='hr',
+        )
+        self.manager = CustomUser.objects.create_user(
+            username='manager', password='password', employee_number='M0001', full_name='上司 太郎', role='manager',
+        )
+        self.department.manager = self.manager
+        self.department.save()
+        self.team = Team.objects.create(name='第一課', department=self.other_department, manager=self.manager)
+        self.employee = CustomUser.objects.create_user(
+            username='employee', password='password', employee_number='E0001', full_name='社員 太郎',
+            department=self.department,
+        )
+        # 他部署に所属する管理課の社員
+        self.team_member = CustomUser.objects.create_user(
+            username='member', password='password', employee_number='E0002', full_name='社員 花子',
+            department=self.other_department, team=self.team,
+        )
+        self.now = timezone.localtime(timezone.now()).replace(hour=9, minute=0, second=0, microsecond=0)
+
+    def counts(self):
+        return unread_count(*company_keys()), unread_count(user_key(self.employee.pk))
+
+    def test_first_punch_updates_two_counters(self):
+        punch(self.employee, 'clock_in', now=self.now - timedelta(days=1))
+        with CaptureQueriesContext(connection) as captured:
+            punch(self.employee, 'clock_in', now=self.now)
+        table = UnreadRecordCounter._meta.db_table
+        writes = [query['sql'] for query in captured.captured_queries if f'"{table}"' in query['sql']]
+        self.assertEqual(len(writes), 2)
+        self.assertEqual(self.counts(), (2, 2))
+
+    def test_admin_edit_and_delete(self):
+        punch(self.employee, 'clock_in', now=self.now)
+        record = AttendanceRecord.objects.get(user=self.employee)
+        self.client.login(username='hr', password='password')
+        local_clock_in = timezone.localtime(record.clock_in)
+        response = self.client.post(reverse('admin:attendance_attendancerecord_change', args=[record.pk]), {
+            'user': self.team_member.pk,
+            'date': record.date.isoformat(),
+            'clock_in_0': local_clock_in.strftime('%Y-%m-%d'),
+            'clock_in_1': local_clock_in.strftime('%H:%M:%S'),
+            'break_total': '00:00:00',
+            'note': '',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.counts(), (1, 0))
+        self.assertEqual(unread_count(user_key(self.team_member.pk)), 1)
+
+        self.client.post(reverse('admin:attendance_attendancerecord_delete', args=[record.pk]), {'post': 'yes'})
+        self.assertEqual(unread_count(*company_keys()), 0)
+        self.assertEqual(unread_count(user_key(self.team_member.pk)), 0)
+
+    def test_user_delete_removes_counts(self):
+        punch(self.employee, 'clock_in', now=self.now)
+        punch(self.team_member, 'clock_in', now=self.now)
+        self.employee.delete()
+        self.assertEqual(unread_count(*company_keys()), 1)
+        self.assertFalse(UnreadRecordCounter.objects.filter(key=user_key(self.employee.pk)).exists())
+
+    def test_transfer_keeps_counts(self):
+        punch(self.employee, 'clock_in', now=self.now)
+        self.employee.department = self.other_department
+        self.employee.save()
+        call_command('reconcile_unread_counters', stdout=io.StringIO())
+
+    def test_manager_badge_includes_team_members(self):
+        punch(self.employee, 'clock_in', now=self.now)
+        punch(self.team_member, 'clock_in', now=self.now)
+        self.client.login(username='manager', password='password')
+        response = self.client.get(reverse('attendance:manager_attendance_list'), {'date': self.now.date().isoformat()})
+        self.assertEqual(response.context['unread_record_count'], 2)
+
+    def notification_counts(self):
+        return {
+            user.pk: Notification.objects.filter(recipient=user).count()
+            for user in (self.employee, self.team_member, self.manager, self.hr)
+        }
+
+    def test_hr_bulk_read_selected_records(self):
+        punch(self.employee, 'clock_in', now=self.now - timedelta(days=1))
+        punch(self.employee, 'clock_in', now=self.now)
+        punch(self.team_member, 'clock_in', now=self.now)
+        selected = list(AttendanceRecord.objects.filter(date=self.now.date()).values_list('pk', flat=True))
+        before = self.notification_counts()
+
+        self.client.login(username='hr', password='password')
+        url = reverse('attendance:hr_attendance_bulk_read')
+        response = self.client.post(url, {'record_ids': [*map(str, selected), 'x'], 'action': 'mark_read'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(set(AttendanceRecord.objects.filter(is_read=True).values_list('pk', flat=True)), set(selected))
+        self.assertEqual(AttendanceRecord.objects.get(is_read=True, user=self.employee).read_by, self.hr)
+        # 確認した件数だけ全社・社員ごとの未確認件数が減る
+        self.assertEqual(self.counts(), (1, 1))
+        self.assertEqual(unread_count(user_key(self.team_member.pk)), 0)
+        # 記録のあった社員ごとに1件ずつ通知する
+        after = self.notification_counts()
+        self.assertEqual(after[self.employee.pk] - before[self.employee.pk], 1)
+        self.assertEqual(after[self.team_member.pk] - before[self.team_member.pk], 1)
+        self.assertEqual(after[self.manager.pk], before[self.manager.pk])
+
+        # 確認済の記録を選び直しても件数・通知は変わらない
+        self.client.post(url, {'record_ids': list(map(str, selected)), 'action': 'mark_read'})
+        self.assertEqual(self.counts(), (1, 1))
+        self.assertEqual(self.notification_counts(), after)
+
+        self.client.post(url, {'scope': 'all', 'action': 'unmark_read'})
+        self.assertFalse(AttendanceRecord.objects.filter(is_read=True).exists())
+        self.assertEqual(self.counts(), (3, 2))
+
+    def test_manager_bulk_read_stays_in_scope(self):
+        outsider = CustomUser.objects.create_user(
+            username='outsider', password='password', employee_number='E0003', full_name='社員 三郎',
+            department=self.other_department,
+        )
+        for user in (self.employee, self.team_member, outsider):
+            punch(user, 'clock_in', now=self.now)
+        before = self.notification_counts()
+
+        self.client.login(username='manager', password='password')
+        self.client.post(reverse('attendance:manager_attendance_bulk_read'), {
+            'date': self.now.date().isoformat(),
+            'record_ids': [str(pk) for pk in AttendanceRecord.objects.values_list('pk', flat=True)],
+            'action': 'mark_read',
+        })
+        self.assertEqual(
+            set(AttendanceRecord.objects.filter(is_read=True).values_list('user_id', flat=True)),
+            {self.employee.pk, self.team_member.pk},
+        )
+        self.assertEqual(unread_count(*company_keys()), 1)
+        self.assertEqual(unread_count(user_key(outsider.pk)), 1)
+        self.assertFalse(Notification.objects.filter(recipient=outsider, sender=self.manager).exists())
+        after = self.notification_counts()
+        self.assertEqual(after[self.employee.pk] - before[self.employee.pk], 1)
+        self.assertEqual(after[self.team_member.pk] - before[self.team_member.pk], 1)
+
+    def test_migration_fills_counters(self):
+        AttendanceRecord.objects.bulk_create([
+            AttendanceRecord(user=self.employee, date=self.now.date()),
+            AttendanceRecord(user=self.employee, date=self.now.date() - timedelta(days=1), is_read=True),
+            AttendanceRecord(user=self.team_member, date=self.now.date()),
+        ])
+        UnreadRecordCounter.objects.create(key='department:1', count=5)
+        migration = importlib.import_module('attendance.migrations.0011_fill_unread_counters')
+        migration.fill_counters(django_apps, None)
+        self.assertEqual(self.counts(), (2, 1))
+        self.assertFalse(UnreadRecordCounter.objects.filter(key='department:1').exists())
+
+
+class ManagerRosterTests(TestCase):
+    """上司の日次一覧と、部下の本日の出勤状況（スナップショットと SSE）"""
+
+    def setUp(self):
+        cache.clear()
+        self.department = Department.objects.create(name='開発部')
+        self.other_department = Department.objects.create(name='営業部')
+        self.manager = CustomUser.objects.create_user(
+            username='manager', password='password', employee_number='M0001', full_name='上司 太郎', role='manager',
+        )
+        self.department.manager = self.manager
+        self.department.save()
+        self.employees = [
+            CustomUser.objects.create_user(
+                username=f'employee{i}', password='password', employee_number=f'E{i:04d}', full_name=f'社員 {i}',
+                department=self.department,
+            )
+            for i in range(12)
+        ]
+        self.outsider = CustomUser.objects.create_user(
+            username='outsider', password='password', employee_number='X0001', full_name='他部署 花子',
+            department=self.other_department,
+        )
+        self.now = timezone.localtime(timezone.now()).replace(hour=9, minute=0, second=0, microsecond=0)
+
+    def test_attendance_list_reads_records_for_page_only(self):
+        for employee in [*self.employees[:11], self.outsider]:
+            punch(employee, 'clock_in', now=self.now)
+        self.client.login(username='manager', password='password')
+        url = reverse('attendance:manager_attendance_list')
+        table = AttendanceRecord._meta.db_table
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url, {'date': self.now.date().isoformat()})
+        page_ids = {user.pk for user in response.context['object_list']}
+        self.assertEqual(page_ids, {employee.pk for employee in self.employees[:10]})
+        self.assertTrue(all(user.record_of_the_day for user in response.context['object_list']))
+
+        record_reads = [
+            query['sql'] for query in captured.captured_queries
+            if query['sql'].startswith('SELECT') and f'FROM "{table}"' in query['sql'] and 'COUNT(' not in query['sql']
+        ]
+        self.assertEqual(len(record_reads), 1)
+        read_ids = {int(pk) for pk in re.search(r'"user_id" IN \(([^)]*)\)', record_reads[0]).group(1).split(',')}
+        self.assertEqual(read_ids, page_ids)
+
+        response = self.client.get(url, {'date': self.now.date().isoformat(), 'status': 'unsubmitted'})
+        self.assertEqual([user.pk for user in response.context['object_list']], [self.employees[11].pk])
+        self.assertEqual(response.context['object_list'][0].record_of_the_day, [])
+        response = self.client.get(url, {'date': self.now.date().isoformat(), 'status': 'submitted', 'page': 2})
+        self.assertEqual([user.pk for user in response.context['object_list']], [self.employees[10].pk])
+
+    async def test_snapshot_reports_status(self):
+        working, on_break, left = self.employees[:3]
+        await sync_to_async(punch)(working, 'clock_in', now=self.now)
+        await sync_to_async(punch)(on_break, 'clock_in', now=self.now)
+        await sync_to_async(punch)(on_break, 'break_start', now=self.now + timedelta(hours=3))
+        await sync_to_async(punch)(left, 'clock_in', now=self.now)
+        await sync_to_async(punch)(left, 'clock_out', now=self.now + timedelta(hours=9))
+
+        user_ids = [working.pk, on_break.pk, left.pk, self.employees[3].pk, self.manager.pk]
+        snapshot = await roster_snapshot(user_ids, self.now.date())
+        self.assertEqual(snapshot['date'], self.now.date().isoformat())
+        # 上司本人は含めず、社員番号順に並べる
+        self.assertEqual(
+            [(row['employee_number'], row['status']) for row in snapshot['rows']],
+            [('E0000', 'working'), ('E0001', 'on_break'), ('E0002', 'left'), ('E0003', 'absent')],
+        )
+        self.assertEqual(snapshot['rows'][1]['break_started_at'], '12:00')
+        self.assertEqual(snapshot['rows'][2]['clock_out'], '18:00')
+
+    async def test_stream_relays_punches_in_scope(self):
+        employee = self.employees[0]
+        day = self.now.date()
+        stream = roster_stream([employee.pk], day)
+        first = await anext(stream)
+        self.assertTrue(first.startswith('event: snapshot\n'))
+        self.assertIn('"status": "absent"', first)
+
+        # 購読しているのはスナップショットを送った時点から（他の社員・他の日付の打刻は送らない）
+        pending = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        event = {'user_id': employee.pk, 'date': day.isoformat(), 'action': 'clock_in', 'at': '09:00'}
+        self.assertEqual(roster_broker.publish(self.outsider.pk, dict(event, user_id=self.outsider.pk)), 0)
+        roster_broker.publish(employee.pk, dict(event, date='2000-01-01'))
+        roster_broker.publish(employee.pk, event)
+        self.assertEqual(await asyncio.wait_for(pending, 5), sse('punch', event))
+        await stream.aclose()
+
+class MonthlyTimesheetTests(TestCase):
+    """月次勤怠集計の差分更新と作り直し"""
+
+    def setUp(self):
+        cache.clear()
+        self.employee = CustomUser.objects.create_user(
+            username='employee', password='password', employee_number='E0001', full_name='社員 太郎',
+        )
+        self.now = timezone.localtime(timezone.now()).replace(hour=9, minute=30, second=0, microsecond=0)
+
+    def timesheet(self):
+        return MonthlyTimesheet.objects.values(*ROLLUP_FIELDS).get(
+            user=self.employee, year=self.now.year, month=self.now.month,
+        )
+
+    def test_punch_delta_matches_full_refresh(self):
+        punch(self.employee, 'clock_in', now=self.now)
+        punch(self.employee, 'break_start', now=self.now.replace(hour=12))
+        punch(self.employee, 'break_end', now=self.now.replace(hour=13))
+        punch(self.employee, 'clock_out', now=self.now.replace(hour=17))
+        applied = self.timesheet()
+        self.assertEqual(applied['days_worked'], 1)
+        self.assertEqual(applied['total_break_time'], timedelta(hours=1))
+
+        refresh_timesheets({(self.employee.pk, self.now.year, self.now.month)})
+        self.assertEqual(self.timesheet(), applied)
+
+    def test_punch_does_not_reread_month(self):
+        punch(self.employee, 'clock_in', now=self.now)
+        table = AttendanceRecord._meta.db_table
+        with CaptureQueriesContext(connection) as captured:
+            punch(self.employee, 'clock_out', now=self.now.replace(hour=17))
+        month_reads = [
+            query['sql'] for query in captured.captured_queries
+            if query['sql'].startswith('SELECT') and f'"{table}"."date" >=' in query['sql']
+        ]
+        self.assertEqual(month_reads, [])
+
+    def test_rebuild_command_replaces_stale_timesheets(self):
+        punch(self.employee, 'clock_in', now=self.now)
+        punch(self.employee, 'clock_out', now=self.now.replace(hour=17))
+        expected = self.timesheet()
+        MonthlyTimesheet.objects.all().delete()
+        # 記録のない月の古い集計
+        stale = MonthlyTimesheet.objects.create(user=self.employee, year=2000, month=1, days_worked=3)
+        MonthlyTimesheet.objects.filter(pk=stale.pk).update(updated_at=self.now - timedelta(days=1))
+
+        out = io.StringIO()
+        call_command('rebuild_monthly_timesheets', '--chunk-size', '1', stdout=out)
+        self.assertIn('1 件の月次勤怠集計を作成し、1 件を削除しました。', out.getvalue())
+        self.assertEqual(self.timesheet(), expected)
+        self.assertFalse(MonthlyTimesheet.objects.filter(pk=stale.pk).exists())
+
+    def test_clock_out_applied_next_day(self):
+        day = date(2026, 3, 10)
+        clock_in = timezone.make_aware(datetime(2026, 3, 10, 9, 30))
+        entry = {'user_id': self.employee.pk, 'note': ''}
+        with mock.patch('django.utils.timezone.localdate', return_value=day):
+            apply_punch_batch([dict(entry, action='clock_in', timestamp=clock_in)])
+        # 退勤打刻がないまま日付が変わると打刻漏れとして数える
+        self.assertEqual(count_missing_clock_outs([self.employee.pk], 2026, 3, today=day), {})
+        self.assertEqual(
+            count_missing_clock_outs([self.employee.pk], 2026, 3, today=day + timedelta(days=1)),
+            {(self.employee.pk, 3): 1},
+        )
+
+        # 前日分の退勤打刻が翌日に反映されても集計は負にならず、打刻漏れも解消される
+        with mock.patch('django.utils.timezone.localdate', return_value=day + timedelta(days=1)):
+            results = apply_punch_batch([dict(entry, action='clock_out', timestamp=clock_in.replace(hour=18))])
+        self.assertEqual(results[0].level, messages.SUCCESS)
+        self.assertEqual(
+            count_missing_clock_outs([self.employee.pk], 2026, 3, today=day + timedelta(days=1)), {},
+        )
+        key = (self.employee.pk, 2026, 3)
+        applied = MonthlyTimesheet.objects.values(*ROLLUP_FIELDS).get(user=self.employee, year=2026, month=3)
+        refresh_timesheets({key})
+        self.assertEqual(
+            MonthlyTimesheet.objects.values(*ROLLUP_FIELDS).get(user=self.employee, year=2026, month=3), applied,
+        )
+        self.assertEqual(applied['days_worked'], 1)
+
+    def test_timesheet_view_counts_missing_clock_outs(self):
+        yesterday = self.now - timedelta(days=1)
+        punch(self.employee, 'clock_in', now=yesterday)
+        self.client.force_login(self.employee)
+        response = self.client.get(reverse('attendance:timesheet'), {'year': yesterday.year})
+        self.assertEqual(response.context['months'][yesterday.month - 1][1].missing_clock_outs, 1)
+        self.assertEqual(response.context['year_total'].missing_clock_outs, 1)
+
+
+class AttendanceExportTests(TestCase):
+    """勤怠記録の CSV / Excel の逐次ダウンロード"""
+    RECORDS = 7
+    CHUNK_SIZE = 3
+
+    def setUp(self):
+        cache.clear()
+        self.hr = CustomUser.objects.create_user(
+            username='hr', password='password', employee_number='H0001', full_name='人事 太郎', role='hr',
+        )
+        self.employee = CustomUser.objects.create_user(
+            username='employee', password='password', employee_number='E0001', full_name='社員 太郎',
+        )
+        start = timezone.make_aware(datetime(2024, 1, 1, 9))
+        records = AttendanceRecord.objects.bulk_create([
+            AttendanceRecord(
+                user=self.employee, date=date(2024, 1, 1) + timedelta(days=day),
+                clock_in=start + timedelta(days=day), clock_out=start + timedelta(days=day, hours=9),
+                break_total=timedelta(hours=1),
+            )
+            for day in range(self.RECORDS)
+        ])
+        BreakRecord.objects.bulk_create([
+            BreakRecord(
+                attendance=record,
+                start_time=record.clock_in + timedelta(hours=hours),
+                end_time=record.clock_in + timedelta(hours=hours, minutes=30),
+            )
+            for record in records
+            for hours in (3, 6)
+        ])
+        self.client.login(username='hr', password='password')
+
+    def export(self, export_format):
+        # チャンクの境界をまたぐよう、小さいチャンクで読む
+        rows = functools.partial(iter_export_rows, chunk_size=self.CHUNK_SIZE)
+        with mock.patch('attendance.views.hr_views.iter_export_rows', rows), \
+                CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('attendance:hr_attendance_export'), {'format': export_format})
+            self.assertEqual(response.status_code, 200)
+            content = b''.join(
+                chunk if isinstance(chunk, bytes) else chunk.encode() for chunk in response.streaming_content
+            )
+        break_queries = [
+            query['sql'] for query in captured.captured_queries
+            if f'FROM "{BreakRecord._meta.db_table}"' in query['sql']
+        ]
+        return response, content, break_queries
+
+    def test_csv(self):
+        response, content, break_queries = self.export('csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.reader(io.StringIO(content.decode('utf-8-sig'))))
+        self.assertEqual(rows[0], EXPORT_HEADER)
+        self.assertEqual(len(rows), self.RECORDS + 1)
+        self.assertEqual(rows[1][:3], ['E0001', '社員 太郎', '2024-01-01'])
+        self.assertEqual(rows[1][6], '12:00-12:30 / 15:00-15:30')
+        self.assertEqual([row[2] for row in rows[1:]], sorted(row[2] for row in rows[1:]))
+        # 休憩は記録ごとではなくチャンクごとに1クエリで読む
+        self.assertEqual(len(break_queries), -(-self.RECORDS // self.CHUNK_SIZE))
+
+    def test_xlsx_is_valid_zip(self):
+        response, content, break_queries = self.export('xlsx')
+        self.assertTrue(response['Content-Disposition'].endswith('.xlsx"'))
+        with zipfile.ZipFile(io.BytesIO(content)) as workbook:
+            self.assertIsNone(workbook.testzip())
+            self.assertIn('xl/workbook.xml', workbook.namelist())
+            sheet = workbook.read('xl/worksheets/sheet1.xml').decode()
+        self.assertEqual(sheet.count('<row>'), self.RECORDS + 1)
+        self.assertIn('<t xml:space="preserve">社員番号</t>', sheet)
+        self.assertEqual(len(break_queries), -(-self.RECORDS // self.CHUNK_SIZE))
+
+class AttendanceImportTests(TestCase):
+    """勤怠記録のCSV取込"""
+
+    def setUp(self):
+        cache.clear()
+        self.hr = CustomUser.objects.create_superuser(
+            username='hr', password='password', employee_number='H0001', full_name='人事 太郎', role='hr',
+        )
+        self.employee = CustomUser.objects.create_user(
+            username='employee', password='password', employee_number='E0001', full_name='社員 太郎',
+        )
+        self.day = date(2024, 1, 15)
+
+    def csv(self, *rows):
+        lines = ['社員番号,日付,出勤,退勤,休憩,備考', *rows]
+        return ('\n'.join(lines) + '\n').encode('utf-8-sig')
+
+    def test_upload_through_view(self):
+        self.client.login(username='hr', password='password')
+        upload = SimpleUploadedFile('attendance.csv', self.csv('E0001,2024-01-15,09:00,18:00,12:00-13:00,'))
+        response = self.client.post(reverse('attendance:hr_attendance_import'), {'file': upload, 'mode': 'ignore'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['result'].created, 1)
+        record = AttendanceRecord.objects.get(user=self.employee, date=self.day)
+        self.assertEqual(record.break_total, timedelta(hours=1))
+        self.assertEqual(record.total_work_time, timedelta(hours=8))
+        self.assertEqual(unread_count(user_key(self.employee.pk)), 1)
+
+    def test_open_break_is_imported(self):
+        result = import_attendance_csv(self.csv('E0001,2024-01-15,09:00,,10:00-10:10 / 12:00-,'))
+        self.assertEqual(result.error_count, 0)
+        record = AttendanceRecord.objects.get(user=self.employee, date=self.day)
+        self.assertEqual(timezone.localtime(record.break_started_at).strftime('%H:%M'), '12:00')
+        self.assertEqual(record.break_total, timedelta(minutes=10))
+        self.assertEqual(record.breaks.filter(end_time__isnull=True).count(), 1)
+
+        result = import_attendance_csv(self.csv('E0001,2024-01-16,09:00,18:00,12:00-,'))
+        self.assertEqual(result.error_count, 1)
+
+    def test_ignore_mode_skips_rows_registered_concurrently(self):
+        AttendanceRecord.objects.create(user=self.employee, date=self.day)
+        manager = AttendanceRecord.objects
+        bulk_create = manager.bulk_create
+
+        def register_first(records, **kwargs):
+            # 登録済みの確認の後に、同じ日の記録が別に登録された場合
+            manager.create(user=self.employee, date=self.day + timedelta(days=1), note='打刻')
+            return bulk_create(records, **kwargs)
+
+        with mock.patch.object(manager, 'bulk_create', side_effect=register_first):
+            result = import_attendance_csv(self.csv(
+                'E0001,2024-01-15,09:00,18:00,,',
+                'E0001,2024-01-16,09:00,18:00,12:00-13:00,',
+                'E0001,2024-01-17,09:00,18:00,12:00-13:00,',
+            ))
+        self.assertEqual((result.created, result.skipped, result.error_count), (1, 2, 0))
+        self.assertEqual(AttendanceRecord.objects.get(user=self.employee, date=self.day + timedelta(days=1)).note, '打刻')
+        self.assertFalse(BreakRecord.objects.filter(attendance__date=self.day + timedelta(days=1)).exists())
+        self.assertEqual(BreakRecord.objects.filter(attendance__date=self.day + timedelta(days=2)).count(), 1)
+        # 未確認件数はこの取込で登録した1件だけ増える（既存・同時登録の記録は create では数えない）
+        self.assertEqual(unread_count(user_key(self.employee.pk)), 1)
+
+
+class CalendarFeedTests(TestCase):
+    """カレンダーの ETag（社員ごとの更新日時）"""
+
+    def setUp(self):
+        cache.clear()
+        self.employee = CustomUser.objects.create_user(
+            username='employee', password='password', employee_number='E0001', full_name='社員 太郎',
+        )
+        self.now = timezone.localtime(timezone.now()).replace(hour=9, minute=0, second=0, microsecond=0)
+        self.client.login(username='employee', password='password')
+
+    def etag(self):
+        start = self.now.date().replace(day=1)
+        params = {'start': start.isoformat(), 'end': (start + timedelta(days=40)).isoformat()}
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(reverse('attendance:calendar_events'), params)
+        self.assertEqual(response.status_code, 200)
+        writes = [query['sql'] for query in captured.captured_queries if query['sql'].startswith(('INSERT', 'UPDATE'))]
+        # 表示の要求ではセッション以外に書き込まない
+        self.assertEqual([sql for sql in writes if 'django_session' not in sql], [])
+        return response['ETag']
+
+    def application(self):
+        return Application.objects.create(
+            applicant=self.employee, application_type='remote', reason='在宅', start_datetime=self.now,
+        )
+
+    def test_etag_changes_with_punch_and_survives_cache_clear(self):
+        first = self.etag()
+        self.assertEqual(self.etag(), first)
+        punch(self.employee, 'clock_in', now=self.now)
+        second = self.etag()
+        self.assertNotEqual(second, first)
+        cache.clear()
+        self.assertEqual(self.etag(), second)
+
+    def test_queryset_update_and_delete_change_etag(self):
+        self.application()
+        before = self.etag()
+        Application.objects.filter(applicant=self.employee).update(status='approved')
+        approved = self.etag()
+        self.assertNotEqual(approved, before)
+
+        Application.objects.filter(applicant=self.employee).delete()
+        self.assertNotEqual(self.etag(), approved)
+
+    def test_unmatched_queryset_update_keeps_etag(self):
+        self.application()
+        before = self.etag()
+        Application.objects.filter(applicant=self.employee, status='rejected').update(status='approved')
+        self.assertEqual(self.etag(), before)
+
+
+class ArchiveTests(TestCase):
+    """年ごとのアーカイブへの移動と振り分け"""
+
+    def setUp(self):
+        cache.clear()
+        # アーカイブテーブルはテストごとのトランザクションで巻き戻るため、作成済みの記録も消す
+        archive._existing_tables.clear()
+        self.employee = CustomUser.objects.create_user(
+            username='employee', password='password', employee_number='E0001', full_name='社員 太郎',
+        )
+        self.retired = CustomUser.objects.create_user(
+            username='retired', password='password', employee_number='E0002', full_name='退職 次郎',
+        )
+        self.days = [date(2024, 3, 1), date(2024, 6, 30)]
+        for user, day in [(self.employee, self.days[0]), (self.retired, self.days[1])]:
+            clock_in = timezone.make_aware(datetime.combine(day, datetime.min.time())) + timedelta(hours=9)
+            AttendanceRecord.objects.create(
+                user=user, date=day, clock_in=clock_in, clock_out=clock_in + timedelta(hours=8), is_read=True,
+            )
+
+    def archive(self):
+        call_command('archive_attendance', '--horizon-days', '30', stdout=io.StringIO())
+
+    def test_routes_on_archived_last_date(self):
+        self.archive()
+        self.assertEqual(AttendanceArchive.objects.values_list('year', 'record_count', 'last_date').get(), (2024, 2, self.days[1]))
+        self.assertEqual(len(archive.record_querysets()), 2)
+        self.assertEqual(len(archive.record_querysets(date(2024, 6, 30), None)), 2)
+        self.assertEqual(len(archive.record_querysets(date(2024, 7, 1), date(2024, 12, 31))), 1)
+        self.assertEqual(len(archive.record_querysets(None, date(2023, 12, 31))), 1)
+        # 保存期間の設定を変えても、アーカイブ済みの記録は読み落とさない
+        with override_settings(ATTENDANCE_ARCHIVE_HORIZON_DAYS=100000):
+            self.assertEqual(len(archive.record_querysets(date(2024, 1, 1), date(2024, 12, 31))), 2)
+
+    def test_rerun_counts_only_inserted_rows(self):
+        self.archive()
+        # 移した後、現行テーブルからの削除の前に失敗した場合と同じ状態にする
+        record_model = archive.archive_models(2024)[0]
+        archived = record_model.objects.get(date=self.days[0])
+        AttendanceRecord.objects.create(
+            pk=archived.pk, user=self.employee, date=archived.date, clock_in=archived.clock_in,
+            clock_out=archived.clock_out, is_read=True,
+        )
+        self.archive()
+        self.assertEqual(AttendanceArchive.objects.get().record_count, 2)
+        self.assertEqual(record_model.objects.count(), 2)
+        self.assertFalse(AttendanceRecord.objects.exists())
+
+    def test_deleted_users_records_are_listed(self):
+        self.archive()
+        self.retired.delete()
+        hr = CustomUser.objects.create_superuser(
+            username='hr', password='password', employee_number='H0001', full_name='人事 太郎', role='hr',
+        )
+        self.client.force_login(hr)
+        response = self.client.get(reverse('attendance:hr_attendance_list'), {'start_date': '2024-01-01'})
+        self.assertContains(response, '削除された社員')
+        self.assertContains(response, '社員 太郎')
+        rows = list(iter_export_rows(archive.record_querysets(date(2024, 1, 1), date(2024, 12, 31))))
+        self.assertEqual([row[:3] for row in rows], [['E0001', '社員 太郎', '2024-03-01'], ['', '', '2024-06-30']])
+
+
+class ReadReplicaTests(TransactionTestCase):
+    """2つの SQLite ファイル（プライマリとレプリカ）での読み取りの振り分け"""
+
+    def setUp(self):
+        cache.clear()
+        self.tempdir = tempfile.TemporaryDirectory()
+        replica = connections.configure_settings({
+            'default': {},
+            'replica': {
+                'ENGINE': 'django.db.backends.sqlite3', 'NAME': f'{self.tempdir.name}/replica.sqlite3', 'CONN_MAX_AGE': None,
+            },
+        })['replica']
+        # connections は settings.DATABASES と同じ辞書を参照する
+        patcher = mock.patch.dict(settings.DATABASES, {'replica': replica})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.tempdir.cleanup)
+        self.addCleanup(self.close_replica)
+        override = override_settings(READ_REPLICA={'REPLICAS': ['replica'], 'PIN_SECONDS': 5, 'PIN_COOKIE': 'db_pin'})
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.employee = CustomUser.objects.create_user(
+            username='employee', password='password', employee_number='E0001', full_name='社員 太郎',
+        )
+        self.record = AttendanceRecord.objects.create(user=self.employee, date=timezone.localdate(), note='複製前')
+        call_command('sync_sqlite_replica', stdout=io.StringIO())
+        # テスト実行中に追加した別名は databases に含められないため、テストの接続制限を受けないよう先に接続しておく
+        connections['replica'].connect()
+        # 複製の後にプライマリだけを変更する（レプリカの遅延と同じ状態）
+        AttendanceRecord.objects.filter(pk=self.record.pk).update(note='プライマリ')
+        self.client.force_login(self.employee)
+
+    def close_replica(self):
+        connections['replica'].close()
+        del connections['replica']
+
+    def detail_note(self):
+        response = self.client.get(reverse('attendance:attendance_detail', args=[self.record.pk]))
+        self.assertEqual(response.status_code, 200)
+        return response.context['object'].note
+
+    def test_reads_use_replica_until_a_write_pins_the_primary(self):
+        self.assertEqual(self.detail_note(), '複製前')
+
+        response = self.client.post(reverse('attendance:dashboard'), {'action': 'clock_in', 'punch_token': 'token-1'})
+        self.assertIn('db_pin', response.cookies)
+        self.assertEqual(self.detail_note(), 'プライマリ')
+
+        self.client.cookies.pop('db_pin')
+        self.assertEqual(self.detail_note(), '複製前')
+
+    def test_read_after_write_in_same_request_uses_primary(self):
+        state = RequestState()
+        state.use_replica = True
+        token = db_router._request_state.set(state)
+        self.addCleanup(db_router._request_state.reset, token)
+
+        self.assertEqual(AttendanceRecord.objects.get(pk=self.record.pk).note, '複製前')
+        AttendanceRecord.objects.filter(pk=self.record.pk).update(note='書き込み後')
+        self.assertEqual(AttendanceRecord.objects.get(pk=self.record.pk).note, '書き込み後')
@@ -2,7 +2,7 @@ from ast import main
 from django.urls import path
 
 from attendance.views import manager_views
-from .views import main_views, hr_views
+from .views import main_views, hr_views, api_views
 
 app_name = 'attendance'
 
@@ -11,14 +11,29 @@ urlpatterns = [
     path('', main_views.Index.as_view(), name='index'),
     # 勤怠記録
     path('attendance/dashboard/', main_views.AttendanceDashboardView.as_view(), name='dashboard'),
+    # ASGI で運用する場合の非同期版
+    path('attendance/dashboard/async/', main_views.AsyncAttendanceDashboardView.as_view(), name='dashboard_async'),
     path('attendances/', main_views.AttendanceListView.as_view(), name='attendance_list'),
     path('attendance/<int:pk>/detail/', main_views.AttendanceDetailView.as_view(), name='attendance_detail'),
+    path('attendance/calendar/', main_views.CalendarView.as_view(), name='calendar'),
+    path('attendance/calendar/events/', main_views.CalendarEventsView.as_view(), name='calendar_events'),
+    path('attendance/timesheet/', main_views.MonthlyTimesheetView.as_view(), name='timesheet'),
+    # 打刻端末API
+    path('api/punches/', api_views.PunchApiView.as_view(), name='punch_api'),
     # 人事権限
     path('hr/attendances/', hr_views.HrAttendanceListView.as_view(), name='hr_attendance_list'),
+    path('hr/attendances/bulk-read/', hr_views.HrAttendanceBulkReadView.as_view(), name='hr_attendance_bulk_read'),
+    path('hr/attendances/import/', hr_views.HrAttendanceImportView.as_view(), name='hr_attendance_import'),
+    path('hr/attendances/export/', hr_views.HrAttendanceExportView.as_view(), name='hr_attendance_export'),
+    path('hr/timesheets/', hr_views.HrTimesheetListView.as_view(), name='hr_timesheet_list'),
     path('hr/attendance/create/', hr_views.HrAttendanceCreateView.as_view(), name='hr_attendance_create'),
     path('hr/attendance/<int:pk>/detail/', hr_views.HrAttendanceDetailView.as_view(), name='hr_attendance_detail'),
     path('hr/attendance/<int:pk>/update/', hr_views.HrAttendanceUpdateView.as_view(), name='hr_attendance_update'),
     path('hr/attendance/<int:pk>/delete/', hr_views.HrAttendanceDeleteView.as_view(), name='hr_attendance_delete'),
     # 上司権限
     path('manager/attendances/', manager_views.ManagerAttendanceListView.as_view(), name='manager_attendance_list'),
+    path('manager/attendances/bulk-read/', manager_views.ManagerAttendanceBulkReadView.as_view(), name='manager_attendance_bulk_read'),
+    path('manager/roster/', manager_views.ManagerRosterView.as_view(), name='manager_roster'),
+    path('manager/roster/stream/', manager_views.ManagerRosterStreamView.as_view(), name='manager_roster_stream'),
+    path('manager/timesheets/', manager_views.ManagerTimesheetListView.as_view(), name='manager_timesheet_list'),
 ]
\ No newline at end of file
@@ -0,0 +1,202 @@
+import hmac
+import json
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from ..services import PUNCH_ACTIONS, PUNCH_TOKEN_TIMEOUT, apply_punch_batch
+from ..journal import buffering_enabled, enqueue_punch_batch
+
+CustomUser = get_user_model()
+logger = logging.getLogger(__name__)
+
+# 1リクエストで受け付ける打刻の上限（オフライン中に溜めた打刻の一括送信用）
+DEFAULT_PUNCH_BATCH_LIMIT = 5000
+# 端末の時計ずれとして許容する未来方向の誤差
+ALLOWED_CLOCK_SKEW = timedelta(minutes=5)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class PunchApiView(View):
+    """
+    ICカード端末向けの打刻API。
+    {"employee_number": ..., "action": ..., "timestamp": ...} の単一打刻か、
+    {"punches": [...]} の一括打刻を受け付け、打刻ごとの結果をJSONで返す。
+    """
+    http_method_names = ['post']
+
+    def authenticate(self, request):
+        header = request.headers.get('Authorization', '')
+        if not header.startswith('Bearer '):
+            return False
+        token = header[len('Bearer '):]
+        return any(
+            hmac.compare_digest(token, kiosk_token)
+            for kiosk_token in getattr(settings, 'ATTENDANCE_KIOSK_TOKENS', [])
+        )
+
+    def post(self, request):
+        if not self.authenticate(request):
+            return JsonResponse({'error': '端末の認証に失敗しました。'}, status=401)
+
+        try:
+            payload = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({'error': 'JSONの形式が正しくありません。'}, status=400)
+        if not isinstance(payload, dict):
+            return JsonResponse({'error': 'JSONの形式が正しくありません。'}, status=400)
+
+        is_batch = 'punches' in payload
+        items = payload['punches'] if is_batch else [payload]
+        if not isinstance(items, list):
+            return JsonResponse({'error': 'punches は配列で指定してください。'}, status=400)
+        limit = getattr(settings, 'ATTENDANCE_PUNCH_BATCH_LIMIT', DEFAULT_PUNCH_BATCH_LIMIT)
+        if len(items) > limit:
+            return JsonResponse({'error': f'一度に送信できる打刻は {limit} 件までです。'}, status=400)
+
+        results = self.process(items)
+        if is_batch:
+            applied = sum(1 for result in results if result['status'] == 'applied')
+            return JsonResponse({'applied': applied, 'results': results})
+        return JsonResponse(results[0])
+
+    def process(self, items):
+        now = timezone.now()
+        results = [None] * len(items)
+
+        # 社員番号は1クエリでまとめて社員IDに変換する
+        employee_numbers = {
+            item.get('employee_number') for item in items
+            if isinstance(item, dict) and isinstance(item.get('employee_number'), str)
+        }
+        user_ids = dict(
+            CustomUser.objects.filter(
+                employee_number__in=employee_numbers,
+                is_active=True,
+            ).values_list('employee_number', 'pk')
+        )
+
+        entries = []
+        for index, item in enumerate(items):
+            entry, error = self.validate(item, user_ids, now)
+            if error:
+                results[index] = {'index': index, 'status': 'invalid', 'message': error}
+            else:
+                entry['index'] = index
+                entries.append(entry)
+
+        entries = self.claim_tokens(entries, results)
+        for entry, result in self.apply(entries):
+            if result is None:
+                status, message = 'error', '打刻を処理できませんでした。再送してください。'
+            else:
+                status, message = 'applied' if result.applied else 'rejected', result.message
+            results[entry['index']] = {'index': entry['index'], 'status': status, 'message': message}
+
+        # 受け付けなかった・処理できなかった打刻は、再送できるようにトークンを解放する
+        rejected_tokens = [
+            entry['token_key'] for entry in entries
+            if entry['token_key'] and results[entry['index']]['status'] != 'applied'
+        ]
+        if rejected_tokens:
+            cache.delete_many(rejected_tokens)
+        return results
+
+    def apply(self, entries):
+        """
+        打刻をまとめて適用し、(entry, PunchResult) のリストを返す。
+        一部の打刻で例外が起きた場合は社員ごとに、さらに失敗した社員の打刻は1件ずつ時刻順に適用し直し、
+        適用できなかった打刻だけを結果 None として返す（他の打刻は巻き込まない）。
+        """
+        # 画面の打刻と同じく、書き込み遅延が有効な場合はジャーナルで受け付ける
+        apply = enqueue_punch_batch if buffering_enabled() else apply_punch_batch
+        try:
+            return list(zip(entries, apply(entries)))
+        except Exception:
+            logger.exception('punch api batch failed entries=%d', len(entries))
+
+        groups = defaultdict(list)
+        for entry in entries:
+            groups[entry['user_id']].append(entry)
+        applied = []
+        for user_id, group in groups.items():
+            if len(group) > 1:
+                try:
+                    applied.extend(zip(group, apply(group)))
+                    continue
+                except Exception:
+                    logger.exception('punch api batch failed user=%s entries=%d', user_id, len(group))
+            for entry in sorted(group, key=lambda entry: entry['timestamp']):
+                try:
+                    applied.extend(zip([entry], apply([entry])))
+                except Exception:
+                    logger.exception('punch api failed user=%s index=%d', user_id, entry['index'])
+                    applied.append((entry, None))
+        return applied
+
+    def validate(self, item, user_ids, now):
+        if not isinstance(item, dict):
+            return None, '打刻はオブジェクトで指定してください。'
+
+        employee_number = item.get('employee_number')
+        if not isinstance(employee_number, str):
+            return None, '社員番号は文字列で指定してください。'
+        user_id = user_ids.get(employee_number)
+        if user_id is None:
+            return None, '社員番号が見つかりません。'
+
+        action = item.get('action')
+        if action not in PUNCH_ACTIONS:
+            return None, '未対応の打刻操作です。'
+
+        timestamp = now
+        if item.get('timestamp'):
+            try:
+                timestamp = parse_datetime(str(item['timestamp']))
+            except ValueError:
+                timestamp = None
+            if timestamp is None:
+                return None, '打刻時刻の形式が正しくありません。'
+            if timezone.is_naive(timestamp):
+                timestamp = timezone.make_aware(timestamp)
+            if timestamp > now + ALLOWED_CLOCK_SKEW:
+                return None, '未来の時刻は打刻できません。'
+
+        note = item.get('note', '')
+        if not isinstance(note, str):
+            return None, '備考は文字列で指定してください。'
+
+        token = item.get('token')
+        token_key = f'attendance:punch-token:{user_id}:{token}' if token else None
+        return {
+            'user_id': user_id,
+            'action': action,
+            'timestamp': timestamp,
+            'note': note,
+            'token_key': token_key,
+        }, None
+
+    def claim_tokens(self, entries, results):
+        """
+        トークンを1件ずつ cache.add で確保し、確保できなかった打刻（再送）は適用せずに duplicate として返す。
+        同じトークンの打刻が別の端末・別のリクエストで同時に届いても、確保できるのは1件だけになる。
+        """
+        unique = []
+        for entry in entries:
+            if entry['token_key'] and not cache.add(entry['token_key'], entry['action'], PUNCH_TOKEN_TIMEOUT):
+                results[entry['index']] = {
+                    'index': entry['index'],
+                    'status': 'duplicate',
+                    'message': 'この打刻は既に処理済みです。',
+                }
+                continue
+            unique.append(entry)
+        return unique
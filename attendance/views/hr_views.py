@@ -1,69 +1,132 @@
 from django.shortcuts import redirect
-from django.views.generic import ListView, CreateView, UpdateView, DeleteView, DetailView
+from django.http import Http404, QueryDict
+from django.views.generic import ListView, CreateView, UpdateView, DeleteView, DetailView, View, FormView
+from django.http import StreamingHttpResponse
 from django.core.exceptions import PermissionDenied
 from django.contrib import messages
 from accounts.mixins import HrOnlyMixin
-from ..models import AttendanceRecord
-from ..forms import AttendanceRecordForm
-from django.db.models import Q
+from ..models import AttendanceRecord, MonthlyTimesheet
+from ..forms import AttendanceImportForm, AttendanceRecordForm
+from ..imports import import_attendance_csv
+from ..cache import invalidate_today, invalidate_today_many
+from ..services import set_read_status
+from ..pagination import merge_querysets, paginate_keyset
+from ..filters import filter_attendance_records, filter_attendance_sources
+from ..archive import find_archived_record
+from ..exports import iter_export_rows, stream_csv, stream_xlsx
+from ..counters import add_unread, adjust_unread, company_keys, unread_count, unread_deltas
+from ..rollups import attach_period_totals, parse_period
+from ..changes import records_changed
+from accounts.models import Department
+from django.db import transaction
+from django.db.models import Prefetch, Q
+from django.contrib.auth import get_user_model
 from django.urls import reverse_lazy, reverse
 from datetime import date, timedelta
 from django.utils import timezone
 
+CustomUser = get_user_model()
+
 class HrAttendanceListView(HrOnlyMixin, ListView):
     model = AttendanceRecord
     template_name = 'attendance/hr_attendance_list.html'
+    use_read_replica = True
     paginate_by = 10
+    keyset_ordering = ('-date', '-id')
 
     def get_queryset(self):
-        queryset = AttendanceRecord.objects.select_related('user')
-        
-        q = self.request.GET.get('q')
-        if q:
-            queryset = queryset.filter(
-                Q(user__username__icontains=q) | Q(user__full_name__icontains=q)
-            )
-        
-        start_date_param = self.request.GET.get('start_date')
-        end_date_param = self.request.GET.get('end_date')
-        if start_date_param:
-            try:
-                start_date_obj = date.fromisoformat(start_date_param)
-                queryset = queryset.filter(date__gte=start_date_obj)
-            except ValueError:
-                pass
-        if end_date_param:
-            try:
-                end_date_obj = date.fromisoformat(end_date_param)
-                queryset = queryset.filter(date__lte=end_date_obj)
-            except ValueError:
-                pass
-        
-        selected_read_status = self.request.GET.get('read_status', 'all')
-        if selected_read_status == 'unread':
-            queryset = queryset.filter(is_read=False)
-        
-        elif selected_read_status == 'read':
-            queryset = queryset.filter(is_read=True)
-        
-        return queryset
+        # 開始日がアーカイブの境界日より前の場合だけ、該当する年のアーカイブも含めたクエリセットのリストになる
+        return filter_attendance_sources(self.request.GET, lambda source: source.select_related('user'))
+
+    def paginate_queryset(self, queryset, page_size):
+        # page 指定がある場合は従来のページ番号方式
+        if 'page' in self.request.GET:
+            return super().paginate_queryset(merge_querysets(queryset, self.keyset_ordering), page_size)
+        # それ以外は (date, id) をキーにしたシーク方式で、深いページでも先頭と同じコストで取得する
+        self.cursor_page = paginate_keyset(queryset, self.keyset_ordering, self.request.GET.get('cursor'), page_size)
+        return (None, None, self.cursor_page.object_list, False)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
+        context['cursor_page'] = getattr(self, 'cursor_page', None)
+        # 総件数は要求された場合のみ数える
+        if self.request.GET.get('count'):
+            context['total_count'] = sum(queryset.count() for queryset in self.get_queryset())
         context['q'] = self.request.GET.get('q', '')
         context['start_date_filter_value'] = self.request.GET.get('start_date', '')
         context['end_date_filter_value'] = self.request.GET.get('end_date', '')
         context['selected_read_status'] = self.request.GET.get('read_status', 'all')
-        context['unread_record_count'] = self.get_queryset().filter(is_read=False).count()
+        # 未確認件数は全社の集計値を読む（一覧の再集計はしない）
+        context['unread_record_count'] = unread_count(*company_keys())
 
         query_params = self.request.GET.copy()
-        if 'page' in query_params:
-            del query_params['page']
+        for param in ('page', 'cursor'):
+            if param in query_params:
+                del query_params[param]
         context['current_filters_query'] = f'&{query_params.urlencode()}' if query_params else ''
+        context['filters_query'] = query_params.urlencode()
         
         return context
 
+class HrAttendanceBulkReadView(HrOnlyMixin, View):
+    """一覧で選択した記録、または検索条件に一致するすべての記録をまとめて確認・確認取消する"""
+
+    def post(self, request, *args, **kwargs):
+        # 一覧の検索条件はフォームの filters にクエリ文字列として引き継ぐ
+        filters = QueryDict(request.POST.get('filters', ''))
+        read = request.POST.get('action') != 'unmark_read'
+
+        queryset = AttendanceRecord.objects.all()
+        if request.POST.get('scope') == 'all':
+            queryset = filter_attendance_records(queryset, filters)
+        else:
+            record_ids = [pk for pk in request.POST.getlist('record_ids') if pk.isdigit()]
+            if not record_ids:
+                messages.warning(request, '勤怠記録が選択されていません。')
+                return redirect(f"{reverse('attendance:hr_attendance_list')}?{filters.urlencode()}")
+            queryset = queryset.filter(pk__in=record_ids)
+
+        updated = set_read_status(queryset, request.user, read=read)
+        messages.success(request, f"{updated} 件の勤怠記録を{'確認済' if read else '未確認'}にしました。")
+        return redirect(f"{reverse('attendance:hr_attendance_list')}?{filters.urlencode()}")
+
+class HrAttendanceExportView(HrOnlyMixin, View):
+    """給与計算用に、一覧と同じ条件の勤怠記録を CSV / Excel で逐次ダウンロードする"""
+    use_read_replica = True
+    formats = {
+        'csv': ('text/csv; charset=utf-8', stream_csv),
+        'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', stream_xlsx),
+    }
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get('format', 'csv')
+        if export_format not in self.formats:
+            export_format = 'csv'
+        content_type, stream = self.formats[export_format]
+
+        querysets = filter_attendance_sources(request.GET)
+        response = StreamingHttpResponse(stream(iter_export_rows(querysets)), content_type=content_type)
+        filename = f"attendance_{timezone.localdate().strftime('%Y%m%d')}.{export_format}"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+class HrAttendanceImportView(HrOnlyMixin, FormView):
+    """旧システムなどから出力したCSVの勤怠記録をまとめて取り込む"""
+    form_class = AttendanceImportForm
+    template_name = 'attendance/hr_attendance_import.html'
+
+    def form_valid(self, form):
+        result = import_attendance_csv(form.cleaned_data['file'], mode=form.cleaned_data['mode'])
+        if result.error_count:
+            messages.warning(self.request, f'{result.error_count} 行を取り込めませんでした。エラー内容を確認してください。')
+        messages.success(
+            self.request,
+            f'新規 {result.created} 件、上書き {result.updated} 件、スキップ {result.skipped} 件の勤怠記録を取り込みました。',
+        )
+        # 結果は同じ画面に表示する（エラー行を確認してから修正ファイルを再取込できるように）
+        return self.render_to_response(self.get_context_data(form=self.form_class(), result=result))
+
 class HrAttendanceCreateView(HrOnlyMixin, CreateView):
     model = AttendanceRecord
     form_class = AttendanceRecordForm
@@ -99,29 +162,44 @@ class HrAttendanceCreateView(HrOnlyMixin, CreateView):
             return redirect(self.success_url)
         
         messages.success(self.request, f'{user} さんの {record_date} の勤怠を登録しました。')
-        
-        return super().form_valid(form)
+        with transaction.atomic():
+            response = super().form_valid(form)
+            add_unread(self.object.user)
+            records_changed([(self.object.user_id, self.object.date)])
+        invalidate_today(self.object.user_id, self.object.date)
+        return response
 
 class HrAttendanceDetailView(HrOnlyMixin, DetailView):
     model = AttendanceRecord
     template_name = 'attendance/attendance_detail.html'
+    use_read_replica = True
 
     def get_queryset(self):
         return AttendanceRecord.objects.select_related('user', 'read_by').prefetch_related('breaks')
+
+    def get_object(self, queryset=None):
+        try:
+            return super().get_object(queryset)
+        except Http404:
+            # 一覧からアーカイブ済みの記録を開いた場合
+            record = find_archived_record(self.kwargs['pk'])
+            if record is None:
+                raise
+            return record
     
     def post(self, request, *args, **kwargs):
         self.object = self.get_object()
 
-        if 'mark_read' in request.POST:
-            self.object.is_read = True
-            self.object.read_by = request.user
-            self.object.read_at = timezone.now()
-            self.object.save()
-        elif 'unmark_read' in request.POST:
-            self.object.is_read = False
-            self.object.read_by = None
-            self.object.read_at = None
-            self.object.save()
+        records = AttendanceRecord.objects.filter(pk=self.object.pk)
+
+        # 確認状況が実際に変わった場合だけ未確認件数を増減する
+        with transaction.atomic():
+            if 'mark_read' in request.POST:
+                if records.filter(is_read=False).update(is_read=True, read_by=request.user, read_at=timezone.now()):
+                    add_unread(self.object.user, -1)
+            elif 'unmark_read' in request.POST:
+                if records.filter(is_read=True).update(is_read=False, read_by=None, read_at=None):
+                    add_unread(self.object.user)
         
         return redirect('attendance:hr_attendance_detail', pk=self.object.pk)
 
@@ -144,7 +222,21 @@ class HrAttendanceUpdateView(HrOnlyMixin, UpdateView):
         user = form.cleaned_data.get('user')
         record_date = form.cleaned_data.get('date')
         messages.success(self.request, f'{user} さんの {record_date} の勤怠データを更新しました。')
-        return super().form_valid(form)
+        with transaction.atomic():
+            response = super().form_valid(form)
+            # 未確認の記録の社員が変わった場合は集計先を付け替える
+            if not self.object.is_read and 'user' in form.changed_data:
+                deltas = unread_deltas([form.initial['user']], sign=-1)
+                deltas.update(unread_deltas([self.object.user_id]))
+                adjust_unread(deltas)
+            # 社員・日付が変更された場合に備えて変更前後の両方を破棄・再集計する
+            changed_keys = {
+                (form.initial.get('user'), form.initial.get('date')),
+                (self.object.user_id, self.object.date),
+            }
+            records_changed(changed_keys)
+        invalidate_today_many(changed_keys)
+        return response
     
     def get_success_url(self):
         return reverse('attendance:hr_attendance_detail', kwargs={'pk':self.object.pk})
@@ -164,7 +256,53 @@ class HrAttendanceDeleteView(HrOnlyMixin, DeleteView):
             return redirect('attendance:hr_attendance_list')
         return obj
 
+    def form_valid(self, form):
+        invalidate_today(self.object.user_id, self.object.date)
+        with transaction.atomic():
+            if not self.object.is_read:
+                add_unread(self.object.user, -1)
+            records_changed([(self.object.user_id, self.object.date)])
+            return super().form_valid(form)
+
     def delete(self, request, *args, **kwargs):
         record = self.get_object()
         messages.success(self.request, f'{record.user} さんの {record.date} 分の勤怠データを削除しました。')
-        return super().delete(request, *args, **kwargs)
\ No newline at end of file
+        return super().delete(request, *args, **kwargs)
+
+class HrTimesheetListView(HrOnlyMixin, ListView):
+    """全社員の月次・年間の勤怠集計"""
+    model = CustomUser
+    template_name = 'attendance/timesheet_summary.html'
+    use_read_replica = True
+    paginate_by = 20
+
+    def get_queryset(self):
+        self.year, self.month = parse_period(self.request.GET)
+        timesheets = MonthlyTimesheet.objects.filter(year=self.year)
+        if self.month:
+            timesheets = timesheets.filter(month=self.month)
+
+        queryset = CustomUser.objects.select_related('department').order_by('employee_number')
+        department_id = self.request.GET.get('department')
+        if department_id and department_id.isdigit():
+            queryset = queryset.filter(department_id=department_id)
+        return queryset.prefetch_related(
+            Prefetch('monthly_timesheets', queryset=timesheets, to_attr='period_timesheets')
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        attach_period_totals(context['object_list'], self.year, self.month)
+        context['title'] = '全社員の勤怠集計'
+        context['list_url'] = reverse('attendance:hr_timesheet_list')
+        context['year'] = self.year
+        context['month'] = self.month
+        context['month_choices'] = range(1, 13)
+        context['departments'] = Department.objects.order_by('name')
+        context['selected_department'] = self.request.GET.get('department', '')
+
+        query_params = self.request.GET.copy()
+        if 'page' in query_params:
+            del query_params['page']
+        context['current_filters_query'] = f'&{query_params.urlencode()}' if query_params else ''
+        return context
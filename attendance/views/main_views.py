@@ -3,115 +3,114 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib import messages
 from django.utils import timezone
 from django.shortcuts import redirect, render
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, JsonResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.contrib.auth import get_user_model
 from datetime import date
-from ..models import AttendanceRecord, BreakRecord
+import uuid
+from asgiref.sync import sync_to_async
+from ..models import AttendanceRecord, BreakRecord, MonthlyTimesheet
 from ..forms import AttendanceRecordForm
+from ..services import PUNCH_ACTIONS, punch
+from ..journal import buffering_enabled, enqueue_punch, overlay_pending
+from ..cache import aget_today_record, get_today_record
+from ..counters import unread_count, user_key
+from ..rollups import attach_missing_clock_outs, count_missing_clock_outs, parse_period, year_totals
+from ..calendar_feed import CalendarFeed, parse_range
+from ..archive import find_archived_record
+from ..filters import filter_attendance_sources
+from ..pagination import merge_querysets
+from accounts.models import Department, Team
+from accounts.scope import get_manager_scope
+from accounts.mixins import AsyncLoginRequiredMixin
 
 class Index(TemplateView):
     template_name = 'attendance/index.html'
 
+def dashboard_context(record):
+    """打刻画面の表示内容（同期・非同期のビューで共通）"""
+    if buffering_enabled():
+        # 未反映の打刻をジャーナルから重ねて、本人には打刻直後の状態を見せる
+        record = overlay_pending(record)
+    # 二重送信・リトライを判別するための打刻トークン
+    return {'record': record, 'punch_token': uuid.uuid4().hex}
+
+def submit_punch(request):
+    """打刻ボタンの POST を処理して結果をメッセージに積む（不正な操作の場合は None）"""
+    action = request.POST.get('action')
+    if action not in PUNCH_ACTIONS:
+        return None
+
+    apply = enqueue_punch if buffering_enabled() else punch
+    result = apply(
+        request.user,
+        action,
+        note=request.POST.get('note', ''),
+        token=request.POST.get('punch_token'),
+    )
+    messages.add_message(request, result.level, result.message)
+    return result
+
+def punch_redirect(result, to):
+    response = redirect(to)
+    if result is not None:
+        response['X-Punch-Query-Count'] = result.query_count
+    return response
+
 class AttendanceDashboardView(LoginRequiredMixin, View):
     template_name = 'attendance/attendance_dashboard.html'
 
     def get(self, request):
         """出勤・退勤・休憩打刻をすべて扱う単一ビュー"""
         today = timezone.localdate()
-        record, _ = AttendanceRecord.objects.get_or_create(user=request.user, date=today)
-        # 現在進行中の休憩（未終了のBreakRecord）
-        active_break = record.breaks.filter(end_time__isnull=True).first()
-        context = {'record': record, 'active_break':active_break}
-       
-        return render(request, self.template_name, context)
+        # 表示のみでは勤怠記録を作成しない（作成は最初の打刻時）
+        record = get_today_record(request.user, today)
+        return render(request, self.template_name, dashboard_context(record))
     
     def post(self, request):
         """出勤または退勤ボタン押下時の処理"""
-        today = timezone.localdate()
-        record, _ = AttendanceRecord.objects.get_or_create(user=request.user, date=today)
-        action = request.POST.get('action')
-        active_break = record.breaks.filter(end_time__isnull=True).first()
-        now = timezone.localtime(timezone.now())
-        note = request.POST.get('note', '')
-
-        if action == 'clock_in':
-            if record.clock_in:
-                messages.warning(request, '既に出勤済みです。')
-            else:
-                record.clock_in = now
-                record.save()
-                messages.success(request, f"出勤時刻を登録しました：{now.strftime('%H:%M')}")
-        
-        elif action == 'clock_out':
-            if not record.clock_in:
-                messages.warning(request, '出勤していません。先に出勤を記録してください。')
-            elif record.clock_out:
-                messages.warning(request, '既に退勤済みです。')
-            else:
-                record.clock_out = now
-                record.calculate_total_work_time()
-                record.save()
-                messages.success(request, f"退勤時刻を登録しました：{now.strftime('%H:%M')}")
-        
-        elif action == 'break_start':
-            if active_break:
-                messages.warning(request, '既に休憩中です。')
-            else:
-                BreakRecord.objects.create(attendance=record, start_time=now)
-                messages.success(request, f"休憩を開始しました：{now.strftime('%H:%M')}")
-        
-        elif action == 'break_end':
-            if not active_break:
-                messages.warning(request, '開始中の休憩はありません。')
-            else:
-                active_break.end_time = now
-                active_break.save()
-                record.calculate_total_work_time()
-                messages.success(request, f"休憩を終了しました：{now.strftime('%H:%M')}")
-        
-        elif action == 'update_note':
-            record.note = note
-            record.save()
-            messages.success(request, '備考を更新しました。')
-        
-        return redirect('attendance:dashboard')
+        return punch_redirect(submit_punch(request), 'attendance:dashboard')
+
+class AsyncAttendanceDashboardView(AsyncLoginRequiredMixin, View):
+    """
+    AttendanceDashboardView の非同期版。表示は非同期のキャッシュ・ORMで読む。
+    打刻はトランザクション内で行うため、同期の打刻処理をスレッドで実行する。
+    """
+    template_name = AttendanceDashboardView.template_name
+
+    async def get(self, request):
+        record = await aget_today_record(request.user, timezone.localdate())
+        return render(request, self.template_name, dashboard_context(record))
+
+    async def post(self, request):
+        result = await sync_to_async(submit_punch)(request)
+        return punch_redirect(result, 'attendance:dashboard_async')
 
 class AttendanceListView(LoginRequiredMixin, ListView):
     model = AttendanceRecord
     template_name = 'attendance/attendance_list.html'
+    use_read_replica = True
     paginate_by = 10
 
     def get_queryset(self):
-        queryset = AttendanceRecord.objects.filter(user=self.request.user)
-
         self.start_date_param = self.request.GET.get('start_date')
         self.end_date_param = self.request.GET.get('end_date')
         self.selected_read_status = self.request.GET.get('read_status', 'all')
-        # start_date 処理: 開始日以降
-        if self.start_date_param:
-            try:
-                start_date_obj = date.fromisoformat(self.start_date_param)
-                queryset = queryset.filter(date__gte=start_date_obj)
-            except ValueError:
-                pass
-        # end_date 処理: 終了日以前
-        if self.end_date_param:
-            try:
-                end_date_obj = date.fromisoformat(self.end_date_param)
-                queryset = queryset.filter(date__lte=end_date_obj)
-            except ValueError:
-                pass
-        
-        if self.selected_read_status == 'unread':
-            queryset = queryset.filter(is_read=False)
-        elif self.selected_read_status == 'read':
-            queryset = queryset.filter(is_read=True)
-        return queryset
+        # 開始日・終了日・確認状況で絞り込む（開始日が古い場合はアーカイブも含める）
+        querysets = filter_attendance_sources(
+            {'start_date': self.start_date_param, 'end_date': self.end_date_param, 'read_status': self.selected_read_status},
+            lambda source: source.filter(user=self.request.user),
+        )
+        return merge_querysets(querysets, ('-date', '-id'))
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['start_date_filter_value'] = self.start_date_param if self.start_date_param else ''
         context['end_date_filter_value'] = self.end_date_param if self.end_date_param else ''
         context['selected_read_status'] = self.selected_read_status
-        context['unread_record_count'] = self.get_queryset().filter(user=self.request.user, is_read=False).count()
+        context['unread_record_count'] = unread_count(user_key(self.request.user.pk))
 
         query_params = self.request.GET.copy()
         if 'page' in query_params:
@@ -123,6 +122,130 @@ class AttendanceListView(LoginRequiredMixin, ListView):
 class AttendanceDetailView(LoginRequiredMixin, DetailView):
     model = AttendanceRecord
     template_name = 'attendance/attendance_detail.html'
+    use_read_replica = True
 
     def get_queryset(self):
-        return AttendanceRecord.objects.select_related('user')
\ No newline at end of file
+        return AttendanceRecord.objects.select_related('user')
+
+    def get_object(self, queryset=None):
+        try:
+            return super().get_object(queryset)
+        except Http404:
+            record = find_archived_record(self.kwargs['pk'])
+            if record is None:
+                raise
+            return record
+
+class MonthlyTimesheetView(LoginRequiredMixin, TemplateView):
+    """ログインユーザーの月別・年間の勤怠集計"""
+    template_name = 'attendance/timesheet.html'
+    use_read_replica = True
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        year, _ = parse_period(self.request.GET)
+        timesheets = {
+            timesheet.month: timesheet
+            for timesheet in attach_missing_clock_outs(
+                MonthlyTimesheet.objects.filter(user=self.request.user, year=year),
+                count_missing_clock_outs([self.request.user.pk], year),
+            )
+        }
+        context['year'] = year
+        context['previous_year'] = year - 1
+        context['next_year'] = year + 1 if year < timezone.localdate().year else None
+        context['months'] = [(month, timesheets.get(month)) for month in range(1, 13)]
+        context['year_total'] = year_totals(timesheets.values())
+        return context
+
+CustomUser = get_user_model()
+
+def resolve_calendar_feed(request):
+    """
+    クエリ文字列（user / team / department と start / end）から表示対象の CalendarFeed を求める。
+    社員は本人のみ、上司は管理範囲内、人事はすべてを表示できる。
+    条件付きGETの判定と本体の両方から呼ばれるため、リクエストごとに1回だけ解決する。
+    """
+    if hasattr(request, '_calendar_feed'):
+        return request._calendar_feed
+
+    viewer = request.user
+    start, end = parse_range(request.GET.get('start'), request.GET.get('end'))
+    scope = get_manager_scope(viewer) if viewer.is_manager else None
+
+    for kind in ('team', 'department'):
+        target_id = request.GET.get(kind)
+        if not target_id:
+            continue
+        if not target_id.isdigit():
+            raise ValueError(f'{kind} が正しくありません。')
+        target_id = int(target_id)
+        user_ids = set(CustomUser.objects.filter(**{f'{kind}_id': target_id}).values_list('pk', flat=True))
+        if not viewer.is_hr:
+            # 上司は管理範囲内の社員だけを表示する（管理部署内の課なども表示できる）
+            if not scope or not user_ids & scope.user_ids:
+                raise PermissionDenied
+            user_ids &= scope.user_ids
+        request._calendar_feed = CalendarFeed(kind, target_id, user_ids, start, end)
+        return request._calendar_feed
+
+    user_id = request.GET.get('user') or str(viewer.pk)
+    if not user_id.isdigit():
+        raise ValueError('user が正しくありません。')
+    user_id = int(user_id)
+    if user_id != viewer.pk and not viewer.is_hr and not (scope and user_id in scope):
+        raise PermissionDenied
+    request._calendar_feed = CalendarFeed('user', user_id, [user_id], start, end)
+    return request._calendar_feed
+
+def _calendar_etag(request, *args, **kwargs):
+    try:
+        return resolve_calendar_feed(request).etag()
+    except ValueError:
+        return None
+
+def _calendar_last_modified(request, *args, **kwargs):
+    try:
+        return resolve_calendar_feed(request).last_modified()
+    except ValueError:
+        return None
+
+class CalendarEventsView(LoginRequiredMixin, View):
+    """
+    FullCalendar のイベントソース。
+    勤怠・申請の変更時に更新される社員ごとの更新日時から ETag / Last-Modified を返し、
+    変更がなければ 304 を返してイベントのクエリを省く。
+    """
+    use_read_replica = True
+
+    @method_decorator(condition(etag_func=_calendar_etag, last_modified_func=_calendar_last_modified))
+    def get(self, request):
+        try:
+            feed = resolve_calendar_feed(request)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        names = {}
+        if feed.kind != 'user':
+            names = dict(CustomUser.objects.filter(pk__in=feed.user_ids).values_list('pk', 'full_name'))
+        response = JsonResponse(feed.events(names), safe=False)
+        # 毎回再検証させる（変更がなければ 304 になる）
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+class CalendarView(LoginRequiredMixin, TemplateView):
+    """勤怠と承認済みの申請のカレンダー"""
+    template_name = 'attendance/calendar.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        user = self.request.user
+        if user.is_hr:
+            context['teams'] = Team.objects.select_related('department').order_by('department__name', 'name')
+            context['departments'] = Department.objects.order_by('name')
+        elif user.is_manager:
+            scope = get_manager_scope(user)
+            context['teams'] = Team.objects.filter(pk__in=scope.team_ids).select_related('department')
+            context['departments'] = Department.objects.filter(pk__in=scope.department_ids)
+            context['subordinates'] = CustomUser.objects.filter(pk__in=scope.user_ids).order_by('employee_number')
+        return context
@@ -1,11 +1,20 @@
 from django.shortcuts import redirect
-from django.views.generic import ListView, CreateView, UpdateView, DeleteView, DetailView
+from django.http import HttpResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
+from django.views.generic import ListView, CreateView, UpdateView, DeleteView, DetailView, TemplateView, View
 from django.contrib.auth import get_user_model
 from django.contrib import messages
-from accounts.mixins import ManagerOnlyMixin
+from accounts.mixins import AsyncManagerOnlyMixin, ManagerOnlyMixin
+from accounts.scope import get_manager_scope
 from django.db.models import Prefetch
-from ..models import AttendanceRecord
+from ..models import AttendanceRecord, MonthlyTimesheet
 from ..forms import AttendanceRecordForm
+from ..rollups import attach_period_totals, parse_period
+from ..services import set_read_status
+from ..archive import record_querysets
+from ..broker import sse
+from ..roster import ROSTER_POLL_RETRY_MS, roster_snapshot, roster_stream
 from django.db.models import Q
 from django.urls import reverse_lazy, reverse
 from datetime import date, timedelta
@@ -16,13 +25,14 @@ CustomUser = get_user_model()
 class ManagerAttendanceListView(ManagerOnlyMixin, ListView):
     model = CustomUser
     template_name = 'attendance/manager_attendance_list.html'
+    use_read_replica = True
     paginate_by = 10
 
     def get_default_date(self):
         return date.today()
 
     def get_queryset(self):
-        manage_departments = self.request.user.manage_departments.all()
+        scope = get_manager_scope(self.request.user)
         date_param = self.request.GET.get('date')
 
         if date_param:
@@ -37,45 +47,141 @@ class ManagerAttendanceListView(ManagerOnlyMixin, ListView):
 
         # 対象ユーザー
         queryset = CustomUser.objects.filter(
-            department__in=manage_departments,
+            pk__in=scope.user_ids,
             role='employee',
         ).order_by('employee_number')
 
-        # 対象ユーザーに限定した出勤データ
-        record_for_date = AttendanceRecord.objects.filter(
-            date=self.selected_date,
-        ).select_related('read_by')
-
-        # Prefetch
-        queryset = queryset.prefetch_related(
-            Prefetch('attendance_records', queryset=record_for_date, to_attr='record_of_the_day')
-        )
+        # 表示中の日付の出勤データ（古い日付はアーカイブから読む）
+        self.record_sources = [
+            source.filter(date=self.selected_date)
+            for source in record_querysets(self.selected_date, self.selected_date)
+        ]
 
-        # フィルタ
+        # フィルタ（記録の有無は副問い合わせで判定し、記録自体は表示するページの社員分だけ読む）
         status_param = self.request.GET.get('status')
-        if status_param == 'submitted':
-            queryset = queryset.filter(attendance_records__date=self.selected_date).distinct()
-        elif status_param == 'unsubmitted':
-            queryset = queryset.exclude(attendance_records__date=self.selected_date).distinct()
+        if status_param in ('submitted', 'unsubmitted'):
+            submitted = Q()
+            for source in self.record_sources:
+                submitted |= Q(pk__in=source.values('user_id'))
+            queryset = queryset.filter(submitted) if status_param == 'submitted' else queryset.exclude(submitted)
 
         return queryset
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        users = list(context['object_list'])
+        records_by_user = {
+            record.user_id: record
+            for source in self.record_sources
+            for record in source.filter(user_id__in=[user.pk for user in users]).select_related('read_by')
+        }
+        for user in users:
+            record = records_by_user.get(user.pk)
+            user.record_of_the_day = [record] if record else []
         context['selected_date'] = self.selected_date
         context['date_filter_value'] = self.selected_date.isoformat()
         context['selected_status'] = self.request.GET.get('status', 'all')
         
-        unread_record_count = AttendanceRecord.objects.filter(
-            user__department__in=self.request.user.manage_departments.all(),
+        # 一覧と同じ部下（管理部署の社員と、他部署に所属する管理課の社員）の未確認件数。
+        # 1日分の未確認の記録だけを持つ部分インデックスを日付で引いて数える
+        context['unread_record_count'] = AttendanceRecord.objects.filter(
             date=self.selected_date,
             is_read=False,
+            user_id__in=get_manager_scope(self.request.user).user_ids,
+            user__role='employee',
         ).count()
-        context['unread_record_count'] = unread_record_count
 
         query_params = self.request.GET.copy()
         if 'page' in query_params:
             del query_params['page']
         context['current_filters_query'] = f'&{query_params.urlencode()}' if query_params else ''
+        context['filters_query'] = query_params.urlencode()
+
+        return context
+
+class ManagerAttendanceBulkReadView(ManagerOnlyMixin, View):
+    """表示中の日付の部下の記録を、選択分またはすべてまとめて確認・確認取消する"""
+
+    def post(self, request, *args, **kwargs):
+        try:
+            selected_date = date.fromisoformat(request.POST.get('date', ''))
+        except ValueError:
+            selected_date = date.today()
+        list_url = f"{reverse('attendance:manager_attendance_list')}?{request.POST.get('filters', '')}"
+        read = request.POST.get('action') != 'unmark_read'
+
+        # 部下の社員の、表示中の日付の記録に限定する
+        queryset = AttendanceRecord.objects.filter(
+            user_id__in=get_manager_scope(request.user).user_ids,
+            user__role='employee',
+            date=selected_date,
+        )
+        if request.POST.get('scope') != 'all':
+            record_ids = [pk for pk in request.POST.getlist('record_ids') if pk.isdigit()]
+            if not record_ids:
+                messages.warning(request, '勤怠記録が選択されていません。')
+                return redirect(list_url)
+            queryset = queryset.filter(pk__in=record_ids)
+
+        updated = set_read_status(queryset, request.user, read=read)
+        messages.success(request, f"{updated} 件の勤怠記録を{'確認済' if read else '未確認'}にしました。")
+        return redirect(list_url)
+
+class ManagerTimesheetListView(ManagerOnlyMixin, ListView):
+    """部下の月次・年間の勤怠集計"""
+    model = CustomUser
+    template_name = 'attendance/timesheet_summary.html'
+    use_read_replica = True
+    paginate_by = 10
+
+    def get_queryset(self):
+        self.year, self.month = parse_period(self.request.GET)
+        timesheets = MonthlyTimesheet.objects.filter(year=self.year)
+        if self.month:
+            timesheets = timesheets.filter(month=self.month)
+
+        return CustomUser.objects.filter(
+            pk__in=get_manager_scope(self.request.user).user_ids,
+            role='employee',
+        ).order_by('employee_number').prefetch_related(
+            Prefetch('monthly_timesheets', queryset=timesheets, to_attr='period_timesheets')
+        )
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        attach_period_totals(context['object_list'], self.year, self.month)
+        context['title'] = '部下の勤怠集計'
+        context['list_url'] = reverse('attendance:manager_timesheet_list')
+        context['year'] = self.year
+        context['month'] = self.month
+        context['month_choices'] = range(1, 13)
+
+        query_params = self.request.GET.copy()
+        if 'page' in query_params:
+            del query_params['page']
+        context['current_filters_query'] = f'&{query_params.urlencode()}' if query_params else ''
+        return context
 
-        return context
\ No newline at end of file
+class ManagerRosterView(ManagerOnlyMixin, TemplateView):
+    """部下の本日の出勤状況。表は ManagerRosterStreamView の SSE で更新する"""
+    template_name = 'attendance/manager_roster.html'
+
+class ManagerRosterStreamView(AsyncManagerOnlyMixin, View):
+    """
+    部下の本日の出勤状況を Server-Sent Events で送る。
+    最初にスナップショットを送り、以降は打刻のたびに打刻の処理から配られたイベントだけを送る。
+    """
+
+    async def get(self, request, *args, **kwargs):
+        scope = await sync_to_async(get_manager_scope)(request.user)
+        today = timezone.localdate()
+        if not isinstance(request, ASGIRequest):
+            # WSGI ではワーカーを占有し続けないよう、スナップショットを返して一定間隔で再接続させる
+            snapshot = await roster_snapshot(scope.user_ids, today)
+            response = HttpResponse(sse('snapshot', snapshot, retry=ROSTER_POLL_RETRY_MS), content_type='text/event-stream')
+        else:
+            response = StreamingHttpResponse(roster_stream(scope.user_ids, today), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # リバースプロキシでバッファリングさせない
+        response['X-Accel-Buffering'] = 'no'
+        return response
@@ -0,0 +1,30 @@
+import os
+import tempfile
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+
+
+class SharedFileBasedCache(FileBasedCache):
+    """
+    同じホストのすべてのワーカープロセスで共有するファイルキャッシュ。
+    FileBasedCache の add は存在確認と書き込みが別々のため、同時に呼ばれると両方が成功する。
+    打刻トークンの確保に使うため、一時ファイルを書いてから os.link で置き、先に置けたプロセスだけを成功させる。
+    """
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        # 期限切れのファイルは has_key が削除する
+        if self.has_key(key, version):
+            return False
+        self._createdir()
+        fname = self._key_to_file(key, version)
+        self._cull()
+        fd, tmp_path = tempfile.mkstemp(dir=self._dir)
+        try:
+            with open(fd, 'wb') as f:
+                self._write_content(f, timeout, value)
+            os.link(tmp_path, fname)
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(tmp_path)
+        return True
@@ -0,0 +1,113 @@
+import random
+import time
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.signals import request_finished
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# リクエストごとの振り分け状態（リクエスト外の処理・管理コマンドでは None = 常にプライマリ）
+_request_state = ContextVar('replica_request_state', default=None)
+# レプリカの遅延があると認証できなくなるため、常にプライマリから読むアプリ
+PRIMARY_ONLY_APPS = {'sessions'}
+
+
+def replica_settings():
+    return {'REPLICAS': [], 'PIN_SECONDS': 5, 'PIN_COOKIE': 'db_pin', **getattr(settings, 'READ_REPLICA', {})}
+
+
+def replica_aliases():
+    """設定済みのレプリカの別名（DATABASES にないものは無視する）"""
+    return [alias for alias in replica_settings()['REPLICAS'] if alias in settings.DATABASES]
+
+
+class RequestState:
+    def __init__(self, pinned=False):
+        # 直前に書き込んだ利用者はプライマリに固定する（自分の書き込みを確実に読めるように）
+        self.pinned = pinned
+        self.use_replica = False
+        self.wrote = False
+        self.alias = None
+
+    def read_alias(self):
+        if not self.use_replica or self.pinned or self.wrote:
+            return None
+        if self.alias is None:
+            # 1リクエストの中では同じレプリカから読む
+            replicas = replica_aliases()
+            self.alias = random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+        return self.alias
+
+
+class ReplicaRouter:
+    """
+    use_read_replica = True のビューの GET / HEAD の読み取りだけをレプリカへ振り分ける。
+    書き込みはすべてプライマリ。リクエスト内で書き込んだ後、トランザクション中の読み取りもプライマリから行う。
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _request_state.get()
+        if state is None or model._meta.app_label in PRIMARY_ONLY_APPS:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return state.read_alias() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # レプリカはプライマリの複製なので、どちらから読んだオブジェクトも関連付けてよい
+        aliases = {DEFAULT_DB_ALIAS, *replica_aliases()}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # レプリカのスキーマはプライマリから複製する
+        if db in replica_aliases():
+            return False
+        return None
+
+
+class ReplicaMiddleware:
+    """
+    リクエストの振り分け状態を用意し、ビューが use_read_replica を持つ場合にレプリカからの読み取りを許可する。
+    書き込みのあったリクエストの応答では、PIN_SECONDS 秒間プライマリに固定する Cookie を付ける。
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        options = replica_settings()
+        try:
+            pinned_until = float(request.COOKIES.get(options['PIN_COOKIE'], 0))
+        except ValueError:
+            pinned_until = 0
+        state = RequestState(pinned=pinned_until > time.time())
+        _request_state.set(state)
+
+        response = self.get_response(request)
+        if state.wrote and replica_aliases():
+            response.set_cookie(
+                options['PIN_COOKIE'], str(time.time() + options['PIN_SECONDS']),
+                max_age=options['PIN_SECONDS'], httponly=True, samesite='Lax',
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _request_state.get()
+        view_class = getattr(view_func, 'view_class', None)
+        if state is not None and request.method in ('GET', 'HEAD') and getattr(view_class, 'use_read_replica', False):
+            state.use_replica = True
+
+
+def _reset_request_state(**kwargs):
+    # ストリーミング応答は返却後も読み取りを続けるため、応答を閉じたときに状態を破棄する
+    _request_state.set(None)
+
+
+request_finished.connect(_reset_request_state)
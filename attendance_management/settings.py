@@ -47,6 +47,8 @@ AUTH_USER_MODEL = 'accounts.CustomUser'
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # セッション保存などの書き込みも検知できるよう、セッションより外側に置く
+    'attendance_management.db_router.ReplicaMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -83,9 +85,98 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # 打刻は読み取り後に書き込むため、開始時点で書き込みロックを取得して
+            # 「database is locked」でのトランザクション失敗を防ぐ
+            'transaction_mode': 'IMMEDIATE',
+        },
+    }
+}
+
+# 参照用レプリカ。REPLICAS に DATABASES の別名を並べると、一覧・詳細・集計の画面
+# （use_read_replica = True のビュー）の GET の読み取りをレプリカへ振り分ける。
+# 書き込みをした利用者は PIN_SECONDS 秒間プライマリから読む（自分の書き込みがすぐ見えるように）
+READ_REPLICA = {
+    'REPLICAS': [],
+    'PIN_SECONDS': 5,
+    'PIN_COOKIE': 'db_pin',
+}
+# ローカルで確認する場合は2つ目のSQLiteファイルを用意し、sync_sqlite_replica コマンドで複製する
+# DATABASES['replica'] = {
+#     'ENGINE': 'django.db.backends.sqlite3',
+#     'NAME': BASE_DIR / 'db_replica.sqlite3',
+#     'TEST': {'MIRROR': 'default'},
+# }
+# READ_REPLICA['REPLICAS'] = ['replica']
+DATABASE_ROUTERS = ['attendance_management.db_router.ReplicaRouter']
+
+# キャッシュ（打刻トークンの重複排除、打刻画面・一覧の未確認件数などの表示用）
+# 打刻などで破棄したキャッシュが他のワーカーに残らないよう、全ワーカープロセスで共有するキャッシュが必須。
+# 既定は同じホストのプロセス間で共有するファイルキャッシュ。複数ホストで動かす場合は
+# django.core.cache.backends.redis.RedisCache などホスト間で共有するキャッシュにすること
+# （LocMemCache はプロセスごとのため使えない。manage.py check --deploy で警告する）
+CACHES = {
+    'default': {
+        'BACKEND': 'attendance_management.cache_backends.SharedFileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
     }
 }
 
+# 打刻の書き込み遅延（朝夕の打刻集中時にSQLiteの書き込みロック競合を避ける）
+# ENABLED にすると打刻はジャーナルへの追記で受付し、flush_punch_journal コマンドが
+# FLUSH_INTERVAL 秒ごとにまとめてDBへ反映する。反映済みセグメントの記録は SEGMENT_HISTORY_SECONDS 秒後に削除する
+PUNCH_BUFFER = {
+    'ENABLED': False,
+    'JOURNAL_DIR': BASE_DIR / 'punch_journal',
+    'FLUSH_INTERVAL': 2,
+    'BATCH_SIZE': 500,
+    'SEGMENT_HISTORY_SECONDS': 60 * 60,
+}
+
+# 通知の送信待ち（承認などのリクエストでは送信待ちに1行追加するだけにする）
+# ENABLED にすると drain_notification_outbox コマンドが DRAIN_INTERVAL 秒ごとに
+# BATCH_SIZE 行ずつまとめて通知を作成する
+NOTIFICATION_OUTBOX = {
+    'ENABLED': False,
+    'DRAIN_INTERVAL': 2,
+    'BATCH_SIZE': 500,
+}
+
+# 通知の保存期間（purge_notifications コマンドで削除する。None でその条件を使わない）
+# READ_DAYS 日より前の既読の通知と、1人あたり新しい順に MAX_PER_USER 件を超えた通知を削除する
+NOTIFICATION_RETENTION = {
+    'READ_DAYS': 90,
+    'MAX_PER_USER': 1000,
+}
+
+# まとめた通知のメールダイジェスト（send_notification_digest コマンドで送る）
+# メールは EMAIL_BACKEND で送信する（開発時は django.core.mail.backends.console.EmailBackend など）
+NOTIFICATION_DIGEST = {
+    'BASE_URL': 'http://localhost:8000',
+    'SUBJECT': '【勤怠管理】未読の通知があります',
+    'BATCH_SIZE': 100,
+}
+
+# 新しい通知のプッシュ（ASGI で動かす場合に通知バッジへ即時に届ける）
+# 既定はプロセス内で配る。複数ワーカーで動かす場合は run_push_relay コマンドを起動し、
+# BACKEND を 'notifications.push.RelayBroker'、OPTIONS を {'address': '127.0.0.1:8765'} にする
+NOTIFICATION_PUSH = {
+    'BACKEND': 'attendance.broker.Broker',
+    'OPTIONS': {},
+}
+
+# ICカード打刻端末の認証トークン（Authorization: Bearer <token>）
+ATTENDANCE_KIOSK_TOKENS = []
+# 打刻APIで一度に受け付ける打刻の上限
+ATTENDANCE_PUNCH_BATCH_LIMIT = 5000
+
+# 遅刻・早退の判定に使う始業・終業時刻（月次集計用）
+ATTENDANCE_WORK_START = '09:00'
+ATTENDANCE_WORK_END = '18:00'
+
+# この日数より古い確認済の勤怠記録を年ごとのアーカイブテーブルへ移す
+ATTENDANCE_ARCHIVE_HORIZON_DAYS = 365
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -1,12 +1,13 @@
-from .models import Notification
+from .counters import unread_notification_count
 
 def unread_notification_context(request):
+    # 非同期ビューは描画前に件数を求めて request に設定している
+    unread_count = getattr(request, 'unread_notification_count', None)
+    if unread_count is not None:
+        return {'unread_notification_count': unread_count}
     unread_count = 0
 
     if request.user.is_authenticated:
-        unread_count = Notification.objects.filter(
-            recipient=request.user,
-            is_read=False,
-        ).count()
+        unread_count = unread_notification_count(request.user.pk)
 
     return {'unread_notification_count': unread_count}
\ No newline at end of file
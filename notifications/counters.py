@@ -0,0 +1,42 @@
+from collections import Counter
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from .models import UnreadNotificationCounter
+from .push import publish_unread_later
+
+
+def unread_deltas(queryset, sign=-1):
+    """queryset に含まれる未読の通知を、受信者ごとの増減にする（既読化・削除の前に数える）"""
+    return Counter({
+        row['recipient_id']: sign * row['count']
+        for row in queryset.filter(is_read=False).order_by().values('recipient_id').annotate(count=Count('id'))
+    })
+
+
+def adjust_unread_notifications(deltas):
+    """受信者ごとの未読件数の増減を、呼び出し元と同じトランザクションで反映する"""
+    changed = []
+    for user_id, delta in deltas.items():
+        if not delta:
+            continue
+        changed.append(user_id)
+        if UnreadNotificationCounter.objects.filter(user_id=user_id).update(count=F('count') + delta):
+            continue
+        try:
+            with transaction.atomic():
+                UnreadNotificationCounter.objects.create(user_id=user_id, count=delta)
+        except IntegrityError:
+            UnreadNotificationCounter.objects.filter(user_id=user_id).update(count=F('count') + delta)
+    publish_unread_later(changed)
+
+
+def unread_notification_count(user_id):
+    """
+    未読件数。集計行を主キーで1行読む（行がない受信者は0件）。
+    キャッシュに置くと、コミット前に読んだ古い件数が破棄の後に書き戻されることがあるため、常に集計行から読む。
+    """
+    return UnreadNotificationCounter.objects.filter(user_id=user_id).values_list('count', flat=True).first() or 0
+
+
+async def aunread_notification_count(user_id):
+    return await UnreadNotificationCounter.objects.filter(user_id=user_id).values_list('count', flat=True).afirst() or 0
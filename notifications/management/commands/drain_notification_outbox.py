@@ -0,0 +1,39 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError
+from notifications.outbox import drain_outbox, get_outbox_settings
+
+
+class Command(BaseCommand):
+    help = (
+        '送信待ちの通知を古い順にまとめて通知へ反映します。'
+        'NOTIFICATION_OUTBOX の ENABLED を有効にした環境で常駐させてください。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='送信待ちがなくなるまで反映して終了する')
+        parser.add_argument('--interval', type=float, help='反映間隔（秒）。省略時は NOTIFICATION_OUTBOX の DRAIN_INTERVAL')
+        parser.add_argument('--batch-size', type=int, help='1トランザクションで反映する送信待ちの行数')
+
+    def handle(self, *args, **options):
+        outbox_settings = get_outbox_settings()
+        interval = options['interval'] or outbox_settings['DRAIN_INTERVAL']
+        batch_size = options['batch_size'] or outbox_settings['BATCH_SIZE']
+
+        while True:
+            total = 0
+            try:
+                # 溜まっている間は待たずに続けて反映する（通知が0件でも行を取り出せた間は続ける）
+                while True:
+                    claimed, delivered = drain_outbox(batch_size)
+                    if not claimed:
+                        break
+                    total += delivered
+            except DatabaseError as e:
+                # 反映できなかった送信待ちは残るため、次回の反映で再試行される
+                self.stderr.write(f'通知の反映に失敗しました: {e}')
+            if total:
+                self.stdout.write(f'{total} 件の通知を反映しました。')
+            if options['once']:
+                break
+            time.sleep(interval)
@@ -0,0 +1,127 @@
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.utils import timezone
+from notifications.models import Notification
+from notifications.utils import INBOX_ORDERING, delete_notifications, read_status
+
+CustomUser = get_user_model()
+
+DEFAULT_NOTIFICATION_RETENTION = {
+    'READ_DAYS': 90,
+    'MAX_PER_USER': 1000,
+}
+# 期限切れの通知を探すときに、1クエリでまとめて読む受信者の数
+RECIPIENT_CHUNK_SIZE = 500
+# 削除で空いたページがこの割合を超えたら VACUUM でファイルを詰める（SQLite のみ）
+VACUUM_FREE_RATIO = 0.25
+
+
+def get_retention_settings():
+    return {**DEFAULT_NOTIFICATION_RETENTION, **getattr(settings, 'NOTIFICATION_RETENTION', {})}
+
+
+class Command(BaseCommand):
+    help = (
+        '保存期間を過ぎた既読の通知と、1人あたりの上限を超えた古い通知をチャンク単位で削除します。'
+        '削除後に統計情報を更新し、SQLite で空き領域が多い場合は VACUUM します。定期実行してください。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--read-days', type=int, help='この日数より前の既読の通知を削除する（省略時は NOTIFICATION_RETENTION の READ_DAYS）')
+        parser.add_argument('--max-per-user', type=int, help='1人あたりに残す通知の件数（省略時は NOTIFICATION_RETENTION の MAX_PER_USER）')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='1トランザクションで削除する通知の件数')
+        parser.add_argument('--dry-run', action='store_true', help='削除せずに対象件数だけを表示する')
+        parser.add_argument('--vacuum', action='store_true', help='空き領域の割合によらず VACUUM する（SQLite のみ）')
+
+    def handle(self, *args, **options):
+        retention = get_retention_settings()
+        read_days = options['read_days'] if options['read_days'] is not None else retention['READ_DAYS']
+        max_per_user = options['max_per_user'] if options['max_per_user'] is not None else retention['MAX_PER_USER']
+        if read_days is not None and read_days < 0:
+            raise CommandError('--read-days は 0 以上で指定してください。')
+        if max_per_user is not None and max_per_user < 0:
+            raise CommandError('--max-per-user は 0 以上で指定してください。')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size は 1 以上で指定してください。')
+        self.chunk_size = options['chunk_size']
+        self.dry_run = options['dry_run']
+
+        expired = 0
+        if read_days is not None:
+            cutoff = timezone.now() - timedelta(days=read_days)
+            expired = self.purge_expired(cutoff)
+            self.stdout.write(f'{read_days} 日より前の既読の通知: {expired} 件')
+
+        capped = 0
+        if max_per_user is not None:
+            capped = self.purge_over_cap(max_per_user)
+            self.stdout.write(f'1人 {max_per_user} 件を超えた古い通知: {capped} 件')
+
+        if self.dry_run:
+            self.stdout.write(self.style.SUCCESS(f'{expired + capped} 件が対象です（削除していません）。'))
+            return
+
+        if expired + capped or options['vacuum']:
+            self.compact(force_vacuum=options['vacuum'])
+        self.stdout.write(self.style.SUCCESS(f'通知 {expired + capped} 件を削除しました。'))
+
+    def delete_chunks(self, pks):
+        """
+        pks を chunk_size 件ずつ別々のトランザクションで削除し、書き込みロックを短く保つ。
+        削除する未読の通知は、チャンクごとに受信者別の1回の集計で数えて未読件数から引く。
+        """
+        deleted = 0
+        for start in range(0, len(pks), self.chunk_size):
+            deleted += delete_notifications(Notification.objects.filter(pk__in=pks[start:start + self.chunk_size]))
+        return deleted
+
+    def purge_expired(self, cutoff):
+        # 受信者をまとめて、(受信者, 既読, 作成日時) のインデックスを受信者ごとの範囲で読む（通知テーブルを全件走査しない）
+        recipient_ids = list(CustomUser.objects.order_by('pk').values_list('pk', flat=True))
+        pks = []
+        for start in range(0, len(recipient_ids), RECIPIENT_CHUNK_SIZE):
+            pks.extend(
+                Notification.objects.filter(
+                    read_status(True),
+                    recipient_id__in=recipient_ids[start:start + RECIPIENT_CHUNK_SIZE],
+                    created_at__lt=cutoff,
+                ).values_list('pk', flat=True)
+            )
+        return len(pks) if self.dry_run else self.delete_chunks(pks)
+
+    def purge_over_cap(self, max_per_user):
+        over = Notification.objects.order_by().values('recipient_id').annotate(count=Count('id')).filter(
+            count__gt=max_per_user,
+        ).values_list('recipient_id', 'count')
+        if self.dry_run:
+            # 期限切れとして削除される分と重なる場合がある
+            return sum(count - max_per_user for _, count in over)
+        # 新しい順に max_per_user 件を残し、それより古いものを削除する（未読の分は未読件数からも引く）
+        pks = []
+        for recipient_id, _ in over:
+            pks.extend(
+                Notification.objects.filter(recipient_id=recipient_id).order_by(*INBOX_ORDERING).values_list(
+                    'pk', flat=True,
+                )[max_per_user:]
+            )
+        # 受信者をまたいでチャンクに分け、未読件数の増減はチャンクごとに1回の集計でまとめて反映する
+        return self.delete_chunks(pks)
+
+    def compact(self, force_vacuum=False):
+        if connection.vendor != 'sqlite':
+            # 他のデータベースは自動の VACUUM / 統計更新に任せる
+            return
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA page_count')
+            page_count = cursor.fetchone()[0]
+            cursor.execute('PRAGMA freelist_count')
+            free_count = cursor.fetchone()[0]
+            cursor.execute(f'ANALYZE "{Notification._meta.db_table}"')
+            if force_vacuum or (page_count and free_count / page_count > VACUUM_FREE_RATIO):
+                # VACUUM はデータベース全体を書き直すため、空き領域が多い場合だけ実行する
+                cursor.execute('VACUUM')
+                self.stdout.write(f'VACUUM を実行しました（空きページ {free_count} / {page_count}）。')
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+from notifications.push import publish_unread_later
+from notifications.models import Notification, UnreadNotificationCounter
+
+
+class Command(BaseCommand):
+    help = (
+        '受信者ごとの未読通知を集計し直して未読件数と比較します。'
+        '管理画面からの削除や一括更新などで生じたずれを検出し、--fix で修正します。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help='ずれがあった受信者の未読件数を実際の件数で上書きする')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='一度に読み込む集計行の件数')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            rows = Notification.objects.filter(is_read=False).order_by().values_list(
+                'recipient_id',
+            ).annotate(count=Count('id')).iterator(chunk_size=options['chunk_size'])
+            actual = dict(rows)
+            stored = dict(UnreadNotificationCounter.objects.values_list('user_id', 'count'))
+
+            drift = {
+                user_id: (stored.get(user_id, 0), actual.get(user_id, 0))
+                for user_id in set(actual) | set(stored)
+                if stored.get(user_id, 0) != actual.get(user_id, 0)
+            }
+            for user_id, (stored_count, actual_count) in sorted(drift.items()):
+                self.stdout.write(f'社員ID {user_id}: 集計値 {stored_count} / 実件数 {actual_count}')
+
+            if drift and options['fix']:
+                UnreadNotificationCounter.objects.filter(user_id__in=drift).delete()
+                UnreadNotificationCounter.objects.bulk_create([
+                    UnreadNotificationCounter(user_id=user_id, count=actual_count)
+                    for user_id, (_, actual_count) in drift.items()
+                    if actual_count
+                ])
+                publish_unread_later(drift)
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('未読件数にずれはありません。'))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f'{len(drift)} 人の未読件数を修正しました。'))
+        else:
+            raise CommandError(f'{len(drift)} 人の未読件数にずれがあります。--fix で修正できます。')
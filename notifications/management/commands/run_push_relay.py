@@ -0,0 +1,49 @@
+import asyncio
+from django.core.management.base import BaseCommand
+from notifications.push import parse_address
+
+# 読み出しが追いつかない接続に溜めるデータの上限（超えた接続は切断し、再接続時に取り直させる）
+RELAY_CLIENT_BUFFER_LIMIT = 4 * 1024 * 1024
+
+
+class Command(BaseCommand):
+    help = (
+        '複数のワーカープロセス間で通知のプッシュを中継します。受け取ったイベントの行を、接続中のすべてのプロセスへ配り直します。'
+        'NOTIFICATION_PUSH の BACKEND を notifications.push.RelayBroker にした環境で1つだけ常駐させてください。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--address', default='127.0.0.1:8765', help='待ち受けるアドレス（ホスト:ポート）')
+
+    def handle(self, *args, **options):
+        host, port = parse_address(options['address'])
+        try:
+            asyncio.run(self.serve(host, port))
+        except KeyboardInterrupt:
+            pass
+
+    async def serve(self, host, port):
+        clients = set()
+
+        async def relay(reader, writer):
+            clients.add(writer)
+            try:
+                while line := await reader.readline():
+                    if not line.endswith(b'\n'):
+                        break
+                    for client in list(clients):
+                        if client.transport.get_write_buffer_size() > RELAY_CLIENT_BUFFER_LIMIT:
+                            clients.discard(client)
+                            client.close()
+                            continue
+                        client.write(line)
+            except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+                pass
+            finally:
+                clients.discard(writer)
+                writer.close()
+
+        server = await asyncio.start_server(relay, host, port)
+        self.stdout.write(self.style.SUCCESS(f'{host}:{port} で通知のプッシュを中継しています。'))
+        async with server:
+            await server.serve_forever()
@@ -0,0 +1,74 @@
+from itertools import groupby
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Q
+from django.utils import timezone
+from notifications.models import Notification
+from notifications.utils import read_status
+
+DEFAULT_NOTIFICATION_DIGEST = {
+    'BASE_URL': 'http://localhost:8000',
+    'SUBJECT': '【勤怠管理】未読の通知があります',
+    'BATCH_SIZE': 100,
+}
+
+
+def get_digest_settings():
+    return {**DEFAULT_NOTIFICATION_DIGEST, **getattr(settings, 'NOTIFICATION_DIGEST', {})}
+
+
+class Command(BaseCommand):
+    help = (
+        'まとめた通知（種別つきの通知）のうち、前回のダイジェスト以降に作成・更新された未読の通知を、'
+        '受信者ごとに1通のメールにして EMAIL_BACKEND でまとめて送信します。定期実行してください。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='1回の接続で送信するメールの件数（省略時は NOTIFICATION_DIGEST の BATCH_SIZE）')
+        parser.add_argument('--dry-run', action='store_true', help='送信せずに宛先ごとの件数だけを表示する')
+
+    def handle(self, *args, **options):
+        digest = get_digest_settings()
+        batch_size = options['batch_size'] or digest['BATCH_SIZE']
+        if batch_size < 1:
+            raise CommandError('--batch-size は 1 以上で指定してください。')
+
+        started_at = timezone.now()
+        pending = Notification.objects.filter(read_status(False)).exclude(kind='').filter(
+            Q(digest_sent_at__isnull=True) | Q(digest_sent_at__lt=F('created_at')),
+            recipient__is_active=True,
+        ).exclude(recipient__email='').select_related('recipient').order_by('recipient_id', '-created_at')
+
+        batch = []
+        sent = 0
+        with get_connection() as connection:
+            for recipient, notifications in groupby(pending.iterator(chunk_size=1000), key=lambda n: n.recipient):
+                notifications = list(notifications)
+                if options['dry_run']:
+                    self.stdout.write(f'{recipient.email}: {len(notifications)} 件')
+                    continue
+                lines = [f'・{n.message}\n  {digest["BASE_URL"]}{n.link or ""}' for n in notifications]
+                message = EmailMessage(
+                    subject=digest['SUBJECT'],
+                    body=f'{recipient.full_name or recipient.username} さん\n\n' + '\n'.join(lines) + '\n',
+                    to=[recipient.email],
+                    connection=connection,
+                )
+                batch.append((message, [n.pk for n in notifications]))
+                if len(batch) >= batch_size:
+                    sent += self.send_batch(connection, batch, started_at)
+                    batch = []
+            if batch:
+                sent += self.send_batch(connection, batch, started_at)
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS('送信していません。'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'{sent} 通のダイジェストを送信しました。'))
+
+    def send_batch(self, connection, batch, started_at):
+        sent = connection.send_messages([message for message, _ in batch])
+        # 送信した分だけ記録する（集計開始後にまとめられた通知は次回も送る）
+        Notification.objects.filter(pk__in=[pk for _, pks in batch for pk in pks]).update(digest_sent_at=started_at)
+        return sent
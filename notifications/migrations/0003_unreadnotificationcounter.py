@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_counters(apps, schema_editor):
+    # 既存の未読通知から件数を作る
+    Notification = apps.get_model('notifications', 'Notification')
+    UnreadNotificationCounter = apps.get_model('notifications', 'UnreadNotificationCounter')
+    UnreadNotificationCounter.objects.bulk_create([
+        UnreadNotificationCounter(user_id=row['recipient_id'], count=row['count'])
+        for row in Notification.objects.filter(is_read=False).values('recipient_id').annotate(count=Count('id'))
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_usersearchgram'),
+        ('notifications', '0002_list_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UnreadNotificationCounter',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='unread_notification_counter', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='受信者')),
+                ('count', models.IntegerField(default=0, verbose_name='未読件数')),
+            ],
+            options={
+                'verbose_name': '未読通知件数',
+                'verbose_name_plural': '未読通知件数',
+            },
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
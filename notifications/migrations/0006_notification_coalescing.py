@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:03
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0005_notification_inbox_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='count',
+            field=models.PositiveIntegerField(default=1, verbose_name='件数'),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='digest_sent_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='ダイジェスト送信日時'),
+        ),
+        migrations.AddField(
+            model_name='notification',
+            name='kind',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='種別'),
+        ),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_read', False), models.Q(('kind', ''), _negated=True)), fields=('recipient', 'kind'), name='notification_unread_kind_uniq'),
+        ),
+    ]
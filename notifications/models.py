@@ -18,6 +18,64 @@ class Notification(models.Model):
     message = models.CharField(max_length=255, verbose_name='メッセージ')
     is_read = models.BooleanField(default=False, verbose_name='既読')
     created_at =models.DateTimeField(auto_now_add=True, verbose_name='作成日')
+    # 種別を指定した通知は、受信者ごとに未読の1行へまとめる（件数と最新の詳細画面を更新する）
+    kind = models.CharField(max_length=100, blank=True, default='', verbose_name='種別')
+    count = models.PositiveIntegerField(default=1, verbose_name='件数')
+    digest_sent_at = models.DateTimeField(blank=True, null=True, verbose_name='ダイジェスト送信日時')
+
+    class Meta:
+        indexes = [
+            # 通知一覧（未読・既読それぞれを新しい順に読む）と、受信者ごとの未読件数の集計用
+            models.Index(fields=['recipient', 'is_read', 'created_at'], name='notification_inbox_idx'),
+        ]
+        constraints = [
+            # まとめる通知は、受信者・種別ごとに未読の行を1つだけにする
+            models.UniqueConstraint(
+                fields=['recipient', 'kind'],
+                condition=models.Q(is_read=False) & ~models.Q(kind=''),
+                name='notification_unread_kind_uniq',
+            ),
+        ]
 
     def __str__(self):
         return f'{self.recipient} - {self.message[:20]}'
+
+
+class UnreadNotificationCounter(models.Model):
+    """受信者ごとの未読通知の件数（通知の作成・既読・削除時に同じトランザクションで増減する）"""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='unread_notification_counter',
+        verbose_name='受信者',
+    )
+    count = models.IntegerField(default=0, verbose_name='未読件数')
+
+    class Meta:
+        verbose_name = '未読通知件数'
+        verbose_name_plural = '未読通知件数'
+
+    def __str__(self):
+        return f'{self.user_id}: {self.count}'
+
+
+class NotificationOutbox(models.Model):
+    """配信待ちの通知。リクエストはこの1行を追加するだけで、drain_notification_outbox が通知へ展開する"""
+    sender = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='送信者',
+    )
+    # [[受信者ID, メッセージ], ...]
+    recipient_messages = models.JSONField(verbose_name='受信者とメッセージ')
+    link = models.URLField(blank=True, null=True, verbose_name='詳細画面')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='登録日時')
+
+    class Meta:
+        verbose_name = '通知送信待ち'
+        verbose_name_plural = '通知送信待ち'
+
+    def __str__(self):
+        return f'{self.sender_id} → {len(self.recipient_messages)} 件'
@@ -0,0 +1,69 @@
+import logging
+from collections import Counter
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from .counters import adjust_unread_notifications
+from .models import Notification, NotificationOutbox
+from .push import publish_notifications_later
+
+logger = logging.getLogger(__name__)
+
+CustomUser = get_user_model()
+
+DEFAULT_NOTIFICATION_OUTBOX = {
+    'ENABLED': False,
+    'DRAIN_INTERVAL': 2,
+    'BATCH_SIZE': 500,
+}
+
+
+def get_outbox_settings():
+    return {**DEFAULT_NOTIFICATION_OUTBOX, **getattr(settings, 'NOTIFICATION_OUTBOX', {})}
+
+
+def outbox_enabled():
+    return get_outbox_settings()['ENABLED']
+
+
+def enqueue_notifications(sender, recipient_messages, link):
+    """受信者IDとメッセージの組を、呼び出し元のトランザクションで送信待ちに1行追加する"""
+    if recipient_messages:
+        NotificationOutbox.objects.create(
+            sender=sender,
+            recipient_messages=[[recipient_id, message] for recipient_id, message in recipient_messages.items()],
+            link=link,
+        )
+
+
+def drain_outbox(batch_size=None):
+    """
+    送信待ちを古い順に最大 batch_size 行取り出し、通知の INSERT 1文と未読件数の更新にまとめて反映する。
+    取り出し・反映・削除は1トランザクションで行うため、途中で失敗した行は次回に再試行される。
+    (取り出した送信待ちの行数, 反映した通知の件数) を返す。受信者がすべて削除済みの行だけなら通知は0件になるため、
+    送信待ちが残っているかは行数で判断すること。
+    """
+    batch_size = batch_size or get_outbox_settings()['BATCH_SIZE']
+    with transaction.atomic():
+        events = list(
+            NotificationOutbox.objects.select_for_update(skip_locked=True).order_by('pk')[:batch_size]
+        )
+        if not events:
+            return 0, 0
+
+        # 登録後に退職などで削除された受信者の分は捨てる（残すと同じバッチが失敗し続ける）
+        recipient_ids = {recipient_id for event in events for recipient_id, _ in event.recipient_messages}
+        existing = set(CustomUser.objects.filter(pk__in=recipient_ids).values_list('pk', flat=True))
+        notifications = [
+            Notification(sender_id=event.sender_id, recipient_id=recipient_id, message=message, link=event.link)
+            for event in events
+            for recipient_id, message in event.recipient_messages
+            if recipient_id in existing
+        ]
+        Notification.objects.bulk_create(notifications, batch_size=1000)
+        publish_notifications_later(notifications)
+        adjust_unread_notifications(Counter(notification.recipient_id for notification in notifications))
+        NotificationOutbox.objects.filter(pk__in=[event.pk for event in events]).delete()
+
+    logger.info('notification outbox events=%d notifications=%d', len(events), len(notifications))
+    return len(events), len(notifications)
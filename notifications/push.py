@@ -0,0 +1,163 @@
+import json
+import logging
+import socket
+import threading
+import time
+from collections import deque
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from attendance.broker import RESYNC, Broker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NOTIFICATION_PUSH = {
+    'BACKEND': 'attendance.broker.Broker',
+    'OPTIONS': {},
+}
+# 中継サーバーとの接続が切れたときに再接続するまでの秒数
+RELAY_RETRY_SECONDS = 1
+# 中継サーバーへの送信を待つ上限（秒）。詰まった場合はこのプロセス内だけに配る
+RELAY_SEND_TIMEOUT = 2
+# 中継サーバーに接続するまで溜めておくイベントの上限（超えた分はこのプロセス内だけに配る）
+RELAY_PENDING_LIMIT = 1000
+
+
+def get_push_settings():
+    return {**DEFAULT_NOTIFICATION_PUSH, **getattr(settings, 'NOTIFICATION_PUSH', {})}
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+class RelayBroker(Broker):
+    """
+    複数のワーカープロセスで動かす場合の Broker。
+    publish は run_push_relay コマンドの中継サーバーへ送り、中継サーバーが全プロセスへ配り直したイベントを
+    各プロセスのバックグラウンドスレッドが受け取って、自分のプロセスの購読へ配る。
+    起動直後や再接続中に publish したイベントは RELAY_PENDING_LIMIT 件まで溜め、接続したときに中継サーバーへ送る
+    （接続前の最初のイベントが他のプロセスへ届かなくならないように）。上限を超えた分はこのプロセスの購読にだけ配る。
+    """
+
+    def __init__(self, address='127.0.0.1:8765'):
+        super().__init__()
+        self.address = parse_address(address)
+        self._send_lock = threading.Lock()
+        self._socket = None
+        self._reader = None
+        self._pending = deque()
+
+    def _start(self):
+        with self._send_lock:
+            if self._reader is None:
+                self._reader = threading.Thread(target=self._run, name='notification-relay', daemon=True)
+                self._reader.start()
+
+    def _run(self):
+        while True:
+            try:
+                sock = socket.create_connection(self.address, timeout=RELAY_SEND_TIMEOUT)
+            except OSError:
+                time.sleep(RELAY_RETRY_SECONDS)
+                continue
+            with self._send_lock:
+                try:
+                    # 接続するまでに溜めたイベントを先に送る
+                    if self._pending:
+                        sock.sendall(b''.join(self._pending))
+                        self._pending.clear()
+                except OSError as e:
+                    logger.warning('notification relay send failed: %s', e)
+                    sock.close()
+                    time.sleep(RELAY_RETRY_SECONDS)
+                    continue
+                self._socket = sock
+            # 切断中のイベントは届いていないため、購読中の接続には取り直させる
+            self._deliver_all(RESYNC)
+            try:
+                self._read(sock)
+            except OSError as e:
+                logger.warning('notification relay disconnected: %s', e)
+            finally:
+                with self._send_lock:
+                    self._socket = None
+                sock.close()
+            time.sleep(RELAY_RETRY_SECONDS)
+
+    def _read(self, sock):
+        buffer = b''
+        while True:
+            try:
+                chunk = sock.recv(65536)
+            except TimeoutError:
+                continue
+            if not chunk:
+                return
+            *lines, buffer = (buffer + chunk).split(b'\n')
+            for line in lines:
+                try:
+                    key, event = json.loads(line)
+                except ValueError:
+                    continue
+                super().publish(key, event)
+
+    def _deliver_all(self, event):
+        with self._lock:
+            subscriptions = {subscription for subscriptions in self._subscriptions.values() for subscription in subscriptions}
+        for subscription in subscriptions:
+            subscription.put(event)
+
+    def subscribe(self, keys):
+        self._start()
+        return super().subscribe(keys)
+
+    def publish(self, key, event):
+        self._start()
+        line = json.dumps([key, event], ensure_ascii=False).encode() + b'\n'
+        with self._send_lock:
+            if self._socket is None:
+                if len(self._pending) < RELAY_PENDING_LIMIT:
+                    self._pending.append(line)
+                    return 0
+            else:
+                try:
+                    self._socket.sendall(line)
+                    return 0
+                except OSError as e:
+                    logger.warning('notification relay send failed: %s', e)
+        return super().publish(key, event)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def notification_broker():
+    """NOTIFICATION_PUSH の BACKEND で指定した Broker（プロセスごとに1つ）"""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            push = get_push_settings()
+            _broker = import_string(push['BACKEND'])(**push['OPTIONS'])
+        return _broker
+
+
+def publish_notifications_later(notifications):
+    """作成・更新した通知を、コミット後に受信者の接続へ配る"""
+    notification_broker().publish_later(
+        (notification.recipient_id, {
+            'type': 'notification',
+            'message': notification.message,
+            'link': notification.link,
+            'count': notification.count,
+            'created_at': timezone.localtime(notification.created_at).strftime('%Y/%m/%d %H:%M'),
+        })
+        for notification in notifications
+    )
+
+
+def publish_unread_later(user_ids):
+    """未読件数が変わったことを、コミット後に受信者の接続へ知らせる（件数は接続側で読む）"""
+    notification_broker().publish_later((user_id, {'type': 'unread'}) for user_id in user_ids)
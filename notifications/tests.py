@@ -1,3 +1,317 @@
-from django.test import TestCase
+import asyncio
+import io
+import socket
+import threading
+from datetime import timedelta
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from attendance.broker import RESYNC, sse
+from .counters import aunread_notification_count, unread_notification_count
+from .models import Notification, NotificationOutbox, UnreadNotificationCounter
+from .push import RelayBroker
+from .utils import INBOX_ORDERING, coalesce_notification, create_notifications, mark_inbox_read
+from .views import notification_stream
 
-# Create your tests here.
+CustomUser = get_user_model()
+
+
+class UnreadNotificationCountTests(TestCase):
+    """未読通知の件数"""
+
+    def setUp(self):
+        cache.clear()
+        self.sender = CustomUser.objects.create_user(username='sender', employee_number='E0001', full_name='送信 太郎')
+        self.recipient = CustomUser.objects.create_user(
+            username='recipient', password='password', employee_number='E0002', full_name='受信 花子',
+        )
+
+    def test_count_follows_counter_row(self):
+        create_notifications(self.sender, {self.recipient.pk: '申請が届きました。'}, '/')
+        self.assertEqual(unread_notification_count(self.recipient.pk), 1)
+        # 他のプロセスが更新した件数も、キャッシュを経由せずにすぐ読める
+        UnreadNotificationCounter.objects.filter(user=self.recipient).update(count=3)
+        self.assertEqual(unread_notification_count(self.recipient.pk), 3)
+        self.assertEqual(async_to_sync(aunread_notification_count)(self.recipient.pk), 3)
+
+    def test_badge_reflects_mark_read(self):
+        create_notifications(self.sender, {self.recipient.pk: '申請が届きました。'}, '/')
+        self.client.login(username='recipient', password='password')
+        response = self.client.get(reverse('notifications:notification_list'))
+        self.assertEqual(response.context['unread_notification_count'], 1)
+
+        mark_inbox_read(self.recipient)
+        response = self.client.get(reverse('notifications:notification_list'))
+        self.assertEqual(response.context['unread_notification_count'], 0)
+        self.assertFalse(Notification.objects.filter(is_read=False).exists())
+
+
+class NotificationInboxTests(TestCase):
+    """通知一覧のページ送りと一括操作"""
+
+    def setUp(self):
+        cache.clear()
+        self.sender = CustomUser.objects.create_user(username='sender', employee_number='E0001', full_name='送信 太郎')
+        self.recipient = CustomUser.objects.create_user(
+            username='recipient', password='password', employee_number='E0002', full_name='受信 花子',
+        )
+        self.other = CustomUser.objects.create_user(username='other', employee_number='E0003', full_name='受信 次郎')
+        for index in range(45):
+            create_notifications(self.sender, {self.recipient.pk: f'通知 {index}', self.other.pk: f'通知 {index}'}, '/')
+        # 作成日時が同じ通知がページの境目をまたぐようにし、一部を既読にする
+        base = timezone.now() - timedelta(days=1)
+        for index, pk in enumerate(Notification.objects.filter(recipient=self.recipient).values_list('pk', flat=True)):
+            Notification.objects.filter(pk=pk).update(created_at=base + timedelta(minutes=index // 4))
+        pks = list(Notification.objects.filter(recipient=self.recipient).values_list('pk', flat=True))
+        mark_inbox_read(self.recipient, pks[::3])
+        self.url = reverse('notifications:notification_list')
+        self.client.login(username='recipient', password='password')
+
+    def expected(self, **filters):
+        return list(
+            Notification.objects.filter(recipient=self.recipient, **filters).order_by(*INBOX_ORDERING).values_list(
+                'pk', flat=True,
+            )
+        )
+
+    def walk(self, status):
+        pages = []
+        params = {'status': status}
+        while True:
+            page = self.client.get(self.url, params).context['cursor_page']
+            pages.append(page)
+            if not page.next_cursor:
+                return pages
+            params = {'status': status, 'cursor': page.next_cursor}
+
+    def assertCounter(self):
+        for user in (self.recipient, self.other):
+            self.assertEqual(
+                unread_notification_count(user.pk), Notification.objects.filter(recipient=user, is_read=False).count(),
+            )
+
+    def test_cursor_pages(self):
+        for status, filters in (('all', {}), ('unread', {'is_read': False}), ('read', {'is_read': True})):
+            with self.subTest(status=status):
+                pages = self.walk(status)
+                self.assertEqual([notification.pk for page in pages for notification in page], self.expected(**filters))
+                # 前のページへ戻っても同じ通知が並ぶ
+                for previous, page in zip(pages, pages[1:]):
+                    response = self.client.get(self.url, {'status': status, 'cursor': page.previous_cursor})
+                    self.assertEqual(
+                        [notification.pk for notification in response.context['cursor_page']],
+                        [notification.pk for notification in previous],
+                    )
+
+    def test_actions_keep_unread_counter(self):
+        self.assertCounter()
+        unread = self.expected(is_read=False)
+        others = list(Notification.objects.filter(recipient=self.other).values_list('pk', flat=True)[:2])
+
+        # 他人の通知を選んでも既読にしない
+        self.client.post(self.url, {
+            'action': 'mark_selected_read', 'selected_ids': [*map(str, unread[:5]), *map(str, others), 'x'],
+        })
+        self.assertEqual(Notification.objects.filter(pk__in=unread[:5], is_read=True).count(), 5)
+        self.assertFalse(Notification.objects.filter(pk__in=others, is_read=True).exists())
+        self.assertCounter()
+
+        self.client.post(self.url, {'delete_id': unread[5]})
+        self.assertFalse(Notification.objects.filter(pk=unread[5]).exists())
+        self.assertCounter()
+        self.assertEqual(self.client.post(self.url, {'delete_id': others[0]}).status_code, 404)
+
+        self.client.post(self.url, {'action': 'delete_read'})
+        self.assertFalse(Notification.objects.filter(recipient=self.recipient, is_read=True).exists())
+        self.assertCounter()
+
+        self.client.post(self.url, {'action': 'mark_all_read'})
+        self.assertEqual(unread_notification_count(self.recipient.pk), 0)
+        self.assertCounter()
+
+class PurgeNotificationsTests(TestCase):
+    """保存期間・上限を超えた通知の削除"""
+
+    def setUp(self):
+        cache.clear()
+        self.sender = CustomUser.objects.create_user(username='sender', employee_number='E0001', full_name='送信 太郎')
+        self.recipients = CustomUser.objects.bulk_create([
+            CustomUser(username=f'recipient{i}', employee_number=f'R{i:04d}', full_name=f'受信 {i}')
+            for i in range(4)
+        ])
+        for index in range(6):
+            create_notifications(
+                self.sender, {recipient.pk: f'通知 {index}' for recipient in self.recipients}, '/',
+            )
+        old = timezone.now() - timedelta(days=200)
+        # 古い既読・古い未読の通知を混ぜる
+        for recipient in self.recipients:
+            pks = list(Notification.objects.filter(recipient=recipient).order_by('pk').values_list('pk', flat=True))
+            Notification.objects.filter(pk__in=pks[:3]).update(created_at=old)
+        mark_inbox_read(self.recipients[0])
+        mark_inbox_read(self.recipients[1], pks=Notification.objects.filter(
+            recipient=self.recipients[1], created_at=old,
+        ).values_list('pk', flat=True)[:2])
+
+    def assertCountersMatch(self):
+        for recipient in self.recipients:
+            self.assertEqual(
+                unread_notification_count(recipient.pk),
+                Notification.objects.filter(recipient=recipient, is_read=False).count(),
+            )
+
+    def test_counters_stay_consistent(self):
+        self.assertCountersMatch()
+        with CaptureQueriesContext(connection) as captured:
+            call_command(
+                'purge_notifications', '--read-days', '90', '--max-per-user', '2', '--chunk-size', '3',
+                stdout=io.StringIO(),
+            )
+        self.assertCountersMatch()
+        self.assertEqual(
+            [Notification.objects.filter(recipient=recipient).count() for recipient in self.recipients], [2] * 4,
+        )
+        self.assertFalse(
+            Notification.objects.filter(is_read=True, created_at__lt=timezone.now() - timedelta(days=90)).exists()
+        )
+
+        # 期限切れの通知は受信者ごとではなく、まとめて1クエリで探す
+        table = Notification._meta.db_table
+        expired_reads = [
+            query['sql'] for query in captured.captured_queries
+            if query['sql'].startswith('SELECT') and f'FROM "{table}"' in query['sql'] and '"created_at" <' in query['sql']
+        ]
+        self.assertEqual(len(expired_reads), 1)
+
+@override_settings(NOTIFICATION_OUTBOX={'ENABLED': True})
+class NotificationOutboxTests(TestCase):
+    """送信待ちからの通知の反映"""
+
+    def setUp(self):
+        cache.clear()
+        self.sender = CustomUser.objects.create_user(username='sender', employee_number='E0001', full_name='送信 太郎')
+        self.recipient = CustomUser.objects.create_user(username='recipient', employee_number='E0002', full_name='受信 花子')
+        self.retired = CustomUser.objects.create_user(username='retired', employee_number='E0003', full_name='退職 次郎')
+
+    def test_drain_continues_past_batches_without_recipients(self):
+        create_notifications(self.sender, {self.retired.pk: '申請が届きました。'}, '/')
+        create_notifications(self.sender, {self.recipient.pk: '申請が届きました。'}, '/')
+        self.assertFalse(Notification.objects.exists())
+        self.retired.delete()
+
+        out = io.StringIO()
+        call_command('drain_notification_outbox', '--once', '--batch-size', '1', stdout=out)
+        self.assertIn('1 件の通知を反映しました。', out.getvalue())
+        self.assertFalse(NotificationOutbox.objects.exists())
+        self.assertEqual(list(Notification.objects.values_list('recipient_id', flat=True)), [self.recipient.pk])
+        self.assertEqual(unread_notification_count(self.recipient.pk), 1)
+
+
+class CoalescedNotificationTests(TestCase):
+    """種別ごとにまとめる通知とメールのダイジェスト"""
+
+    def setUp(self):
+        cache.clear()
+        self.sender = CustomUser.objects.create_user(username='sender', employee_number='E0001', full_name='送信 太郎')
+        self.recipient = CustomUser.objects.create_user(
+            username='recipient', employee_number='E0002', full_name='受信 花子', email='recipient@example.com',
+        )
+
+    def coalesce(self, kind='application'):
+        coalesce_notification(
+            self.sender, self.recipient, kind, '新しい申請が届きました。', '新しい申請が {count} 件届きました。', '/applications/',
+        )
+
+    def test_repeated_notifications_share_one_unread_row(self):
+        for _ in range(3):
+            self.coalesce()
+        notification = Notification.objects.get()
+        self.assertEqual((notification.count, notification.message), (3, '新しい申請が 3 件届きました。'))
+        self.assertEqual(unread_notification_count(self.recipient.pk), 1)
+
+        # 既読にした後は新しい行を作る
+        mark_inbox_read(self.recipient)
+        self.coalesce()
+        self.assertEqual(Notification.objects.filter(is_read=False).get().count, 1)
+        self.assertEqual(unread_notification_count(self.recipient.pk), 1)
+
+    def test_digest_sends_each_update_once(self):
+        self.coalesce()
+        self.coalesce('attendance')
+        create_notifications(self.sender, {self.recipient.pk: 'まとめない通知'}, '/')
+
+        call_command('send_notification_digest', stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['recipient@example.com'])
+        self.assertIn('新しい申請が届きました。', mail.outbox[0].body)
+        self.assertNotIn('まとめない通知', mail.outbox[0].body)
+
+        call_command('send_notification_digest', stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 1)
+
+        # まとめた通知が更新されたら、次のダイジェストで送る
+        self.coalesce()
+        call_command('send_notification_digest', stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertIn('新しい申請が 2 件届きました。', mail.outbox[1].body)
+        # 送信済みで更新のない種別の通知は含めない
+        self.assertEqual(mail.outbox[1].body.count('・'), 1)
+
+
+class RelayBrokerTests(SimpleTestCase):
+    """複数プロセス間の通知のプッシュ（中継サーバー経由）"""
+
+    def free_port(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    def start_relay(self, port):
+        """受け取った行をそのまま返す中継サーバー（接続1つ分）"""
+        server = socket.create_server(('127.0.0.1', port))
+        self.addCleanup(server.close)
+        received = []
+
+        def run():
+            client, _ = server.accept()
+            with client:
+                while data := client.recv(65536):
+                    received.append(data)
+                    client.sendall(data)
+
+        threading.Thread(target=run, daemon=True).start()
+        return received
+
+    async def test_events_published_before_connecting_are_relayed(self):
+        port = self.free_port()
+        broker = RelayBroker(f'127.0.0.1:{port}')
+        async with broker.subscribe([1]) as subscription:
+            # 中継サーバーへの接続前の publish は溜めておき、このプロセスにもまだ配らない
+            self.assertEqual(broker.publish(1, {'type': 'unread'}), 0)
+            received = self.start_relay(port)
+            event = RESYNC
+            while event is RESYNC:
+                event = await asyncio.wait_for(subscription.get(), 10)
+        broker._socket.shutdown(socket.SHUT_RDWR)
+        self.assertEqual(event, {'type': 'unread'})
+        self.assertEqual(b''.join(received), b'[1, {"type": "unread"}]\n')
+
+
+class NotificationStreamTests(TestCase):
+    """通知の SSE"""
+
+    async def test_first_count_is_read_after_subscribing(self):
+        sender = await CustomUser.objects.acreate(username='sender', employee_number='E0001', full_name='送信 太郎')
+        recipient = await CustomUser.objects.acreate(username='recipient', employee_number='E0002', full_name='受信 花子')
+        # 接続の受付（認証時の件数の読み込み）と購読の開始の間に届いた通知も数える
+        stream = notification_stream(recipient.pk)
+        await sync_to_async(create_notifications)(sender, {recipient.pk: '申請が届きました。'}, '/')
+        self.assertEqual(await anext(stream), sse('unread', {'count': 1}))
+        await stream.aclose()
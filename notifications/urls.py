@@ -5,4 +5,8 @@ app_name = 'notifications'
 
 urlpatterns = [
     path('notifications/', views.NotificationListView.as_view(), name='notification_list'),
+    # ASGI で運用する場合の非同期版
+    path('notifications/async/', views.AsyncNotificationListView.as_view(), name='notification_list_async'),
+    # 新しい通知と未読件数のプッシュ（Server-Sent Events）
+    path('notifications/stream/', views.NotificationStreamView.as_view(), name='notification_stream'),
 ]
\ No newline at end of file
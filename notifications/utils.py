@@ -1,10 +1,136 @@
+from collections import Counter
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+from django.db.models.lookups import Exact
 from django.urls import reverse
+from django.utils import timezone
 from .models import Notification
+from .counters import adjust_unread_notifications, unread_deltas
+from .outbox import enqueue_notifications, outbox_enabled
+from .push import publish_notifications_later
+
+# 通知一覧の並び順（シーク方式のページ送りのため一意になる id を最後に含める）
+INBOX_ORDERING = ('-created_at', '-id')
+
+def inbox(user):
+    """通知一覧に表示する通知（新しい順）"""
+    return Notification.objects.filter(recipient=user).order_by(*INBOX_ORDERING)
+
+def read_status(read):
+    """
+    既読・未読の条件。is_read=False は NOT "is_read" と出力され、
+    SQLite が (受信者, 既読, 作成日時) のインデックスの既読列で絞り込めないため等号で比較する
+    """
+    return Exact(F('is_read'), Value(read))
+
+def inbox_sources(user, status=None):
+    """
+    通知一覧のページ送りに使うクエリセットのリスト。
+    すべて表示する場合も未読・既読に分け、それぞれ (受信者, 既読, 作成日時) のインデックスを
+    作成日時の順に読んでから並べ直すため、受信件数によらず1ページ分の行だけを読む。
+    """
+    unread = inbox(user).filter(read_status(False))
+    read = inbox(user).filter(read_status(True))
+    if status == 'unread':
+        return [unread]
+    if status == 'read':
+        return [read]
+    return [unread, read]
+
+def unread_notifications(user):
+    return Notification.objects.filter(recipient=user, is_read=False)
 
 def create_notification(sender, recipient, message, link_name, pk):
-    Notification.objects.create(
-        sender=sender,
-        recipient=recipient,
-        message=message,
-        link=reverse(link_name, kwargs={'pk': pk})
-    )
\ No newline at end of file
+    create_notifications(sender, {recipient.pk: message}, reverse(link_name, kwargs={'pk': pk}))
+
+def create_notifications(sender, recipient_messages, link):
+    """
+    受信者IDとメッセージの組から通知をまとめて作成する（INSERT は1文）。
+    NOTIFICATION_OUTBOX を有効にした環境では送信待ちに1行追加するだけで、通知は drain_notification_outbox が作成する。
+    """
+    if outbox_enabled():
+        enqueue_notifications(sender, recipient_messages, link)
+        return
+    with transaction.atomic():
+        notifications = Notification.objects.bulk_create([
+            Notification(sender=sender, recipient_id=recipient_id, message=message, link=link)
+            for recipient_id, message in recipient_messages.items()
+        ])
+        publish_notifications_later(notifications)
+        adjust_unread_notifications(Counter(recipient_messages.keys()))
+
+def coalesce_notification(sender, recipient, kind, message, summary, link):
+    """
+    受信者・種別ごとに未読の通知を1行にまとめる。未読の行がなければ message で作成し、
+    あれば件数を1増やして summary（{count} に件数が入る）と最新の詳細画面・日時に更新する。
+    行数は受信者ごとの種別の数で頭打ちになり、未読件数は行を作成したときだけ増える。
+    """
+    with transaction.atomic():
+        unread = Notification.objects.select_for_update().filter(read_status(False), recipient=recipient, kind=kind)
+        existing = unread.values_list('pk', 'count').first()
+        if existing is None:
+            try:
+                with transaction.atomic():
+                    notification = Notification.objects.create(
+                        sender=sender, recipient=recipient, kind=kind, message=message, link=link,
+                    )
+            except IntegrityError:
+                # 同時に作成された行があれば、そちらへまとめる
+                existing = unread.values_list('pk', 'count').get()
+            else:
+                publish_notifications_later([notification])
+                adjust_unread_notifications({recipient.pk: 1})
+                return
+        pk, count = existing
+        notification = Notification(
+            pk=pk,
+            sender=sender,
+            recipient=recipient,
+            kind=kind,
+            message=summary.format(count=count + 1),
+            link=link,
+            count=count + 1,
+            created_at=timezone.now(),
+        )
+        Notification.objects.filter(pk=pk).update(
+            sender=sender,
+            message=notification.message,
+            link=link,
+            count=notification.count,
+            created_at=notification.created_at,
+        )
+        publish_notifications_later([notification])
+
+def mark_notifications_read(queryset):
+    """queryset の未読の通知を既読にし、受信者ごとの未読件数を減らす（既読にした件数を返す）"""
+    with transaction.atomic():
+        deltas = unread_deltas(queryset)
+        updated = queryset.filter(is_read=False).update(is_read=True)
+        adjust_unread_notifications(deltas)
+    return updated
+
+def delete_notifications(queryset):
+    """queryset の通知を削除し、削除した未読の分だけ未読件数を減らす（削除した件数を返す）"""
+    with transaction.atomic():
+        deltas = unread_deltas(queryset)
+        deleted, _ = queryset.delete()
+        adjust_unread_notifications(deltas)
+    return deleted
+
+def mark_inbox_read(user, pks=None):
+    """
+    user の未読の通知（pks を指定した場合はそのうちの該当分）を UPDATE 1文で既読にする。
+    受信者が1人なので、既読にした件数をそのまま未読件数から引く（既読にした件数を返す）。
+    """
+    with transaction.atomic():
+        targets = unread_notifications(user)
+        if pks is not None:
+            targets = targets.filter(pk__in=pks)
+        updated = targets.update(is_read=True)
+        adjust_unread_notifications({user.pk: -updated})
+    return updated
+
+def delete_read_notifications(user):
+    """user の既読の通知を DELETE 1文で削除する（未読件数は変わらない）"""
+    deleted, _ = Notification.objects.filter(recipient=user, is_read=True).delete()
+    return deleted
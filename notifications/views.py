@@ -1,37 +1,147 @@
-from django.views.generic import ListView
-from django.shortcuts import get_object_or_404, redirect
+import asyncio
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.generic import ListView, View
+from django.shortcuts import get_object_or_404, redirect, render
 from django.contrib import messages
+from attendance.broker import RESYNC, sse
+from attendance.pagination import paginate_keyset
+from .counters import aunread_notification_count
 from .models import Notification
+from .push import notification_broker
+from .utils import INBOX_ORDERING, delete_notifications, delete_read_notifications, inbox_sources, mark_inbox_read
 from django.contrib.auth.mixins import LoginRequiredMixin
+from accounts.mixins import AsyncLoginRequiredMixin
+
+INBOX_STATUSES = ('all', 'unread', 'read')
+# 接続を保つためのコメントを送る間隔（秒）
+PUSH_KEEPALIVE = 15
+# ログアウトなどを反映するため、この秒数で接続を閉じて再接続させる
+PUSH_STREAM_MAX_SECONDS = 60 * 30
+# ASGI 以外（WSGI）ではストリームを保てないため、未読件数を返してこの間隔で再接続させる
+PUSH_POLL_RETRY_MS = 30 * 1000
+
+def inbox_status(params):
+    status = params.get('status', 'all')
+    return status if status in INBOX_STATUSES else 'all'
+
+def inbox_context(status, cursor_page):
+    return {
+        'cursor_page': cursor_page,
+        'selected_status': status,
+        'status_query': f'&status={status}' if status != 'all' else '',
+    }
+
+async def notification_stream(user_id):
+    """
+    最初に未読件数、以降は自分宛ての通知と未読件数の変化を SSE で送る。
+    件数はイベントに含めず、受け取った接続が集計行から読み直す（送る側は受信者の接続の有無を知らなくてよい）。
+    最初の件数は購読を始めてから読み、その間の変化を取りこぼさないようにする。
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + PUSH_STREAM_MAX_SECONDS
+    async with notification_broker().subscribe([user_id]) as subscription:
+        yield sse('unread', {'count': await aunread_notification_count(user_id)})
+        while loop.time() < deadline:
+            try:
+                event = await asyncio.wait_for(subscription.get(), PUSH_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if event is not RESYNC and event['type'] == 'notification':
+                yield sse('notification', event)
+            yield sse('unread', {'count': await aunread_notification_count(user_id)})
+
+def apply_inbox_action(request):
+    """通知一覧のフォームの操作を実行する（一括操作はいずれも1文の UPDATE / DELETE）"""
+    user = request.user
+    action = request.POST.get('action')
+
+    if 'read_id' in request.POST:
+        notification = get_object_or_404(
+            Notification,
+            pk=request.POST['read_id'],
+            recipient=user
+        )
+        mark_inbox_read(user, [notification.pk])
+        messages.success(request, '通知を既読にしました。')
+
+    elif 'delete_id' in request.POST:
+        notification = get_object_or_404(
+            Notification,
+            pk=request.POST['delete_id'],
+            recipient=user,
+        )
+        delete_notifications(Notification.objects.filter(pk=notification.pk))
+        messages.info(request, '通知を削除しました。')
+
+    elif action == 'mark_selected_read':
+        pks = [pk for pk in request.POST.getlist('selected_ids') if pk.isdigit()]
+        if not pks:
+            messages.warning(request, '既読にする通知を選択してください。')
+        else:
+            updated = mark_inbox_read(user, pks)
+            messages.success(request, f'{updated} 件の通知を既読にしました。')
+
+    elif action == 'mark_all_read':
+        updated = mark_inbox_read(user)
+        messages.success(request, f'{updated} 件の通知を既読にしました。')
+
+    elif action == 'delete_read':
+        deleted = delete_read_notifications(user)
+        messages.info(request, f'既読の通知 {deleted} 件を削除しました。')
 
 class NotificationListView(LoginRequiredMixin, ListView):
     modell = Notification
     template_name = 'notifications/notification_list.html'
+    paginate_by = 20
 
     def get_queryset(self):
-        return Notification.objects.filter(
-            recipient=self.request.user,
-            ).order_by('-created_at')
-    
+        return inbox_sources(self.request.user, inbox_status(self.request.GET))
+
+    def paginate_queryset(self, queryset, page_size):
+        # (作成日時, id) をキーにしたシーク方式で、受信件数が多くても先頭ページと同じコストで読む
+        self.cursor_page = paginate_keyset(queryset, INBOX_ORDERING, self.request.GET.get('cursor'), page_size)
+        return (None, None, self.cursor_page.object_list, False)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(inbox_context(inbox_status(self.request.GET), self.cursor_page))
+        return context
+
     def post(self, request, *args, **kwargs):
-        if 'read_id' in request.POST:
-            notification = get_object_or_404(
-                Notification,
-                pk=request.POST['read_id'],
-                recipient=request.user
-            )
-            notification.is_read = True
-            notification.save()
-            messages.success(request, '通知を既読にしました。')
-
-        elif 'delete_id' in request.POST:
-            notification = get_object_or_404(
-                Notification,
-                pk=request.POST['delete_id'],
-                recipient=request.user,
-            )
-            notification.delete()
-            messages.info(request, '通知を削除しました。')
-        
+        apply_inbox_action(request)
         return redirect('notifications:notification_list')
 
+class AsyncNotificationListView(AsyncLoginRequiredMixin, View):
+    """NotificationListView の非同期版（ASGI で動かす場合にスレッドを占有しない）"""
+    template_name = NotificationListView.template_name
+
+    async def get(self, request, *args, **kwargs):
+        status = inbox_status(request.GET)
+        cursor_page = await sync_to_async(paginate_keyset)(
+            inbox_sources(request.user, status), INBOX_ORDERING, request.GET.get('cursor'), NotificationListView.paginate_by,
+        )
+        context = {'object_list': cursor_page.object_list, **inbox_context(status, cursor_page)}
+        return render(request, self.template_name, context)
+
+    async def post(self, request, *args, **kwargs):
+        await sync_to_async(apply_inbox_action)(request)
+        return redirect('notifications:notification_list_async')
+
+class NotificationStreamView(AsyncLoginRequiredMixin, View):
+    """自分宛ての新しい通知と未読件数を Server-Sent Events で送る（全画面の通知バッジが購読する）"""
+
+    async def get(self, request, *args, **kwargs):
+        if not isinstance(request, ASGIRequest):
+            # WSGI ではワーカーを占有し続けないよう、未読件数を返して一定間隔で再接続させる
+            data = sse('unread', {'count': request.unread_notification_count}, retry=PUSH_POLL_RETRY_MS)
+            response = HttpResponse(data, content_type='text/event-stream')
+        else:
+            stream = notification_stream(request.user.pk)
+            response = StreamingHttpResponse(stream, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # リバースプロキシでバッファリングさせない
+        response['X-Accel-Buffering'] = 'no'
+        return response